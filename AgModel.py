@@ -39,6 +39,8 @@
 import os
 import sys
 import time
+import queue
+import threading
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -92,6 +94,9 @@ class Settings(eg.EgStore):
         self.DomesticatedCerealHandlingCost = 0.00001        ## Enter the handling costs for domestic Cereal (hours handling time expended per seed once encountered)
         # SIMULATION CONTROLS
         self.Years = 3000        ## Enter the number of years for which to run the simulation
+        # DISPLAY CONTROLS
+        self.RedrawInterval = 100    ## Minimum time (milliseconds) between redraws of the real-time plot
+        self.RedrawYears = 1        ## Minimum number of new simulated years between redraws of the real-time plot
 
         self.filename = filename  # this is required
 
@@ -107,6 +112,153 @@ def deathdealer(p, f, n):
     deaths = np.round(np.random.normal(p,f)*n)
     return(deaths)
 
+def simulate(People, Prey, patchdens, patchprop, records, RealTimeText):
+    '''Run the simulation from People people and Prey prey. The patch densities and domestic proportions of every year go in the columns of the preallocated arrays patchdens and patchprop, and the general stats of every year are put on the queue records as one tuple (in the order of the general stats file), followed by None when the run is over. If the run fails, the exception is put on the queue before the None, so that the main thread can raise it. This runs in a worker thread, so that the plot window stays responsive while the simulation runs'''
+    try:
+        simulate_years(People, Prey, patchdens, patchprop, records, RealTimeText)
+    except Exception as error:
+        records.put(error) # hand the failure to the main thread, rather than letting it pass for the end of the run
+    finally:
+        records.put(None) # (also if the run failed, so that the plot doesn't wait forever)
+
+def simulate_years(People, Prey, patchdens, patchprop, records, RealTimeText):
+    '''The yearly loop of simulate()'''
+    Cerealdens = np.full(int(Cereal), CerealDensity, dtype=float) # set up preallocated arrays for our Cereal patches. They will all start out the same.
+    Cerealprop = np.full(int(Cereal), WildToDomesticatedProportion, dtype=float)
+    Cerealnew = np.empty(int(Cereal), dtype=float) # scratch arrays for the yearly patch update, so that it doesn't have to allocate anything
+    Cerealkeep = np.empty(int(Cereal), dtype=bool)
+    patchdens[:, 0] = Cerealdens # update with year 0 data
+    patchprop[:, 0] = Cerealprop # update with year 0 data
+    Domesticated = 1 - WildToDomesticatedProportion # the proportion of domestic-type Cereal last year
+    for year in range(1,Years+1):        #this is the outer loop, that does things at an annual resolution, counting the years down for the simulation
+        if RealTimeText: print("Year: %s Human Population: %s" % (year, People))
+        kcalneed = People * HumanKcal        # find the number of kcals needed by the band this year
+        timebudget = People * ForagingHours       # find the time budget for the band this year
+        Prey_now = Prey            #set up a variable to track Prey population exploitation this year
+        Cereal_now = Cereal        #set up a variable to track Cereal patch exploitation this year
+        eatCereal = 0        #set up data container to count how many Cereal patches we ate this year
+        eatPrey = 0        #set up data container to count how many Prey we ate this year
+        while kcalneed > 0:        #this is the inner loop, doing foraging within the year, until kcal need is satisfied
+            if Prey_now <= 0 and Cereal_now <= 0:
+                if RealTimeText: print("ate everything!!!")
+                break
+            #first calculate info about the current state of Cereal
+            WildToDomesticatedProportion_now = np.mean(Cerealprop[0:Cereal_now]) if Cereal_now > 0 else np.nan #Note that we are taking the mean proportion across all remaining Cereal patches in the data array.
+            CerealDensity_now = np.mean(Cerealdens[0:Cereal_now]) if Cereal_now > 0 else np.nan #Note that we are taking the mean number of individuals per patch across all remaining patches in the Cereal data array. Note that we are reading off of the right end of the array list.
+            CerealReturns = (WildCerealReturns * WildToDomesticatedProportion_now) + (DomesticatedCerealReturns * (1 - WildToDomesticatedProportion_now))        #determine the actual kcal return for Cereal, based on the proportion of wild to domesticated.
+            CombinedCerealHandlingCost = (WildCerealHandlingCost * WildToDomesticatedProportion_now) + (DomesticatedCerealHandlingCost * (1 - WildToDomesticatedProportion_now))    #determine the actual handling time for Cereal, based on the proportion of wild to domesticated.
+            if Prey_now <= 0:
+                Preyscore = 0
+            else:
+                PreySearchCost_Now = PreySearchCost / (Prey_now / PreyDensity)        #find the actual search time for the amount of Prey at this time
+                if MinPreyEncountered >= MaxPreyEncountered:
+                    PreyEncountered_Now = MinPreyEncountered
+                else:
+                    PreyEncountered_Now = np.random.randint(MinPreyEncountered, MaxPreyEncountered)     # find how many prey are encountered at this time
+                Preyscore = PreyReturns / (PreySearchCost_Now + PreyHandlingCost)    #find the current return rate (kcal/hr) for Prey.
+            if Cereal_now <= 0:
+                Cerealscore = 0
+            else:
+                Cerealscore = (CerealReturns * CerealDensity_now ) / (CerealSearchCosts + (CombinedCerealHandlingCost *  CerealDensity_now))        #find the current return rate (kcal/hr for Cereal.
+            if np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Hunting prey is more profitable
+                if timebudget <= 0:
+                    if RealTimeText: print("Ran out of labor time this year")
+                    Preyscore = 0
+                    pass
+                if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
+                    if RealTimeText: print("Killed all the Prey available this year, will try to make up the remainder of the diet with Cereal")
+                    Preyscore = 0.
+                    pass
+                else:
+                    kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
+                    timebudget = timebudget - (PreySearchCost_Now + (PreyHandlingCost * PreyEncountered_Now))
+                    eatPrey = eatPrey + PreyEncountered_Now
+                    Prey_now = Prey_now - PreyEncountered_Now
+            elif np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Harvesting cereal is more profitable
+                if timebudget <= 0:
+                    if RealTimeText: print("Ran out of labor time this year")
+                    Cerealscore = 0
+                    pass
+                if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
+                    if RealTimeText: print("Harvested all available Cereal this year, will try to make up the remainder of the diet with Prey.")
+                    Cerealscore = 0
+                    pass
+                else:
+                    kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
+                    timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
+                    eatCereal = eatCereal + 1
+                    Cereal_now = Cereal_now - 1
+            else: # both equally profitable, so randomly choose hunting or harvesting
+                if np.random.randint(0,1) == 1:
+                    if timebudget <= 0:
+                        if RealTimeText: print("Ran out of labor time this year")
+                        Preyscore = 0
+                        pass
+                    if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
+                        if RealTimeText: print("Killed all the Prey available this year, will try to make up the remainder of the diet with Cereal")
+                        Preyscore = 0.
+                        pass
+                    else:
+                        kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
+                        timebudget = timebudget - (PreySearchCost_Now + PreyHandlingCost)
+                        eatPrey = eatPrey + PreyEncountered_Now
+                        Prey_now = Prey_now - PreyEncountered_Now
+                else:
+                    if timebudget <= 0:
+                        if RealTimeText: print("Ran out of labor time this year")
+                        Cerealscore = 0
+                        pass
+                    if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
+                        if RealTimeText: print("Harvested all available Cereal this year, will try to make up the remainder of the diet with Prey.")
+                        Cerealscore = 0
+                        pass
+                    else:
+                        kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
+                        timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
+                        eatCereal = eatCereal + 1
+                        Cereal_now = Cereal_now - 1
+            if timebudget <= 0:        #check if they've run out of foraging time, and stop the loop if necessary.
+                if RealTimeText: print("Ran out of all foraging time for this year before gathering enough food.")
+                break
+            if Prey <= 0 and Cereal <= 0:    #check if they've run out of food, and stop the loop if necessary.
+                if RealTimeText: print("Ate all the Prey and all the Cereal this year before gathering enough food.")
+                break
+            if Preyscore <= 0 and Cerealscore <= 0:    #check if they've run out of food, and stop the loop if necessary.
+                if RealTimeText: print("Ate all the Prey and all the Cereal this year before gathering enough food.")
+                break
+        ####### Now that the band has foraged for a year, update human, Prey, and Cereal populations, and implement selection
+        if (People * HumanKcal) - kcalneed <= (People * HumanKcal * StarvationThreshold):     #Check if they starved this year and just die deaths if so
+            if RealTimeText: print("Starvation occurred.")
+            People = People - deathdealer(HumanDeathRate*2, HumanBirthDeathFilter, People)
+        else: #otherwise, balance births and deaths, and adjust the population accordingly
+            People = People + babymaker(HumanBirthRate, HumanBirthDeathFilter, People) - deathdealer(HumanDeathRate, HumanBirthDeathFilter, People)
+        if MaxPreyMigrants == 0:
+            PreyMigrantsNow = 0
+        else:
+            PreyMigrantsNow = np.random.randint(0, MaxPreyMigrants)
+        Prey = Prey_now + babymaker(PreyBirthRate, PreyBirthDeathFilter, Prey_now) - deathdealer(PreyDeathRate, PreyBirthDeathFilter, Prey_now) + PreyMigrantsNow #Adjust the Prey population by calculating the balance of natural births and deaths on the hunted population, and then add the migrants population
+        if People > MaximumPeople: People = MaximumPeople # don't allow human pop to exceed the limit we set
+        if Prey > MaxPrey: Prey = MaxPrey # don't allow Prey pop to exceed natural carrying capacity
+        #This part is a bit complicated. We are adjusting the proportions of wild to domestic Cereal in JUST the Cereal patches that were exploited this year. We are also adjusting the density of individuals in those patches. This is the effect of the "artificial selection" exhibited by humans while exploiting those patches. At the same time, we are implementing a "diffusion" of wild-type characteristics back to all the patches. If they are used, selection might outweigh diffusion. If they aren't being used, then just diffusion occurs. In this version of the model, diffusion is density dependent, and is adjusted by (lat year's) the proportion of domestic to non-domestic Cereals left in the population.
+        currentCerealDiffusionRate = np.random.normal(CerealDiffusionRate, (CerealDiffusionRate*SelectionDiffusionFilter)) * (1 - Domesticated)
+        currentCerealSelectionRate = np.random.normal(CerealSelectionRate, (CerealSelectionRate*SelectionDiffusionFilter))
+        exploited = min(max(int(eatCereal) - 1, 0), int(Cereal)) # patches are counted from 1, and patch x gets the selection treatment if x < eatCereal
+        np.add(Cerealdens[:exploited], CerealCultivationDensity, out=Cerealnew[:exploited])
+        np.subtract(Cerealdens[exploited:], CerealCultivationDensity, out=Cerealnew[exploited:])
+        np.logical_or(Cerealnew > MaxCerealDensity - CerealCultivationDensity, Cerealnew < CerealDensity + CerealCultivationDensity, out=Cerealkeep)
+        np.copyto(Cerealdens, Cerealnew, where=~Cerealkeep) # adjust the patch density array, but only if the value will stay between CerealDensity and MaxCerealDensity.
+        np.add(Cerealprop[:exploited], currentCerealDiffusionRate - currentCerealSelectionRate, out=Cerealnew[:exploited])
+        np.add(Cerealprop[exploited:], currentCerealDiffusionRate, out=Cerealnew[exploited:])
+        np.logical_or(Cerealnew > 1 - currentCerealDiffusionRate, Cerealnew < 0 + currentCerealSelectionRate, out=Cerealkeep)
+        np.copyto(Cerealprop, Cerealnew, where=~Cerealkeep) # adjust the selection coefficient array, but only if the value will stay between 1 and 0.
+
+        #update the patch time-series arrays with the current year's data
+        patchdens[:, year] = Cerealdens
+        patchprop[:, year] = Cerealprop
+        ######## Okay, now send this year's stats to the live plot
+        Domesticated = 1 - np.mean(Cerealprop)
+        records.put((year, People, (People * HumanKcal) - kcalneed, Prey, eatPrey, np.sum(Cerealdens)/1000., eatCereal, Domesticated, (np.mean(Cerealdens))/1000.))
+
 #Run setup routine
 # make/get the settings file
 settingsFilename = eg.fileopenbox("Choose a settings file to load/save model variables from. If there is no existing settings file, press 'Cancel'", "Settings", default='%s%s*.config' % (os.getcwd(), os.sep), filetypes=["*.config"])
@@ -302,6 +454,12 @@ if __name__ == "__main__":
         sys.exit(0)
     if choice == 2:
         RealTimePlotting = True
+        # ask how often to redraw the plot. Redrawing every year makes the plot, not the model, most of the run time.
+        fieldValues = eg.multenterbox("Set how often the real-time plot is redrawn. Longer intervals give faster runs.", "Plot updates", ["Minimum time between plot redraws (milliseconds)", "Minimum number of new simulated years between plot redraws"], [settings.RedrawInterval, settings.RedrawYears])
+        if fieldValues is not None:
+            settings.RedrawInterval = max(float(fieldValues[0]), 0.)
+            settings.RedrawYears = max(int(float(fieldValues[1])), 1)
+            settings.store()
     else:  # user chose Cancel
         RealTimePlotting = False
     if choice == 1 or choice == 2:
@@ -309,24 +467,12 @@ if __name__ == "__main__":
     else:
         RealTimeText= False
     ##### Setup the simulation
-    Cerealpatches = []
-    for patch in range(int(Cereal)): # set up a data container for our Cereal patches.
-        Cerealpatches.append([CerealDensity, WildToDomesticatedProportion]) # They will all start out the same.
-    Cereal_df = pd.DataFrame(Cerealpatches, columns=['CerealDensity','WildToDomesticatedProportion']) # turn this data container into a pandas dataframe for more efficient math and indexing
-    patchdens_ts = pd.DataFrame(index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))) # set up a blank pandas dataframe to catch patch density timeseries stats for possible output
-    patchprop_ts = pd.DataFrame(index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))) # set up a blank pandas dataframe to catch patch domestic proportion timeseries stats for possible output
-    patchdens_ts[0] = Cereal_df.CerealDensity # update with year 0 data
-    patchprop_ts[0] = Cereal_df.WildToDomesticatedProportion # update with year 0 data
-    # set up some individual data containers for the output stats and plots
-    yr = [0]
-    HumPop = [People]
-    HumanKcalPrey = [0]
-    PreyPop = [Prey]
-    CerealPop = [(Cereal * CerealDensity)/1000.]
-    PreyKilled = [0]
-    CerealExploited = [0]
-    ProportionDomesticated = [1 - WildToDomesticatedProportion]
-    AverageCerealDensity = [CerealDensity/1000]
+    patchdens = np.full((int(Cereal), Years+1), np.nan) # set up preallocated arrays to catch patch density and domestic proportion timeseries stats for possible output (one column per year). They start out as NaN, so that years that never ran can't pass for real data
+    patchprop = np.full((int(Cereal), Years+1), np.nan)
+    # set up a preallocated array for the output stats and plots, one row per year. The columns are the year, human population, human kcal deficit, Prey population, Prey killed, Cereal population, Cereal patches exploited, proportion of domestic-type Cereal, and average Cereal patch density
+    stats = np.full((Years+1, 9), np.nan)
+    stats[0] = [0, People, 0, Prey, 0, (Cereal * CerealDensity)/1000., 0, 1 - WildToDomesticatedProportion, CerealDensity/1000]
+    records = queue.Queue() # the worker thread streams the stats of every year through this queue
 
     # Setup the plot window with 4 subplots, the axes array is 1-d
     fig = plt.figure(figsize=(15,10))
@@ -360,173 +506,91 @@ if __name__ == "__main__":
     for tl in ax7.get_yticklabels():
         tl.set_color('r')
     ax6.set_xlabel('Years')
-    p1, = ax1.plot(yr, HumPop, 'k-') #Note the comma!!! Very important to have the comma!!!
-    p2, = ax2.plot(yr, PreyPop, 'k-') #Note the comma!!! Very important to have the comma!!!
-    p3, = ax3.plot(yr, CerealPop, 'r-') #Note the comma!!! Very important to have the comma!!!
-    p4, = ax4.plot(yr, PreyKilled, 'k-') #Note the comma!!! Very important to have the comma!!!
-    p5, = ax5.plot(yr, CerealExploited, 'r-') #Note the comma!!! Very important to have the comma!!!
-    p6, = ax6.plot(yr, ProportionDomesticated, 'k-') #Note the comma!!! Very important to have the comma!!!
-    p7, = ax7.plot(yr, AverageCerealDensity, 'r-') #Note the comma!!! Very important to have the comma!!!
+    # the lines of the plot, and the column of the stats array that each one shows. While the simulation runs, they are animated: they are left out of full redraws of the figure, and only they are redrawn (blitted) over a saved copy of the background (the axes, ticks and labels), so a redraw doesn't have to render the whole figure.
+    lines = []
+    for ax, column, style in [(ax1, 1, 'k-'), (ax2, 3, 'k-'), (ax3, 5, 'r-'), (ax4, 4, 'k-'), (ax5, 6, 'r-'), (ax6, 7, 'k-'), (ax7, 8, 'r-')]:
+        line, = ax.plot(stats[:1, 0], stats[:1, column], style, animated=RealTimePlotting)
+        lines.append((line, column))
     plt.setp( ax1.get_xticklabels(), visible=False)
+    background = None
+    shown = 0 # the last year that is shown on the plot
+
+    def show_lines(year):
+        '''Point the plot lines at the stats up to year (this doesn't copy them)'''
+        global shown
+        for line, column in lines:
+            line.set_data(stats[:year+1, 0], stats[:year+1, column])
+        shown = year
+
+    def save_background(event):
+        '''Keep a copy of the figure without the lines after every full redraw (e.g. when the window is resized), and draw the lines back over it'''
+        global background
+        background = fig.canvas.copy_from_bbox(fig.bbox)
+        for line, column in lines:
+            line.axes.draw_artist(line)
+
+    def blit(year):
+        '''Redraw just the lines, with the stats up to year'''
+        show_lines(year)
+        fig.canvas.restore_region(background)
+        for line, column in lines:
+            line.axes.draw_artist(line)
+        fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+
     if RealTimePlotting is True:
         # show the plot window
+        redrawn = fig.canvas.mpl_connect('draw_event', save_background)
         plt.show()
+        fig.canvas.draw()
+        fig.canvas.flush_events()
     else:
         pass
     ####### The simulation starts here.
     t0 = time.time() #set up a timer to see how fast we are
     print("Simulation Initiated, please stand by...")
-    for year in range(1,Years+1):        #this is the outer loop, that does things at an annual resolution, counting the years down for the simulation
-        if RealTimeText: print("Year: %s Human Population: %s" % (year, People))
-        kcalneed = People * HumanKcal        # find the number of kcals needed by the band this year
-        timebudget = People * ForagingHours       # find the time budget for the band this year
-        Prey_now = Prey            #set up a variable to track Prey population exploitation this year
-        Cereal_now = Cereal        #set up a variable to track Cereal patch exploitation this year
-        eatCereal = 0        #set up data container to count how many Cereal patches we ate this year
-        eatPrey = 0        #set up data container to count how many Prey we ate this year
-        while kcalneed > 0:        #this is the inner loop, doing foraging within the year, until kcal need is satisfied
-            if Prey_now <= 0 and Cereal_now <= 0:
-                if RealTimeText: print("ate everything!!!")
-                break
-            #first calculate info about the current state of Cereal
-            WildToDomesticatedProportion_now = np.mean(Cereal_df.WildToDomesticatedProportion[0:Cereal_now]) #Note that we are taking the mean proportion across all remaining Cereal patches in the data array.
-            CerealDensity_now = np.mean(Cereal_df.CerealDensity[0:Cereal_now]) #Note that we are taking the mean number of individuals per patch across all remaining patches in the Cereal data array. Note that we are reading off of the right end of the array list.
-            CerealReturns = (WildCerealReturns * WildToDomesticatedProportion_now) + (DomesticatedCerealReturns * (1 - WildToDomesticatedProportion_now))        #determine the actual kcal return for Cereal, based on the proportion of wild to domesticated.
-            CombinedCerealHandlingCost = (WildCerealHandlingCost * WildToDomesticatedProportion_now) + (DomesticatedCerealHandlingCost * (1 - WildToDomesticatedProportion_now))    #determine the actual handling time for Cereal, based on the proportion of wild to domesticated.
-            if Prey_now <= 0:
-                Preyscore = 0
-            else:
-                PreySearchCost_Now = PreySearchCost / (Prey_now / PreyDensity)        #find the actual search time for the amount of Prey at this time
-                if MinPreyEncountered >= MaxPreyEncountered:
-                    PreyEncountered_Now = MinPreyEncountered
-                else:
-                    PreyEncountered_Now = np.random.randint(MinPreyEncountered, MaxPreyEncountered)     # find how many prey are encountered at this time
-                Preyscore = PreyReturns / (PreySearchCost_Now + PreyHandlingCost)    #find the current return rate (kcal/hr) for Prey.
-            if Cereal_now <= 0:
-                Cerealscore = 0
-            else:
-                Cerealscore = (CerealReturns * CerealDensity_now ) / (CerealSearchCosts + (CombinedCerealHandlingCost *  CerealDensity_now))        #find the current return rate (kcal/hr for Cereal.
-            if np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Hunting prey is more profitable
-                if timebudget <= 0:
-                    if RealTimeText: print("Ran out of labor time this year")
-                    Preyscore = 0
-                    pass
-                if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
-                    if RealTimeText: print("Killed all the Prey available this year, will try to make up the remainder of the diet with Cereal")
-                    Preyscore = 0.
-                    pass
-                else:
-                    kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
-                    timebudget = timebudget - (PreySearchCost_Now + (PreyHandlingCost * PreyEncountered_Now))
-                    eatPrey = eatPrey + PreyEncountered_Now
-                    Prey_now = Prey_now - PreyEncountered_Now
-            elif np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Harvesting cereal is more profitable
-                if timebudget <= 0:
-                    if RealTimeText: print("Ran out of labor time this year")
-                    Cerealscore = 0
-                    pass
-                if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
-                    if RealTimeText: print("Harvested all available Cereal this year, will try to make up the remainder of the diet with Prey.")
-                    Cerealscore = 0
-                    pass
-                else:
-                    kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
-                    timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
-                    eatCereal = eatCereal + 1
-                    Cereal_now = Cereal_now - 1
-            else: # both equally profitable, so randomly choose hunting or harvesting
-                if np.random.randint(0,1) == 1:
-                    if timebudget <= 0:
-                        if RealTimeText: print("Ran out of labor time this year")
-                        Preyscore = 0
-                        pass
-                    if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
-                        if RealTimeText: print("Killed all the Prey available this year, will try to make up the remainder of the diet with Cereal")
-                        Preyscore = 0.
-                        pass
-                    else:
-                        kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
-                        timebudget = timebudget - (PreySearchCost_Now + PreyHandlingCost)
-                        eatPrey = eatPrey + PreyEncountered_Now
-                        Prey_now = Prey_now - PreyEncountered_Now
+    worker = threading.Thread(target=simulate, args=(People, Prey, patchdens, patchprop, records, RealTimeText), daemon=True)
+    worker.start()
+    # collect the yearly stats from the worker as they come in, and redraw the plot at most every RedrawInterval milliseconds and RedrawYears years (so the cost of the plot doesn't grow with every year of the run)
+    interval = settings.RedrawInterval / 1000.
+    wait = min(max(interval, 0.01), 0.05) if RealTimePlotting else None # (how long to wait for new stats before handling window events again)
+    lastdraw = time.time()
+    year = 0
+    failure = None # the exception that the worker thread failed with, if it did
+    finished = False
+    while not finished:
+        try:
+            record = records.get(timeout=wait)
+            while record is not None:
+                if isinstance(record, Exception):
+                    failure = record
                 else:
-                    if timebudget <= 0:
-                        if RealTimeText: print("Ran out of labor time this year")
-                        Cerealscore = 0
-                        pass
-                    if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
-                        if RealTimeText: print("Harvested all available Cereal this year, will try to make up the remainder of the diet with Prey.")
-                        Cerealscore = 0
-                        pass
-                    else:
-                        kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
-                        timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
-                        eatCereal = eatCereal + 1
-                        Cereal_now = Cereal_now - 1
-            if timebudget <= 0:        #check if they've run out of foraging time, and stop the loop if necessary.
-                if RealTimeText: print("Ran out of all foraging time for this year before gathering enough food.")
-                break
-            if Prey <= 0 and Cereal <= 0:    #check if they've run out of food, and stop the loop if necessary.
-                if RealTimeText: print("Ate all the Prey and all the Cereal this year before gathering enough food.")
-                break
-            if Preyscore <= 0 and Cerealscore <= 0:    #check if they've run out of food, and stop the loop if necessary.
-                if RealTimeText: print("Ate all the Prey and all the Cereal this year before gathering enough food.")
-                break
-        ####### Now that the band has foraged for a year, update human, Prey, and Cereal populations, and implement selection
-        if (People * HumanKcal) - kcalneed <= (People * HumanKcal * StarvationThreshold):     #Check if they starved this year and just die deaths if so
-            if RealTimeText: print("Starvation occurred.")
-            People = People - deathdealer(HumanDeathRate*2, HumanBirthDeathFilter, People)
-        else: #otherwise, balance births and deaths, and adjust the population accordingly
-            People = People + babymaker(HumanBirthRate, HumanBirthDeathFilter, People) - deathdealer(HumanDeathRate, HumanBirthDeathFilter, People)
-        if MaxPreyMigrants == 0:
-            PreyMigrantsNow = 0
-        else:
-            PreyMigrantsNow = np.random.randint(0, MaxPreyMigrants)
-        Prey = Prey_now + babymaker(PreyBirthRate, PreyBirthDeathFilter, Prey_now) - deathdealer(PreyDeathRate, PreyBirthDeathFilter, Prey_now) + PreyMigrantsNow #Adjust the Prey population by calculating the balance of natural births and deaths on the hunted population, and then add the migrants population
-        if People > MaximumPeople: People = MaximumPeople # don't allow human pop to exceed the limit we set
-        if Prey > MaxPrey: Prey = MaxPrey # don't allow Prey pop to exceed natural carrying capacity
-        #This part is a bit complicated. We are adjusting the proportions of wild to domestic Cereal in JUST the Cereal patches that were exploited this year. We are also adjusting the density of individuals in those patches. This is the effect of the "artificial selection" exhibited by humans while exploiting those patches. At the same time, we are implementing a "diffusion" of wild-type characteristics back to all the patches. If they are used, selection might outweigh diffusion. If they aren't being used, then just diffusion occurs. In this version of the model, diffusion is density dependent, and is adjusted by (lat year's) the proportion of domestic to non-domestic Cereals left in the population.
-        patch_adjust = [] # make a matrix to do the selection/diffusion on the individual patches based on if they got used or not.
-        currentCerealDiffusionRate = np.random.normal(CerealDiffusionRate, (CerealDiffusionRate*SelectionDiffusionFilter)) * (1 - ProportionDomesticated[-1])
-        currentCerealSelectionRate = np.random.normal(CerealSelectionRate, (CerealSelectionRate*SelectionDiffusionFilter))
-        for x in range(1,int(Cereal+1)):
-            if x < eatCereal:
-                patch_adjust.append([currentCerealDiffusionRate-currentCerealSelectionRate, CerealCultivationDensity])
-            else:
-                patch_adjust.append([currentCerealDiffusionRate, -CerealCultivationDensity])
-        patch_adjustdf = pd.DataFrame(patch_adjust, columns=['sel', 'cult']) #turn the matrix into a pandas dataframe for easy matrix math
-        #patch_adjustdf.to_csv("patch_changes.csv") ## this is here for debugging purposes. Uncomment if you want the patch adjustments to be written to a file.
-
-        Cereal_df['CerealDensity'] = Cereal_df['CerealDensity'] = Cereal_df['CerealDensity'].where((Cereal_df['CerealDensity'] + patch_adjustdf['cult'] > MaxCerealDensity - CerealCultivationDensity) | (Cereal_df['CerealDensity'] + patch_adjustdf['cult'] < CerealDensity + CerealCultivationDensity), other=Cereal_df['CerealDensity'] + patch_adjustdf['cult']) # adjust the patch density column, but only if the value will stay between CerealDensity and MaxCerealDensity.
-
-        Cereal_df['WildToDomesticatedProportion'] = Cereal_df['WildToDomesticatedProportion'].where((Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel'] > 1 - currentCerealDiffusionRate) | (Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel'] < 0 + currentCerealSelectionRate), other=Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel']) # adjust the selection coefficient column, but only if the value will stay between 1 and 0.
-
-        #Cereal_df.to_csv('supposed_new_patches.csv') ## this is here for debugging purposes. Uncomment if you want the patch adjustments to be written to a file.
-        #update the patch time-series dataframes with the current year's data
-        patchdens_ts[year] = Cereal_df.CerealDensity
-        patchprop_ts[year] = Cereal_df.WildToDomesticatedProportion
-        ######## Okay, now update the live plot data
-        yr.append(year)
-        HumPop.append(People)
-        HumanKcalPrey.append((People * HumanKcal) - kcalneed)
-        PreyPop.append(Prey)
-        CerealPop.append(np.sum(Cereal_df.CerealDensity)/1000.)
-        PreyKilled.append(eatPrey)
-        CerealExploited.append(eatCereal)
-        ProportionDomesticated.append(1 - np.mean(Cereal_df.WildToDomesticatedProportion))
-        AverageCerealDensity.append((np.mean(Cereal_df.CerealDensity))/1000.)
-        p1.set_data(yr, HumPop)
-        p2.set_data(yr, PreyPop)
-        p3.set_data(yr, CerealPop)
-        p4.set_data(yr, PreyKilled)
-        p5.set_data(yr, CerealExploited)
-        p6.set_data(yr, ProportionDomesticated)
-        p7.set_data(yr, AverageCerealDensity)
+                    year = int(record[0])
+                    stats[year] = record
+                record = records.get_nowait()
+            finished = True
+        except queue.Empty:
+            pass
         if RealTimePlotting is True:
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-        else:
-            plt.draw()
+            if year - shown >= settings.RedrawYears and time.time() - lastdraw >= interval:
+                blit(year)
+                lastdraw = time.time()
+            else:
+                fig.canvas.flush_events() # keep the window responsive
+    worker.join()
+    if failure is not None: # don't offer to save the output of a run that didn't finish
+        eg.msgbox("The simulation failed after year %s:\n\n%r" % (year, failure), "Simulation Failed")
+        raise failure
+    # show the whole run, with a full redraw so the lines are drawn as part of the figure again
+    show_lines(year)
+    for line, column in lines:
+        line.set_animated(False)
+    if RealTimePlotting is True:
+        fig.canvas.mpl_disconnect(redrawn)
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+    else:
+        plt.draw()
     ######
     t1 = time.time()
     print("Simulation Finished.\nTotal compute time is", round(t1-t0, 2), "seconds.")
@@ -539,7 +603,7 @@ if __name__ == "__main__":
         sys.exit(0)
     if "General Stats" in choice:
         GeneralStatsFile = eg.filesavebox("Choose a file to save the general stats to", "Save General Stats", default='%s%sSimulation_general_stats.csv' % (os.getcwd(), os.sep), filetypes=["*.csv", "Comma separated ASCII text files"])
-        statsout = pd.DataFrame(data=np.array([yr, HumPop, HumanKcalPrey, PreyPop, PreyKilled, CerealPop, CerealExploited, ProportionDomesticated, AverageCerealDensity]).T, columns = ["Year","Total Human Population","Human Kcal Deficit","Total Prey Animals Population","Number of Prey Animals Eaten","Total Cereal Population (*10^3)","Number of Cereal Patches Exploited","Proportion of Domestic-Type Cereal","Average Cereal Patch Density (*10^3)"])      # put the main stats data in a pandas data frame for easy formatting
+        statsout = pd.DataFrame(data=stats, columns = ["Year","Total Human Population","Human Kcal Deficit","Total Prey Animals Population","Number of Prey Animals Eaten","Total Cereal Population (*10^3)","Number of Cereal Patches Exploited","Proportion of Domestic-Type Cereal","Average Cereal Patch Density (*10^3)"])      # put the main stats data in a pandas data frame for easy formatting
         if GeneralStatsFile == '': # did the user press cancel, or not enter a file name? If so, then pass, otherwise, write the file.
             pass
         else:
@@ -551,12 +615,12 @@ if __name__ == "__main__":
         if CerealDensityStatsFile == '':
             pass
         else:
-            patchdens_ts.to_csv(CerealDensityStatsFile, float_format='%.5f')
+            pd.DataFrame(patchdens, index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))).to_csv(CerealDensityStatsFile, float_format='%.5f')
         CerealProportionStatsFile = eg.filesavebox("Choose a file to save the Cereal patches domesticated proportion stats to", "Save Cereal Patch Stats", default='%s%sSimulation_Cereal_patch_domestic_proportion_stats.csv' % (os.getcwd(), os.sep), filetypes=["*.csv"])
         if CerealProportionStatsFile == '':
             pass
         else:
-            patchprop_ts.to_csv(CerealProportionStatsFile, float_format='%.5f')
+            pd.DataFrame(patchprop, index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))).to_csv(CerealProportionStatsFile, float_format='%.5f')
     else:
         pass
     if "Plot" in choice:
@@ -36,21 +36,48 @@
 
 import os
 import sys
+import json
+import time
+import warnings
 import numpy as np
-import pandas as pd
 import argparse
+from patches import CerealPatches, CompactPatches
+from convergence import Convergence
+from recorders import Recorder, CompactRecorder, COMPACT_POLICIES
+from foraging import Diet, forage_batched, forage_diet, forage_stepwise
 
 #Set up sparse CLI
 parser = argparse.ArgumentParser(description='This model simulates a complex hunter-gatherer band making optimal foraging decisions between a high-ranked resource and a low-ranked resource. The high-ranked resource is rich, but hard to find and proces,and potentially very scarce. The low-ranked resource is poor, but common and easy to find and process.')
-parser.add_argument('--HumanBirthRate', metavar='0.032', type=float, nargs='?', const=.032, default=.032, help='Enter the annual human per capita birth rate')
-parser.add_argument('--CerealSelectionRate', metavar='0.03', type=float, nargs='?', const=.03, default=.03, help='Enter the coefficient of selection (e.g., the rate of change from wild-type to domestic type)')
-parser.add_argument('--CerealCultivationDensity', metavar='1000000', type=int, nargs='?', const=1000000, default=1000000, help='Enter the number of additional millet plants to added to a patch each year due to proto cultivation of the patch. The patch reduces by the same number if not exploited.')
+parser.add_argument('--HumanBirthRate', metavar='0.032', type=float, nargs='?', const=.032, default=None, help='Enter the annual human per capita birth rate')
+parser.add_argument('--CerealSelectionRate', metavar='0.03', type=float, nargs='?', const=.03, default=None, help='Enter the coefficient of selection (e.g., the rate of change from wild-type to domestic type)')
+parser.add_argument('--CerealCultivationDensity', metavar='1000000', type=int, nargs='?', const=1000000, default=None, help='Enter the number of additional millet plants to added to a patch each year due to proto cultivation of the patch. The patch reduces by the same number if not exploited.')
 parser.add_argument('--label', metavar='Z.ZZ', nargs='?', const='1.01', default='1.01', help='This is the experiment and run number. E.g., experiment 1, run 1, should look like: 1.01')
+parser.add_argument('--Engine', metavar='python', choices=['python', 'numba'], default=None, help='Enter the simulation engine to use: "python" or "numba" (compiled with Numba, falls back to "python" if it is not installed)')
+parser.add_argument('--ForagingEngine', metavar='batched', choices=['batched', 'stepwise', 'diet'], default=None, help='Enter the foraging engine to use: "batched" (resolves runs of same-resource foraging bouts in bulk), "stepwise" (one decision at a time, as in earlier versions of the model) or "diet" (as "batched", choosing between Prey, Cereal and the extra --Resources)')
+parser.add_argument('--EarlyStop', metavar='off', choices=['off', 'absorbing', 'steady', 'stationary'], default=None, help='Enter when to stop the run before Years (see convergence.py): "off", "absorbing" (once the humans have died out), "steady" (also once the whole state stays put) or "stationary" (also once the general stats are stationary). The output is padded forward to Years')
+parser.add_argument('--Landscape', metavar='dense', choices=['dense', 'compact', 'grid'], default=None, help='Enter how to hold the Cereal patches: "dense" (an array entry per patch), "compact" (runs of identical patches, in float32, for landscapes of 10^5 patches and more, see patches.py) or "grid" (a 2-D grid around a camp, with distance dependent search costs and neighbour diffusion, see landscape.py)')
+parser.add_argument('--cache', metavar='DIR', default=None, help='Directory of a result cache (see cache.py). If this run (same parameters, seed and model version) is already in the cache, its output is written from there instead of simulating it again; otherwise the run is added to the cache. Only runs with a --seed are cached')
+parser.add_argument('--cachesize', metavar='GB', type=float, default=None, help='Size cap of the result cache, in GB. The least recently used runs are deleted from it when it grows past this size')
+parser.add_argument('--store', metavar='FILE', default=None, help='Append the output of this run to the sweep store FILE (see store.py) under its label, instead of writing CSV files')
+parser.add_argument('--summary', metavar='FILE', default=None, help='Fold the output of this run into the running summary statistics of its experiment, saved in FILE (see summaries.py), instead of writing CSV files')
+parser.add_argument('--patches', metavar='full', choices=['full', 'decimate', 'changes', 'delta', 'none'], default=None, help='How to write the patch density and domestic proportion CSV files: "full" (every patch in every year, the default), "decimate" (only every --every years, the default on the compact Landscape, which only takes "decimate" or "none"), "changes" (only the patches that changed each year), "delta" (run-length encoded yearly changes) or "none" (see PATCH_POLICIES in recorders.py)')
+parser.add_argument('--every', metavar='10', type=int, default=10, help='Interval in years between the recorded years of the "decimate" patch files')
+parser.add_argument('--seed', metavar='N', type=int, default=None, help='Seed for the random number generator. Runs with the same parameters and seed produce identical output. Leave out for an unpredictable seed')
+parser.add_argument('--checkpoint', metavar='FILE', default=None, help='Save the complete state of the run to FILE every now and then (see checkpoint.py and --checkpointyears, --checkpointseconds), so that it can be resumed with --resume if it is killed. The file is deleted once the output is written')
+parser.add_argument('--checkpointyears', metavar='N', type=int, default=None, help='Save a checkpoint every N years')
+parser.add_argument('--checkpointseconds', metavar='T', type=float, default=None, help='Save a checkpoint every T seconds (default 600, if --checkpointyears isn\'t given either)')
+parser.add_argument('--resume', action='store_true', help='Carry on from the --checkpoint FILE, if there is one, exactly as if the run had never stopped')
+parser.add_argument('--config', metavar='FILE', default=None, help='Load the model parameters from a settings file saved by the GUI version of the model (e.g. agmodel.config). Parameters given on the command line override the ones in the file')
+parser.add_argument('--manifest', metavar='FILE', default=None, help='Run every run listed in the JSON or CSV manifest FILE (see manifest.py), each with its own parameters on top of the ones given on the command line, in this one process. Each run is labelled and written out like a single run')
+parser.add_argument('--burnin', metavar='YEARS', type=int, default=None, help='With --manifest, simulate the first YEARS years once, with the parameters given on the command line, and fork every run of the manifest from there as a scenario branch, with its own parameters and random number stream from then on (see burnin.py)')
+parser.add_argument('--processes', metavar='1', type=int, default=1, help='Number of worker processes that run the runs of a --manifest in parallel (0 for one per CPU)')
+parser.add_argument('--profile', action='store_true', help='Profile the run (see profiling.py): write the wall time of each phase of the yearly loop, the foraging bouts of each year and the random numbers drawn to a JSON report next to its output')
 ###############################################################
 ## EDIT THESE VARIABLES AS YOU SEE FIT
 # HUMAN VARIABLES
 People = 50         ## Enter the initial number of people in the band
 MaximumPeople = 3000    ## Enter the maximum human population (just to keep this in the realm of possibility, and to help set the y axis on the plot)
+Bands = 1        ## Enter the number of forager bands that share the Prey and Cereal patches, each starting with People people and capped at MaximumPeople, with its own camp (more than 1 needs Landscape = "grid", see bands.py)
 HumanBirthRate = 0.032         ## Enter the annual human per capita birth rate
 HumanDeathRate = 0.03        ## Enter the annual human per capita death rate
 HumanBirthDeathFilter = 0.005 ## Width of the Gaussian randomizing filter for human birth and death rates
@@ -87,187 +114,300 @@ MaxCerealDensity = 100000000 ## Maximum number of Cereal kernels that can be har
 CerealCultivationDensity = 1000000 ## Number of additional Cereal kernels that can be harvested from a patch each year due to proto-cultivation of the patch (up to maximum density). The patch yield reduces by the same number if not exploited (down to minimum)
 WildCerealHandlingCost = 0.0001        ## Enter the handling costs for wild Cereal (hours handling time expended per seed once encountered)
 DomesticatedCerealHandlingCost = 0.00001        ## Enter the handling costs for domestic Cereal (hours handling time expended per seed once encountered)
+# OTHER RESOURCE VARIABLES (only used when ForagingEngine = "diet", see foraging.py)
+Resources = ""        ## Enter the extra food resources as a JSON list, with an object per resource giving its "name", its "kind" ("prey", whose search cost rises as it is depleted within the year, or "plant", whose search cost stays the same), the kcal "returns", "search" and "handling" costs (hours) of one bout, and the "stock" of bouts available each year, e.g. [{"name": "Nuts", "kind": "plant", "returns": 100000, "search": 4, "handling": 8, "stock": 500}] ("" for none)
+# LANDSCAPE VARIABLES (only used when Landscape = "grid", see landscape.py)
+GridWidth = 0        ## Enter the number of Cereal patches in each row of the grid (0 makes the grid as square as possible)
+CampX = -1.0        ## Enter the column of the band's camp, in patch widths from the left edge of the grid (-1 puts it in the middle)
+CampY = -1.0        ## Enter the row of the band's camp, in patch widths from the top edge of the grid (-1 puts it in the middle)
+TravelCost = 0.1        ## Enter the extra search cost for Cereal per patch width of distance from the camp (hours)
+NeighbourDiffusion = 0.05        ## Enter the fraction of the way that the domestic proportion of each patch moves towards the mean of its neighbours each year
 # SIMULATION CONTROLS
 Years = 3000        ## Enter the number of years for which to run the simulation
+Engine = "python"        ## Enter the simulation engine to use: "python" is the pure Python/NumPy engine, "numba" compiles the whole simulation to native code with Numba (see jit.py; falls back to "python" if Numba isn't installed)
+ForagingEngine = "batched"        ## Enter the foraging engine to use: "batched" resolves runs of same-resource foraging bouts in bulk, "stepwise" makes one decision at a time, exactly as in earlier versions of the model (much slower, but useful as a reference), "diet" works like "batched", but chooses between Prey, Cereal and the extra Resources
+EarlyStop = "off"        ## Enter when to stop a run before Years: "off" never does, "absorbing" stops once the humans have died out, "steady" also stops once the whole state has stayed put for EarlyStopWindow years, "stationary" also stops once the general stats have been stationary for EarlyStopWindow years (see convergence.py). The last simulated year is copied forward to fill the output up to Years
+EarlyStopWindow = 100        ## Enter the number of years over which the "steady" and "stationary" early stopping detectors look
+EarlyStopTolerance = 0.001        ## Enter the relative tolerance of the "steady" and "stationary" early stopping detectors
+Landscape = "dense"        ## Enter how to hold the Cereal patches: "dense" keeps an array entry per patch, as in earlier versions. "compact" keeps runs of neighbouring patches with the same state in float32 (see CompactPatches in patches.py), so that memory and the time of a year don't grow with the number of patches. Use it for regional landscapes of 10^5 to 10^6 patches and more. It follows the same dynamics, but not the exact random number stream of a dense run, and it only works with the "python" engine. "grid" lays the patches out on a 2-D grid around a camp, with search costs that grow with distance and diffusion of domestic traits between neighbouring patches (see the LANDSCAPE VARIABLES above, and landscape.py). It only works with the "python" engine
 
 # DO NOT EDIT BELOW THIS LINE
 #############################################################
 #############################################################
 #############################################################
 
-#Get values from command line variables
-args = vars(parser.parse_args())
-HumanBirthRate = args["HumanBirthRate"]
-CerealSelectionRate = args["CerealSelectionRate"]
-CerealCultivationDensity = args["CerealCultivationDensity"]
-label = args["label"]
+# Names of all the model parameters above, in the order they appear. These can be overridden by passing a mapping to run_simulation()
+PARAMETERS = ['People', 'MaximumPeople', 'Bands', 'HumanBirthRate', 'HumanDeathRate', 'HumanBirthDeathFilter', 'StarvationThreshold', 'HumanKcal', 'ForagingHours', 'ForagingUncertainty',
+              'Prey', 'MaxPrey', 'MaxPreyMigrants', 'PreyBirthRate', 'PreyDeathRate', 'PreyBirthDeathFilter', 'PreyReturns', 'PreySearchCost', 'PreyDensity', 'MaxPreyEncountered', 'MinPreyEncountered', 'PreyHandlingCost',
+              'Cereal', 'WildCerealReturns', 'DomesticatedCerealReturns', 'WildToDomesticatedProportion', 'CerealSelectionRate', 'CerealDiffusionRate', 'SelectionDiffusionFilter', 'CerealSearchCosts', 'CerealDensity', 'MaxCerealDensity', 'CerealCultivationDensity', 'WildCerealHandlingCost', 'DomesticatedCerealHandlingCost',
+              'Resources',
+              'GridWidth', 'CampX', 'CampY', 'TravelCost', 'NeighbourDiffusion',
+              'Years', 'Engine', 'ForagingEngine', 'EarlyStop', 'EarlyStopWindow', 'EarlyStopTolerance', 'Landscape']
+DEFAULTS = dict((name, globals()[name]) for name in PARAMETERS)
+MODEL_VERSION = "0.6" # keep this in step with the version in the header
+
+# Add a command line option for every model parameter that doesn't have one of its own above, so that any of them can be set from the command line
+for name in PARAMETERS:
+    if '--%s' % name not in parser._option_string_actions:
+        parser.add_argument('--%s' % name, metavar='%s' % DEFAULTS[name], type=type(DEFAULTS[name]), default=None, help='Override the %s parameter (default %s, see the header of AgModel_headless.py)' % (name, DEFAULTS[name]))
+
 #Make some custom functions for the population dynamics
 
-def babymaker(p, f, n):
-    '''p is the per capita birth rate, f is the width of the Gaussian filter, n is the population size'''
-    babys = np.round(np.random.normal(p,f)*n)
+def babymaker(p, f, n, rng=np.random):
+    '''p is the per capita birth rate, f is the width of the Gaussian filter, n is the population size (or an array of population sizes, each of which gets its own draw of the rate), rng is the random number generator to draw from'''
+    babys = np.round(rng.normal(p,f,np.shape(n) or None)*n)
     return(babys)
 
-def deathdealer(p, f, n):
-    '''p is the per capita death rate, f is the width of the Gaussian filter, n is the population size'''
-    deaths = np.round(np.random.normal(p,f)*n)
+def deathdealer(p, f, n, rng=np.random):
+    '''p is the per capita death rate, f is the width of the Gaussian filter, n is the population size (or an array of population sizes, each of which gets its own draw of the rate), rng is the random number generator to draw from'''
+    deaths = np.round(rng.normal(p,f,np.shape(n) or None)*n)
     return(deaths)
 
+def model_parameters(params=None):
+    '''Returns a full set of model parameters: DEFAULTS, overridden by the mapping params. Raises KeyError for names that aren't model parameters'''
+    unknown = set(params or {}) - set(PARAMETERS)
+    if unknown:
+        raise KeyError("Unknown model parameter(s): %s" % ", ".join(sorted(unknown)))
+    p = dict(DEFAULTS)
+    p.update(params or {})
+    return p
 
-if __name__ == "__main__":
-    ##### Setup the simulation
-    Cerealpatches = []
-    for patch in range(int(Cereal)): # set up a data container for our Cereal patches.
-        Cerealpatches.append([CerealDensity, WildToDomesticatedProportion]) # They will all start out the same.
-    Cereal_df = pd.DataFrame(Cerealpatches, columns=['CerealDensity','WildToDomesticatedProportion']) # turn this data container into a pandas dataframe for more efficient math and indexing
-    patchdens_ts = pd.DataFrame(index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))) # set up a blank pandas dataframe to catch patch density timeseries stats for possible output
-    patchprop_ts = pd.DataFrame(index=list(range(1,int(Cereal+1))), columns=list(range(Years+1))) # set up a blank pandas dataframe to catch patch domestic proportion timeseries stats for possible output
-    patchdens_ts[0] = Cereal_df.CerealDensity # update with year 0 data
-    patchprop_ts[0] = Cereal_df.WildToDomesticatedProportion # update with year 0 data
-    # set up some individual data containers for the output stats and plots
-    yr = [0]
-    HumPop = [People]
-    HumanKcalPrey = [0]
-    PreyPop = [Prey]
-    CerealPop = [(Cereal * CerealDensity)/1000.]
-    PreyKilled = [0]
-    CerealExploited = [0]
-    ProportionDomesticated = [1 - WildToDomesticatedProportion]
-    AverageCerealDensity = [CerealDensity/1000]
-    ####### The simulation starts here.
-    for year in range(1,Years+1):        #this is the outer loop, that does things at an annual resolution, counting the years down for the simulation
-        kcalneed = People * HumanKcal        # find the number of kcals needed by the band this year
-        timebudget = People * ForagingHours       # find the time budget for the band this year
+def run_seed(seed, experiment, repetition):
+    '''Derive an independent integer seed for one repetition of one experiment from a base seed'''
+    return int(np.random.SeedSequence([seed, experiment, repetition]).generate_state(1)[0])
+
+
+class Simulation(object):
+    '''The state of one model run: the parameters, the random number generator, the human and Prey populations, the Cereal patches and the output recorder'''
+    def __init__(self, params=None, seed=None, profile=False):
+        '''params is a mapping of parameter names to values that override DEFAULTS, seed is the seed for the random number generator (None for a fresh, unpredictable seed). With profile=True, the run keeps a profiling.Profiler, and its report is put in the output recorder'''
+        self.params = p = model_parameters(params)
+        if p['Bands'] > 1:
+            raise ValueError("Simulation runs a single band, several Bands run with bands.BandSimulation (see run_simulation())")
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.profiler = None
+        if profile:
+            from profiling import Profiler
+            self.profiler = Profiler(p['Years'])
+            self.profiler.count(self.rng) # count the random numbers drawn, without changing them
+        self.diet = None
+        if p['ForagingEngine'] == "diet":
+            self.diet = Diet(p) # the extra resources, as arrays
+            self.forage = lambda *args: forage_diet(*args, diet=self.diet)
+        elif p['Resources']:
+            raise ValueError("Extra Resources need the diet ForagingEngine")
+        else:
+            self.forage = forage_stepwise if p['ForagingEngine'] == "stepwise" else forage_batched
+        self.year = 0
+        self.People = p['People']
+        self.Prey = p['Prey']
+        if p['Landscape'] == "compact":
+            self.patches = CompactPatches(p['Cereal'], p['CerealDensity'], p['WildToDomesticatedProportion']) # the Cereal patches as runs of identical patches. They all start out as one run.
+            self.recorder = CompactRecorder(p['Years'], p['Cereal'])
+        elif p['Landscape'] == "grid":
+            from landscape import GridPatches
+            self.patches = GridPatches(p) # the Cereal patches on a grid, nearest to the camp first
+            self.recorder = Recorder(p['Years'], p['Cereal'])
+        elif p['Landscape'] == "dense":
+            self.patches = CerealPatches(p['Cereal'], p['CerealDensity'], p['WildToDomesticatedProportion']) # set up preallocated arrays for our Cereal patches. They will all start out the same.
+            self.recorder = Recorder(p['Years'], p['Cereal']) # set up preallocated arrays to catch the general stats and the patch density and domestic proportion timeseries stats for output
+        else:
+            raise ValueError("Unknown Landscape: %s" % p['Landscape'])
+        if self.diet is not None and self.diet.names:
+            self.recorder.track_resources(self.diet.names) # also keep the bouts spent on each extra resource
+        self.recorder.record(0, self.People, 0, self.Prey, 0, 0, self.patches) # update with year 0 data
+        self.convergence = Convergence(p) # the early stopping detectors
+
+    def get_state(self, history=True):
+        '''Returns the complete state of the run, including the state of the random number generator and the output recorded so far, as a dict of arrays (see checkpoint.py). With history=False, only the current year of the patch time series is included (enough to carry on the run, but not to write out its full output)'''
+        if self.params['Landscape'] == "compact":
+            raise ValueError("Checkpoints and branches don't work on the compact Landscape")
+        kind, key, pos, has_gauss, gauss = self.rng.get_state()
+        first = 0 if history else self.year
+        state = {"version": np.array(MODEL_VERSION), "params": np.array(json.dumps(self.params, default=lambda x: x.item())), "seed": np.array(json.dumps(self.seed, default=lambda x: x.item())), "year": np.array(self.year), "People": np.array(self.People), "Prey": np.array(self.Prey),
+                 "rng_key": key, "rng_pos": np.array(pos), "rng_gauss": np.array([has_gauss, gauss]),
+                 "CerealDensity": self.patches.CerealDensity, "WildToDomesticatedProportion": self.patches.WildToDomesticatedProportion,
+                 "stats": self.recorder.stats[:self.year + 1], "density": self.recorder.density[first:self.year + 1], "proportion": self.recorder.proportion[first:self.year + 1]} # (only the years so far are kept)
+        state.update(("convergence_%s" % name, values) for name, values in self.convergence.get_state().items())
+        if self.recorder.resources is not None:
+            state["resources"] = self.recorder.resources[:self.year + 1]
+        return state
+
+    @classmethod
+    def from_state(cls, state, profile=False):
+        '''Make a run from the dict of arrays written by get_state(), that carries on exactly where that run left off. With profile=True, the years from here on are profiled'''
+        if str(state["version"]) != MODEL_VERSION:
+            raise ValueError("This state is from version %s of the model, not %s" % (state["version"], MODEL_VERSION))
+        simulation = cls(json.loads(str(state["params"])), json.loads(str(state["seed"])), profile)
+        simulation.year = year = int(state["year"])
+        simulation.People = state["People"][()]
+        simulation.Prey = state["Prey"][()]
+        has_gauss, gauss = state["rng_gauss"]
+        simulation.rng.set_state(('MT19937', state["rng_key"], int(state["rng_pos"]), int(has_gauss), float(gauss)))
+        simulation.patches.CerealDensity[:] = state["CerealDensity"]
+        simulation.patches.WildToDomesticatedProportion[:] = state["WildToDomesticatedProportion"]
+        simulation.patches.cumulate()
+        simulation.recorder.stats[:year + 1] = state["stats"]
+        first = year + 1 - len(state["density"]) # (the earlier years of the patch time series are left out of states saved with history=False)
+        simulation.recorder.density[first:year + 1] = state["density"]
+        simulation.recorder.proportion[first:year + 1] = state["proportion"]
+        simulation.convergence.set_state(dict((name[len("convergence_"):], values) for name, values in state.items() if name.startswith("convergence_")))
+        if "resources" in state:
+            simulation.recorder.resources[:year + 1] = state["resources"]
+        return simulation
+
+    def step(self):
+        '''Simulate one year'''
+        p = self.params
+        profiler = self.profiler
+        rng = self.rng if profiler is None else profiler.rng
+        if profiler is not None: profiler.mark()
+        People = self.People
+        Prey = self.Prey
+        self.year = year = self.year + 1
+        kcalneed = People * p['HumanKcal']        # find the number of kcals needed by the band this year
+        timebudget = People * p['ForagingHours']       # find the time budget for the band this year
         Prey_now = Prey            #set up a variable to track Prey population exploitation this year
-        Cereal_now = Cereal        #set up a variable to track Cereal patch exploitation this year
-        eatCereal = 0        #set up data container to count how many Cereal patches we ate this year
-        eatPrey = 0        #set up data container to count how many Prey we ate this year
-        while kcalneed > 0:        #this is the inner loop, doing foraging within the year, until kcal need is satisfied
-            if Prey_now <= 0 and Cereal_now <= 0:
-                break
-            #first calculate info about the current state of Cereal
-            WildToDomesticatedProportion_now = np.mean(Cereal_df.WildToDomesticatedProportion[0:Cereal_now]) #Note that we are taking the mean proportion across all remaining Cereal patches in the data array.
-            CerealDensity_now = np.mean(Cereal_df.CerealDensity[0:Cereal_now]) #Note that we are taking the mean number of individuals per patch across all remaining patches in the Cereal data array. Note that we are reading off of the right end of the array list.
-            CerealReturns = (WildCerealReturns * WildToDomesticatedProportion_now) + (DomesticatedCerealReturns * (1 - WildToDomesticatedProportion_now))        #determine the actual kcal return for Cereal, based on the proportion of wild to domesticated.
-            CombinedCerealHandlingCost = (WildCerealHandlingCost * WildToDomesticatedProportion_now) + (DomesticatedCerealHandlingCost * (1 - WildToDomesticatedProportion_now))    #determine the actual handling time for Cereal, based on the proportion of wild to domesticated.
-            if Prey_now <= 0:
-                Preyscore = 0
-            else:
-                PreySearchCost_Now = PreySearchCost / (Prey_now / PreyDensity)        #find the actual search time for the amount of Prey at this time
-                if MinPreyEncountered >= MaxPreyEncountered:
-                    PreyEncountered_Now = MinPreyEncountered
-                else:
-                    PreyEncountered_Now = np.random.randint(MinPreyEncountered, MaxPreyEncountered)     # find how many prey are encountered at this time
-                Preyscore = PreyReturns / (PreySearchCost_Now + PreyHandlingCost)    #find the current return rate (kcal/hr) for Prey.
-            if Cereal_now <= 0:
-                Cerealscore = 0
-            else:
-                Cerealscore = (CerealReturns * CerealDensity_now ) / (CerealSearchCosts + (CombinedCerealHandlingCost *  CerealDensity_now))        #find the current return rate (kcal/hr for Cereal.
-            if np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Hunting prey is more profitable
-                if timebudget <= 0:
-                    Preyscore = 0
-                    pass
-                if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
-                    Preyscore = 0.
-                    pass
-                else:
-                    kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
-                    timebudget = timebudget - (PreySearchCost_Now + (PreyHandlingCost * PreyEncountered_Now))
-                    eatPrey = eatPrey + PreyEncountered_Now
-                    Prey_now = Prey_now - PreyEncountered_Now
-            elif np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty): # Harvesting cereal is more profitable
-                if timebudget <= 0:
-                    Cerealscore = 0
-                    pass
-                if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
-                    Cerealscore = 0
-                    pass
-                else:
-                    kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
-                    timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
-                    eatCereal = eatCereal + 1
-                    Cereal_now = Cereal_now - 1
-            else: # both equally profitable, so randomly choose hunting or harvesting
-                if np.random.randint(0,1) == 1:
-                    if timebudget <= 0:
-                        Preyscore = 0
-                        pass
-                    if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
-                        Preyscore = 0.
-                        pass
-                    else:
-                        kcalneed = kcalneed - PreyReturns ## QUESTION: should this be the return for a Prey minus the search/handle costs?? Or is that included in the daily dietary need (i.e., the energy expended searching and processing foodstuffs)
-                        timebudget = timebudget - (PreySearchCost_Now + PreyHandlingCost)
-                        eatPrey = eatPrey + PreyEncountered_Now
-                        Prey_now = Prey_now - PreyEncountered_Now
-                else:
-                    if timebudget <= 0:
-                        Cerealscore = 0
-                        pass
-                    if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
-                        Cerealscore = 0
-                        pass
-                    else:
-                        kcalneed = kcalneed - (CerealReturns * CerealDensity_now)
-                        timebudget = timebudget - CerealSearchCosts - (CombinedCerealHandlingCost * CerealDensity_now)
-                        eatCereal = eatCereal + 1
-                        Cereal_now = Cereal_now - 1
-            if timebudget <= 0:        #check if they've run out of foraging time, and stop the loop if necessary.
-                break
-            if Prey <= 0 and Cereal <= 0:    #check if they've run out of food, and stop the loop if necessary.
-                break
-            if Preyscore <= 0 and Cerealscore <= 0:    #check if they've run out of food, and stop the loop if necessary.
-                break
+        Cereal_now = p['Cereal']        #set up a variable to track Cereal patch exploitation this year
+        kcalneed, timebudget, Prey_now, Cereal_now, eatPrey, eatCereal = self.forage(kcalneed, timebudget, Prey_now, Cereal_now, self.patches, p, rng, None if profiler is None else profiler.year_bouts)        #this is the inner loop, doing foraging within the year, until kcal need is satisfied. It returns how many Prey and Cereal patches we ate this year
+        if profiler is not None: profiler.lap('foraging')
         ####### Now that the band has foraged for a year, update human, Prey, and Cereal populations, and implement selection
-        if (People * HumanKcal) - kcalneed <= (People * HumanKcal * StarvationThreshold):     #Check if they starved this year and just die deaths if so
-            People = People - deathdealer(HumanDeathRate*2, HumanBirthDeathFilter, People)
+        if (People * p['HumanKcal']) - kcalneed <= (People * p['HumanKcal'] * p['StarvationThreshold']):     #Check if they starved this year and just die deaths if so
+            People = People - deathdealer(p['HumanDeathRate']*2, p['HumanBirthDeathFilter'], People, rng)
         else: #otherwise, balance births and deaths, and adjust the population accordingly
-            People = People + babymaker(HumanBirthRate, HumanBirthDeathFilter, People) - deathdealer(HumanDeathRate, HumanBirthDeathFilter, People)
-        if MaxPreyMigrants == 0:
+            People = People + babymaker(p['HumanBirthRate'], p['HumanBirthDeathFilter'], People, rng) - deathdealer(p['HumanDeathRate'], p['HumanBirthDeathFilter'], People, rng)
+        if p['MaxPreyMigrants'] == 0:
             PreyMigrantsNow = 0
         else:
-            PreyMigrantsNow = np.random.randint(0, MaxPreyMigrants)
-        Prey = Prey_now + babymaker(PreyBirthRate, PreyBirthDeathFilter, Prey_now) - deathdealer(PreyDeathRate, PreyBirthDeathFilter, Prey_now) + PreyMigrantsNow #Adjust the Prey population by calculating the balance of natural births and deaths on the hunted population, and then add the migrants population
-        if People > MaximumPeople: People = MaximumPeople # don't allow human pop to exceed the limit we set
-        if Prey > MaxPrey: Prey = MaxPrey # don't allow Prey pop to exceed natural carrying capacity
+            PreyMigrantsNow = rng.randint(0, p['MaxPreyMigrants'])
+        Prey = Prey_now + babymaker(p['PreyBirthRate'], p['PreyBirthDeathFilter'], Prey_now, rng) - deathdealer(p['PreyDeathRate'], p['PreyBirthDeathFilter'], Prey_now, rng) + PreyMigrantsNow #Adjust the Prey population by calculating the balance of natural births and deaths on the hunted population, and then add the migrants population
+        if People > p['MaximumPeople']: People = p['MaximumPeople'] # don't allow human pop to exceed the limit we set
+        if Prey > p['MaxPrey']: Prey = p['MaxPrey'] # don't allow Prey pop to exceed natural carrying capacity
+        if profiler is not None: profiler.lap('demography')
         #This part is a bit complicated. We are adjusting the proportions of wild to domestic Cereal in JUST the Cereal patches that were exploited this year. We are also adjusting the density of individuals in those patches. This is the effect of the "artificial selection" exhibited by humans while exploiting those patches. At the same time, we are implementing a "diffusion" of wild-type characteristics back to all the patches. If they are used, selection might outweigh diffusion. If they aren't being used, then just diffusion occurs. In this version of the model, diffusion is density dependent, and is adjusted by (lat year's) the proportion of domestic to non-domestic Cereals left in the population.
-        patch_adjust = [] # make a matrix to do the selection/diffusion on the individual patches based on if they got used or not.
-        currentCerealDiffusionRate = np.random.normal(CerealDiffusionRate, (CerealDiffusionRate*SelectionDiffusionFilter)) * (1 - ProportionDomesticated[-1])
-        currentCerealSelectionRate = np.random.normal(CerealSelectionRate, (CerealSelectionRate*SelectionDiffusionFilter))
-        for x in range(1,int(Cereal+1)):
-            if x < eatCereal:
-                patch_adjust.append([currentCerealDiffusionRate-currentCerealSelectionRate, CerealCultivationDensity])
-            else:
-                patch_adjust.append([currentCerealDiffusionRate, -CerealCultivationDensity])
-        patch_adjustdf = pd.DataFrame(patch_adjust, columns=['sel', 'cult']) #turn the matrix into a pandas dataframe for easy matrix math
-        #patch_adjustdf.to_csv("patch_changes.csv") ## this is here for debugging purposes. Uncomment if you want the patch adjustments to be written to a file.
+        currentCerealDiffusionRate = rng.normal(p['CerealDiffusionRate'], (p['CerealDiffusionRate']*p['SelectionDiffusionFilter'])) * (1 - self.recorder.stats['ProportionDomesticated'][year - 1])
+        currentCerealSelectionRate = rng.normal(p['CerealSelectionRate'], (p['CerealSelectionRate']*p['SelectionDiffusionFilter']))
+        self.patches.adjust(eatCereal, currentCerealDiffusionRate, currentCerealSelectionRate, p['CerealCultivationDensity'], p['CerealDensity'], p['MaxCerealDensity']) # adjust the patch density and selection coefficient arrays in place, but only where the values will stay between CerealDensity and MaxCerealDensity, and between 1 and 0.
+        if profiler is not None: profiler.lap('patches')
+        #update the general stats and the patch time-series with the current year's data
+        self.recorder.record(year, People, (People * p['HumanKcal']) - kcalneed, Prey, eatPrey, eatCereal, self.patches)
+        if self.recorder.resources is not None:
+            self.recorder.record_resources(year, self.diet.eaten)
+        if profiler is not None:
+            profiler.lap('recording')
+            profiler.end_year(year)
+        self.People = People
+        self.Prey = Prey
+
+    def run(self, checkpoint=None, years=None, seconds=None, until=None):
+        '''Simulate all the remaining years (or until the run settles down, see convergence.py), and return the output recorder. If checkpoint is a file name, the complete state of the run is saved to it every "years" years and every "seconds" seconds (see checkpoint.py). If until is given, stop after that year instead (the run can be carried on by calling run() again)'''
+        convergence = self.convergence
+        profiler = self.profiler
+        saved = time.time()
+        end = self.params['Years'] if until is None else min(until, self.params['Years'])
+        while self.year < end and self.recorder.stopped is None:        #this is the outer loop, that does things at an annual resolution, counting the years down for the simulation
+            self.step()
+            converged = convergence.converged(self.year, self.People, self.Prey, self.patches, self.recorder.stats)
+            if profiler is not None: profiler.lap('convergence')
+            if converged:
+                self.recorder.pad(self.year, convergence.reason == "absorbing") # fill the rest of the years with this one
+                break
+            if checkpoint is not None and ((years and self.year % years == 0) or (seconds and time.time() - saved >= seconds)):
+                from checkpoint import save
+                save(self, checkpoint)
+                saved = time.time()
+        if profiler is not None:
+            profiler.stop()
+            self.recorder.profile = profiler.report(self.params, self.seed, self.year)
+        return self.recorder
 
-        Cereal_df['CerealDensity'] = Cereal_df['CerealDensity'] = Cereal_df['CerealDensity'].where((Cereal_df['CerealDensity'] + patch_adjustdf['cult'] > MaxCerealDensity - CerealCultivationDensity) | (Cereal_df['CerealDensity'] + patch_adjustdf['cult'] < CerealDensity + CerealCultivationDensity), other=Cereal_df['CerealDensity'] + patch_adjustdf['cult']) # adjust the patch density column, but only if the value will stay between CerealDensity and MaxCerealDensity.
 
-        Cereal_df['WildToDomesticatedProportion'] = Cereal_df['WildToDomesticatedProportion'].where((Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel'] > 1 - currentCerealDiffusionRate) | (Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel'] < 0 + currentCerealSelectionRate), other=Cereal_df['WildToDomesticatedProportion'] + patch_adjustdf['sel']) # adjust the selection coefficient column, but only if the value will stay between 1 and 0.
+def run_simulation(params=None, seed=None, profile=False):
+    '''Run the model once with the parameter overrides in the mapping params and the random seed seed, and return a recorders.Recorder holding the general stats and patch time series arrays. With profile=True, the recorder's profile attribute holds the profile report of the run (see profiling.py)'''
+    p = model_parameters(params)
+    if p['Engine'] == "numba" and (p['Landscape'] != "dense" or p['Bands'] > 1 or p['ForagingEngine'] == "diet"):
+        warnings.warn("The numba engine only works on the dense Landscape with a single band, and without the diet ForagingEngine, so this run uses the python engine instead")
+        params = p = dict(p, Engine="python")
+    if p['Engine'] == "numba":
+        from jit import run_jit
+        if not profile:
+            return run_jit(params, seed)
+        from profiling import Profiler
+        profiler = Profiler(p['Years'])
+        recorder = run_jit(params, seed)
+        profiler.stop()
+        recorder.profile = profiler.report(p, seed) # (only the total time, as the whole run is one compiled call)
+        return recorder
+    if p['Bands'] > 1:
+        from bands import run_bands
+        return run_bands(params, seed, profile=profile)
+    return Simulation(params, seed, profile).run()
 
-        #Cereal_df.to_csv('supposed_new_patches.csv') ## this is here for debugging purposes. Uncomment if you want the patch adjustments to be written to a file.
-        #update the patch time-series dataframes with the current year's data
-        patchdens_ts[year] = Cereal_df.CerealDensity
-        patchprop_ts[year] = Cereal_df.WildToDomesticatedProportion
-        ######## Okay, now update the live plot data
-        yr.append(year)
-        HumPop.append(People)
-        HumanKcalPrey.append((People * HumanKcal) - kcalneed)
-        PreyPop.append(Prey)
-        CerealPop.append(np.sum(Cereal_df.CerealDensity)/1000.)
-        PreyKilled.append(eatPrey)
-        CerealExploited.append(eatCereal)
-        ProportionDomesticated.append(1 - np.mean(Cereal_df.WildToDomesticatedProportion))
-        AverageCerealDensity.append((np.mean(Cereal_df.CerealDensity))/1000.)
-    ######
-    ###### Simulation has ended, write stats
-    GeneralStatsFile = '%s%sSimulation_general_stats.%s.csv' % (os.getcwd(), os.sep, label)
-    statsout = pd.DataFrame(data=np.array([yr, HumPop, HumanKcalPrey, PreyPop, PreyKilled, CerealPop, CerealExploited, ProportionDomesticated, AverageCerealDensity]).T, columns = ["Year","Total Human Population","Human Kcal Deficit","Total Prey Animals Population","Number of Prey Animals Eaten","Total Cereal Population (*10^3)","Number of Cereal Patches Exploited","Proportion of Domestic-Type Cereal","Average Cereal Patch Density (*10^3)"])      # put the main stats data in a pandas data frame for easy formatting
-    statsout.to_csv(GeneralStatsFile, float_format='%.5f')
-    CerealDensityStatsFile = '%s%sSimulation_millet_patch_density_stats.%s.csv' % (os.getcwd(), os.sep, label)
-    patchdens_ts.to_csv(CerealDensityStatsFile, float_format='%.5f')
-    CerealProportionStatsFile = '%s%sSimulation_millet_patch_domestic_proportion_stats.%s.csv' % (os.getcwd(), os.sep, label)
-    patchprop_ts.to_csv(CerealProportionStatsFile, float_format='%.5f')
-    sys.exit(0)
 
+def write_output(recorder, label, params, args):
+    '''Write out the output of one run as the command line arguments args ask: fold it into a summary file, append it to the sweep store, or write its CSV files. The profile report of a profiled run is written out too, with the time this took'''
+    start = time.perf_counter()
+    if args["summary"] is not None:
+        from summaries import fold, summary_patches
+        p = model_parameters(params)
+        fold(args["summary"], recorder, p['Years'], summary_patches(p), label) # reduce the run into its experiment's summary statistics (once, even if the run is retried)
+    elif args["store"] is not None:
+        from store import SweepStore
+        with SweepStore(args["store"], 'a') as store: # (only held open, and locked, while this run is appended, so that other processes can append to it while this one simulates)
+            store.put(label, recorder)
+    else:
+        recorder.write_csv(label, patches=args["patches"], every=args["every"]) # write the general stats, patch density and patch domestic proportion files to the current working directory
+    if getattr(recorder, "profile", None) is not None: # (runs from the result cache weren't simulated, so have nothing to report)
+        from profiling import write_report
+        recorder.profile["phases"]["output"] += time.perf_counter() - start
+        write_report(recorder.profile, label)
+
+
+if __name__ == "__main__":
+    #Get values from command line variables
+    args = vars(parser.parse_args())
+    params = {}
+    if args["config"] is not None:
+        from manifest import load_config
+        params.update(load_config(args["config"])) # start from the settings saved by the GUI
+    params.update((name, args[name]) for name in PARAMETERS if args[name] is not None)
+    cachesize = None if args["cachesize"] is None else int(args["cachesize"] * 1024**3)
+    if model_parameters(params)['Landscape'] == "compact" and args["patches"] not in (None,) + COMPACT_POLICIES and args["summary"] is None and args["store"] is None:
+        parser.error('--patches %s would expand the runs of patches of the compact Landscape into full Years x Cereal arrays; use --patches decimate (the default there) or none' % args["patches"])
+    if args["manifest"] is not None:
+        ####### Run every run in the manifest, with its own parameters on top of the ones above
+        from manifest import read_manifest, run_manifest
+        runs = read_manifest(args["manifest"])
+        for n, run in enumerate(runs):
+            run["params"] = dict(params, **run["params"])
+            if run["seed"] is None and args["seed"] is not None:
+                run["seed"] = run_seed(args["seed"], n + 1, 0)
+        overrides = dict((run["label"], run["params"]) for run in runs)
+        if args["burnin"] is not None:
+            from burnin import run_branches
+            results = run_branches(params, args["seed"], args["burnin"], runs, args["processes"] or None, args["profile"]) # (the result cache doesn't apply to branches)
+        else:
+            results = run_manifest(runs, args["processes"] or None, args["cache"], cachesize, args["profile"])
+        for label, recorder in results:
+            print("Finished run %s" % label)
+            write_output(recorder, label, overrides[label], args)
+    elif args["burnin"] is not None:
+        parser.error("--burnin needs a --manifest of the branches to fork")
+    else:
+        ####### The simulation starts here.
+        simulate = lambda params, seed: run_simulation(params, seed, args["profile"])
+        if args["checkpoint"] is not None:
+            import checkpoint
+            simulate = lambda params, seed: checkpoint.run(params, seed, args["checkpoint"], args["checkpointyears"], args["checkpointseconds"], args["resume"], args["profile"])
+        if args["cache"] is not None:
+            from cache import ResultCache
+            cache = ResultCache(args["cache"], cachesize)
+            recorder, cached = cache.run(params, args["seed"], simulate)
+        else:
+            recorder = simulate(params, args["seed"])
+        ###### Simulation has ended, write stats
+        write_output(recorder, args["label"], params, args)
+        if args["checkpoint"] is not None and os.path.exists(args["checkpoint"]):
+            os.remove(args["checkpoint"]) # the run is done, so its checkpoint isn't needed any more
+    sys.exit(0)
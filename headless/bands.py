@@ -0,0 +1,213 @@
+#!usr/bin/python
+
+# Several forager bands sharing one landscape
+############################
+# With Bands > 1 (on the "grid" Landscape, see landscape.py), run_simulation() runs BandSimulation: Bands bands, each with its own population (starting at People and capped at MaximumPeople) and its own camp on the grid, all hunting the one Prey population and harvesting the one set of Cereal patches. The camps are spread evenly over the grid (one in the middle of each cell of a near square lattice of Bands cells), unless they are given to BandSimulation.
+# Contention is resolved within each year. The bands forage in rounds, and every band that is still foraging takes one bout per round, with the same noisy diet breadth decision as the single band model:
+#   the bands that hunt take their Prey one after the other, in a random order, so a band only gets Prey if there are some left when its turn comes (and loses the bout, without spending time on it, if not),
+#   the bands that harvest each claim the nearest patch to their own camp that nobody has harvested yet this year. If several bands claim the same patch, one of them (at random) gets it, and the others lose the bout (without spending time on it) and claim their next nearest patch in the next round.
+# Every step of a round is one NumPy operation across the bands, so a round costs about as much for 100 bands as for 1, and the number of rounds in a year is the number of bouts of the busiest band, not the sum over the bands. Each band keeps its own distance ranking of the patches (from landscape.GridIndex, as int32, so Bands x Cereal x 4 bytes) and a pointer to its nearest patch that hasn't been harvested yet, which skips the patches harvested by other bands a block at a time.
+# After foraging, the demography (babymaker/deathdealer) is one draw per band, the Prey population is updated once from what all the bands left of it, and the patch update treats every patch that any band harvested as exploited (with one draw of the selection and diffusion rates for the whole landscape), followed by the neighbour diffusion of landscape.py.
+# The general stats are summed over the bands, and BandRecorder also keeps the population, Prey eaten and patches harvested of every band in every year (written to recorders.BAND_STATS_FILE). A run of one band (Bands = 1) is the single band model, with its own foraging engines, not BandSimulation.
+
+import numpy as np
+from AgModel_headless import Simulation, model_parameters, babymaker, deathdealer
+from convergence import Convergence
+from foraging import cereal_payoffs, prey_search_cost
+from landscape import GridIndex, NeighbourDiffusion
+from patches import CerealPatches
+from recorders import BandRecorder
+
+BLOCK = 64 # Number of patches of its ranking that a band looks ahead at once for the next one that hasn't been harvested
+
+
+def spread_camps(bands, width, height):
+    '''Returns the (x, y) camps of bands bands spread evenly over a grid of width x height patches: the middle of each cell of a near square lattice, row by row'''
+    columns = int(np.ceil(np.sqrt(bands * width / float(height))))
+    columns = min(max(columns, 1), bands)
+    rows = -(-bands // columns)
+    return [((column + 0.5) * width / columns, (row + 0.5) * height / rows) for row, column in (divmod(b, columns) for b in range(bands))]
+
+
+class SharedPatches(CerealPatches):
+    '''CerealPatches on a grid, in grid order (row by row), that any of the bands can harvest. p is the full set of model parameters'''
+    def __init__(self, p):
+        CerealPatches.__init__(self, p['Cereal'], p['CerealDensity'], p['WildToDomesticatedProportion'])
+        self.index = GridIndex(self.n, p['GridWidth'])
+        self.diffusion = NeighbourDiffusion(self.n, self.index.width, self.index.height, p['NeighbourDiffusion'])
+
+    def adjust(self, exploited, diffusion, selection, cultivation, mindensity, maxdensity):
+        '''Apply one year of selection/diffusion and cultivation density change, as CerealPatches.adjust() does, but to the patches where the boolean array exploited is True (the patches that any band harvested this year), and then the neighbour diffusion'''
+        new = self._new
+        density = self.CerealDensity
+        np.add(density, np.where(exploited, cultivation, -cultivation), out=new)
+        self._apply(density, mindensity + cultivation, maxdensity - cultivation)
+        proportion = self.WildToDomesticatedProportion
+        np.add(proportion, np.where(exploited, diffusion - selection, diffusion), out=new)
+        self._apply(proportion, 0 + selection, 1 - diffusion)
+        self.diffusion.apply(proportion)
+        # (the prefix sums aren't refreshed, as the bands read the state of single patches)
+
+
+class BandSimulation(Simulation):
+    '''The state of a run of several forager bands sharing one landscape: as Simulation, with People the total over the bands, plus the population, camp and patch ranking of each band'''
+    def __init__(self, params=None, seed=None, camps=None, profile=False):
+        '''params, seed and profile are as for Simulation. camps is a list of the (x, y) camp of each band, in patch widths from the corner of the grid (default spreads Bands camps evenly over the grid, see spread_camps())'''
+        self.params = p = model_parameters(params)
+        if p['Landscape'] != "grid":
+            raise ValueError("Several Bands need the grid Landscape")
+        if p['Resources']:
+            raise ValueError("Several Bands only forage on Prey and Cereal, not extra Resources")
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.profiler = None
+        if profile:
+            from profiling import Profiler
+            self.profiler = Profiler(p['Years'])
+            self.profiler.count(self.rng)
+        self.year = 0
+        self.patches = SharedPatches(p)
+        index = self.patches.index
+        N = self.patches.n
+        camps = spread_camps(int(p['Bands']), index.width, index.height) if camps is None else camps
+        self.bands = K = len(camps)
+        self.camps = np.array([index.cell(x, y) for x, y in camps], dtype=float).reshape(K, 2) # the cell (column, row) of each camp
+        self.rank = np.empty((K, N), dtype=np.int32) # the patches nearest to each camp first
+        for b, (x, y) in enumerate(camps):
+            self.rank[b] = index.ranking(x, y)[0]
+        self.population = np.full(K, p['People'], dtype=float)
+        self.People = self.population.sum()
+        self.Prey = p['Prey']
+        # which patches have been harvested this year, and the position in its ranking of the next patch of each band
+        self.taken = np.zeros(N, dtype=bool)
+        self.pos = np.zeros(K, dtype=np.int64)
+        self._window = np.arange(BLOCK)
+        self.recorder = BandRecorder(p['Years'], N, K)
+        zeros = np.zeros(K)
+        self.recorder.record(0, self.People, 0, self.Prey, 0, 0, self.patches) # update with year 0 data
+        self.recorder.record_bands(0, self.population, zeros, zeros)
+        self.convergence = Convergence(p)
+
+    def get_state(self, history=True):
+        raise ValueError("Checkpoints and branches don't work with several Bands")
+
+    def distance(self, bands, cells):
+        '''Returns the distance (in patch widths) of each of the patches cells from the camp of the matching one of bands'''
+        width = self.patches.index.width
+        return np.hypot(cells % width - self.camps[bands, 0], cells // width - self.camps[bands, 1])
+
+    def _advance(self, bands):
+        '''Move the pointers of bands on past the patches that have been harvested this year, to their nearest patch that is still there (or to Cereal, if there are none left)'''
+        N = self.patches.n
+        pos = self.pos
+        bands = bands[pos[bands] < N]
+        bands = bands[self.taken[self.rank[bands, pos[bands]]]]
+        while bands.size:
+            window = pos[bands, None] + self._window
+            free = ~self.taken[self.rank[bands[:, None], np.minimum(window, N - 1)]] | (window >= N)
+            found = free.any(axis=1)
+            pos[bands] = np.where(found, window[np.arange(bands.size), np.argmax(free, axis=1)], window[:, -1] + 1)
+            bands = bands[~found]
+
+    def forage(self, rng, bouts=None):
+        '''Run one year of foraging for all the bands, a round of one bout per band at a time. Returns arrays with the kcal need left over, the number of Prey eaten and the number of Cereal patches harvested by each band, and the Prey left. If bouts is given (a list of two counts), the number of hunting and harvesting bouts are added to it'''
+        p = self.params
+        U = p['ForagingUncertainty']
+        N = self.patches.n
+        proportion, density = self.patches.WildToDomesticatedProportion, self.patches.CerealDensity
+        kcalneed = self.population * p['HumanKcal']        # find the number of kcals needed by each band this year
+        timebudget = self.population * p['ForagingHours']       # find the time budget for each band this year
+        Prey_now = self.Prey
+        eatPrey = np.zeros(self.bands)
+        eatCereal = np.zeros(self.bands, dtype=int)
+        taken, pos = self.taken, self.pos
+        taken[:] = False
+        pos[:] = 0
+        encounters = p['MinPreyEncountered'] < p['MaxPreyEncountered']
+        active = np.flatnonzero((kcalneed > 0) & ((Prey_now > 0) | (N > 0))) # the bands that are still foraging this year
+        while active.size:
+            harvest = pos[active] < N
+            cells = self.rank[active, np.minimum(pos[active], N - 1)] # the nearest patch of each band that is still there
+            search = p['CerealSearchCosts'] + p['TravelCost'] * self.distance(active, cells)
+            CerealGain, CerealHandling, Cerealscore = cereal_payoffs(p, proportion[cells], density[cells], search)
+            Cerealscore = np.where(harvest, Cerealscore, 0.)
+            if Prey_now > 0:
+                PreySearchCost_Now = prey_search_cost(p, Prey_now)
+                Preyscore = p['PreyReturns'] / (PreySearchCost_Now + p['PreyHandlingCost'])
+            else:
+                Preyscore = 0.
+            choice = rng.normal(Preyscore, Preyscore * U, active.size) > rng.normal(Cerealscore, Cerealscore * U) # True where hunting Prey looks more profitable than harvesting Cereal
+            harvest &= ~choice
+            hunters = active[choice] if Prey_now > 0 else active[:0]
+            if hunters.size:
+                if encounters:
+                    enc = rng.randint(p['MinPreyEncountered'], p['MaxPreyEncountered'], hunters.size)
+                else:
+                    enc = np.full(hunters.size, p['MinPreyEncountered'])
+                if hunters.size > 1:
+                    order = rng.permutation(hunters.size)
+                    hunters, enc = hunters[order], enc[order]
+                got = Prey_now - (np.cumsum(enc) - enc) > 0 # the bands that find Prey left when their turn comes
+                hunters, enc = hunters[got], enc[got]
+                kcalneed[hunters] -= p['PreyReturns']
+                timebudget[hunters] -= PreySearchCost_Now + (p['PreyHandlingCost'] * enc)
+                eatPrey[hunters] += enc
+                Prey_now = Prey_now - enc.sum().item()
+            claims = np.flatnonzero(harvest)
+            if claims.size > 1:
+                claims = claims[rng.permutation(claims.size)]
+                claims = claims[np.unique(cells[claims], return_index=True)[1]] # the first claim of each patch (in the random order) gets it
+            if claims.size:
+                harvesters = active[claims]
+                kcalneed[harvesters] -= CerealGain[claims]
+                timebudget[harvesters] -= search[claims] + CerealHandling[claims]
+                eatCereal[harvesters] += 1
+                taken[cells[claims]] = True
+                self._advance(active)
+            if bouts is not None:
+                bouts[0] += hunters.size
+                bouts[1] += claims.size
+            # bands stop foraging once their kcal need is met, or they run out of time or food
+            active = active[(kcalneed[active] > 0) & (timebudget[active] > 0) & ((Prey_now > 0) | (pos[active] < N))]
+        return kcalneed, Prey_now, eatPrey, eatCereal
+
+    def step(self):
+        '''Simulate one year of all the bands'''
+        p = self.params
+        profiler = self.profiler
+        rng = self.rng if profiler is None else profiler.rng
+        if profiler is not None: profiler.mark()
+        People = self.population
+        self.year = year = self.year + 1
+        kcalneed, Prey_now, eatPrey, eatCereal = self.forage(rng, None if profiler is None else profiler.year_bouts)
+        if profiler is not None: profiler.lap('foraging')
+        ####### Now that the bands have foraged for a year, update the human populations of the bands, the shared Prey population, and the Cereal patches
+        starved = (People * p['HumanKcal']) - kcalneed <= (People * p['HumanKcal'] * p['StarvationThreshold'])     #Check which bands starved this year, and just die deaths in those
+        starving = People - deathdealer(p['HumanDeathRate']*2, p['HumanBirthDeathFilter'], People, rng)
+        growing = People + babymaker(p['HumanBirthRate'], p['HumanBirthDeathFilter'], People, rng) - deathdealer(p['HumanDeathRate'], p['HumanBirthDeathFilter'], People, rng)
+        People = np.minimum(np.where(starved, starving, growing), p['MaximumPeople']) # don't allow any band to exceed the limit we set
+        if p['MaxPreyMigrants'] == 0:
+            PreyMigrantsNow = 0
+        else:
+            PreyMigrantsNow = rng.randint(0, p['MaxPreyMigrants'])
+        Prey = Prey_now + babymaker(p['PreyBirthRate'], p['PreyBirthDeathFilter'], Prey_now, rng) - deathdealer(p['PreyDeathRate'], p['PreyBirthDeathFilter'], Prey_now, rng) + PreyMigrantsNow
+        if Prey > p['MaxPrey']: Prey = p['MaxPrey'] # don't allow Prey pop to exceed natural carrying capacity
+        if profiler is not None: profiler.lap('demography')
+        # selection and diffusion, as in Simulation.step(), on every patch that any band harvested this year
+        currentCerealDiffusionRate = rng.normal(p['CerealDiffusionRate'], (p['CerealDiffusionRate']*p['SelectionDiffusionFilter'])) * (1 - self.recorder.stats['ProportionDomesticated'][year - 1])
+        currentCerealSelectionRate = rng.normal(p['CerealSelectionRate'], (p['CerealSelectionRate']*p['SelectionDiffusionFilter']))
+        self.patches.adjust(self.taken, currentCerealDiffusionRate, currentCerealSelectionRate, p['CerealCultivationDensity'], p['CerealDensity'], p['MaxCerealDensity'])
+        if profiler is not None: profiler.lap('patches')
+        self.recorder.record(year, People.sum(), ((People * p['HumanKcal']) - kcalneed).sum(), Prey, eatPrey.sum(), eatCereal.sum(), self.patches)
+        self.recorder.record_bands(year, People, eatPrey, eatCereal)
+        if profiler is not None:
+            profiler.lap('recording')
+            profiler.end_year(year)
+        self.population = People
+        self.People = People.sum()
+        self.Prey = Prey
+
+
+def run_bands(params=None, seed=None, camps=None, profile=False):
+    '''Run the model with several bands sharing one landscape, with the parameter overrides in the mapping params, the random seed seed and the band camps camps (see BandSimulation), and return the recorders.BandRecorder'''
+    return BandSimulation(params, seed, camps, profile).run()
@@ -0,0 +1,200 @@
+#!usr/bin/python
+
+# Benchmark suite for the headless model
+############################
+# Times the model, and the paths that a sweep goes through, along scaling axes, with fixed seeds, so that changes to the foraging loop, the patch update, the sweep machinery or the amalgamation can be checked for speed:
+#   "model" runs one simulation (run_simulation()) at a time, varying one of Years, Cereal, People and MaximumPeople at a time from BASE, and reports its total time. The throughput comes from unprofiled runs, so that the profiler's overhead isn't counted. One more run with profiling on (see profiling.py) gives the time of each phase of the yearly loop.
+#   "sweep" runs a small sweep (SWEEP_EXPERIMENTS experiments at BASE) through parallelizer.execute() in each of the MODES, varying the number of replicates (repetitions) of each experiment. The output is written to CSV files in a temporary directory, as a real sweep would.
+#   "amalgamate" reads the output of that sweep back with stats_amalgamator.amalgamate(), for each number of replicates.
+# Each case is run "repeat" times and the fastest time is kept. Its throughput is the number of simulated years (times the number of runs) per second. With --save, the results are saved as the baseline (BASELINE_FILE). Otherwise they are compared with the baseline, if there is one, and the script exits with status 1 if the throughput of any case has dropped by more than the threshold (a fraction of the baseline). Baselines only make sense on the machine they were saved on.
+#     python3 benchmark.py [--suites model sweep amalgamate] [--axes Years Cereal ...] [--repeat 3] [--threshold 0.2] [--save] [--baseline FILE] [--output FILE]
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+from AgModel_headless import run_simulation, run_seed
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, 'benchmark_baseline.json')
+RESULTS_FILE = 'Benchmark_results.csv'
+SEED = 1 # Base seed of every case, so that each case simulates exactly the same runs every time
+THRESHOLD = 0.2 # Default fraction of the baseline throughput that a case can lose before it counts as a regression
+BASE = {'Years': 500, 'Cereal': 100, 'People': 50, 'MaximumPeople': 3000} # The parameters that the axes vary from
+AXES = {'Years': [250, 500, 1000, 2000],
+        'Cereal': [50, 100, 200, 400],
+        'People': [25, 50, 100, 200],
+        'MaximumPeople': [100, 300, 1000, 3000],
+        'replicates': [2, 4, 8, 16]} # The values of each scaling axis. replicates is the number of repetitions of each experiment of the "sweep" and "amalgamate" suites, the others are model parameters
+SUITES = ('model', 'sweep', 'amalgamate')
+MODES = ('subprocess', 'pool', 'ensemble') # The parallelizer.py modes that the "sweep" suite runs
+SWEEP_EXPERIMENTS = 2 # Number of experiments in the sweeps
+
+
+def environment():
+    '''Returns a description of the machine and software that the benchmarks run on, to keep with a baseline'''
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "system": platform.system(), "cpus": os.cpu_count()}
+
+
+def bench_model(axis, value, repeat):
+    '''Time one run with axis set to value, and return the result of the fastest of repeat unprofiled tries, with the phase times of one profiled run'''
+    params = dict(BASE, **{axis: value})
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        run_simulation(params, SEED)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    profile = run_simulation(params, SEED, profile=True).profile
+    result = {"suite": "model", "axis": axis, "value": value, "seconds": best, "throughput": params['Years'] / best}
+    result.update(("%s seconds" % phase, seconds) for phase, seconds in profile["phases"].items() if phase != "output")
+    return result
+
+
+def sweep(path, mode, replicates):
+    '''Run a sweep of SWEEP_EXPERIMENTS experiments of replicates repetitions each through parallelizer.py in mode, writing its output to the directory path. Returns the time it took'''
+    import parallelizer
+    parallelizer.mode = mode
+    parallelizer.seed = SEED
+    parallelizer.cache = parallelizer.store = None
+    parallelizer.reduce = parallelizer.profile = False
+    parallelizer.patches = "full"
+    tasks = []
+    experiments = []
+    commands = []
+    for i in range(SWEEP_EXPERIMENTS):
+        labels = ['%s.%s' % (i + 1, str(x).zfill(len(str(replicates)))) for x in range(replicates)]
+        if mode == "subprocess": # (the runs start in path, so run the model script from here, with this python)
+            commands.extend([sys.executable, os.path.join(HERE, 'AgModel_headless.py')] + parallelizer.command(BASE, label)[2:] + ['--seed', '%s' % run_seed(SEED, i + 1, x)] for x, label in enumerate(labels))
+        tasks.extend({"experiment": i + 1, "params": dict(BASE), "seed": run_seed(SEED, i + 1, x), "label": label} for x, label in enumerate(labels))
+        experiments.append({"number": i + 1, "params": dict(BASE), "seed": run_seed(SEED, i + 1, replicates), "labels": labels})
+    cwd = os.getcwd()
+    os.chdir(path) # the runs are written to the current working directory
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            progress = parallelizer.execute(commands, tasks, experiments)
+        seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    if progress.failed:
+        raise RuntimeError("%s runs of the benchmark sweep failed: %s" % (len(progress.failed), progress.failed))
+    return seconds
+
+
+def bench_sweeps(replicates, repeat, suites):
+    '''Time the sweeps (in each of MODES) and the amalgamation of their output, with replicates repetitions of each experiment, and return the results of the fastest of repeat tries of each'''
+    from stats_amalgamator import amalgamate
+    results = []
+    years = BASE['Years'] * SWEEP_EXPERIMENTS * replicates
+    path = tempfile.mkdtemp(prefix='agmodel_benchmark_')
+    try:
+        for mode in MODES:
+            if 'sweep' not in suites and mode != "pool": # (the "amalgamate" suite only needs the output of one sweep)
+                continue
+            best = None
+            for n in range(repeat if 'sweep' in suites else 1):
+                for name in os.listdir(path):
+                    os.remove(os.path.join(path, name))
+                seconds = sweep(path, mode, replicates)
+                best = seconds if best is None else min(best, seconds)
+            if 'sweep' in suites:
+                results.append({"suite": "sweep %s" % mode, "axis": "replicates", "value": replicates, "seconds": best, "throughput": years / best})
+        if 'amalgamate' in suites:
+            best = None
+            for n in range(repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    amalgamate(SWEEP_EXPERIMENTS, replicates, path)
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            results.append({"suite": "amalgamate", "axis": "replicates", "value": replicates, "seconds": best, "throughput": years / best})
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def run(suites=SUITES, axes=None, repeat=3):
+    '''Run the benchmark suites along axes (all of AXES if None), and return the results as a pandas DataFrame with a row per case'''
+    axes = list(AXES) if axes is None else axes
+    results = []
+    for axis in axes:
+        for value in AXES[axis]:
+            if axis == 'replicates':
+                new = bench_sweeps(value, repeat, suites) if set(suites) & {'sweep', 'amalgamate'} else []
+            else:
+                new = [bench_model(axis, value, repeat)] if 'model' in suites else []
+            for result in new:
+                print("%-16s %-14s %8s  %8.3f s  %10.0f years/s" % (result["suite"], result["axis"], result["value"], result["seconds"], result["throughput"]))
+            results.extend(new)
+    return pd.DataFrame(results)
+
+
+def case(result):
+    '''Returns the name of the case of a result (a row of the results), that it is matched to the baseline by'''
+    return "%s %s=%s" % (result["suite"], result["axis"], result["value"])
+
+
+def save_baseline(results, filename=BASELINE_FILE):
+    '''Save results as the baseline, keeping the cases of an earlier baseline that weren't run this time'''
+    baseline = {"cases": {}}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            baseline = json.load(f)
+    baseline["environment"] = environment()
+    baseline["cases"].update((case(result), {"seconds": result["seconds"], "throughput": result["throughput"]}) for n, result in results.iterrows())
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+def compare(results, filename=BASELINE_FILE, threshold=THRESHOLD):
+    '''Compare results with the baseline in filename, and return the cases whose throughput dropped by more than threshold (a fraction of the baseline) as (case, baseline throughput, throughput) tuples'''
+    with open(filename) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != environment():
+        print("Warning: the baseline was saved on a different machine or software (%s), so the comparison may not mean much" % baseline.get("environment"))
+    regressions = []
+    for n, result in results.iterrows():
+        old = baseline["cases"].get(case(result))
+        if old is None:
+            continue
+        change = result["throughput"] / old["throughput"] - 1
+        print("%-40s %+6.1f%%" % (case(result), 100 * change))
+        if change < -threshold:
+            regressions.append((case(result), old["throughput"], result["throughput"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the headless model, sweeps and amalgamation along scaling axes, and check for regressions against a saved baseline')
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES), help='Benchmark suites to run (default all)')
+    parser.add_argument('--axes', nargs='+', choices=list(AXES), default=list(AXES), help='Scaling axes to run (default all)')
+    parser.add_argument('--repeat', metavar='3', type=int, default=3, help='Number of times to run each case (the fastest is kept)')
+    parser.add_argument('--threshold', metavar='%s' % THRESHOLD, type=float, default=THRESHOLD, help='Fraction of the baseline throughput that a case can lose before it counts as a regression')
+    parser.add_argument('--save', action='store_true', help='Save the results as the baseline, instead of comparing them with it')
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE_FILE, help='File name of the baseline (default %s)' % os.path.basename(BASELINE_FILE))
+    parser.add_argument('--output', metavar='FILE', default=RESULTS_FILE, help='CSV file to write the results (the scaling curves) to')
+    args = parser.parse_args()
+    results = run(args.suites, args.axes, args.repeat)
+    results.to_csv(args.output, index=False)
+    if args.save:
+        save_baseline(results, args.baseline)
+        print("Saved the baseline to %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            for name, old, new in regressions:
+                print("Regression: %s went from %.0f to %.0f years/s" % (name, old, new))
+            sys.exit(1)
+        print("No regressions past %.0f%%" % (100 * args.threshold))
+    else:
+        print("There is no baseline to compare with yet, save one with --save")
+    sys.exit(0)
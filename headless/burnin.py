@@ -0,0 +1,95 @@
+#!usr/bin/python
+
+# Shared burn-in with forked scenario branches
+############################
+# Many experiments share the same first stretch of years, and only change a parameter (e.g. CerealSelectionRate) from some year onward. Instead of simulating that shared prefix again for every branch, burn_in() simulates it once, and run_branches() forks any number of scenario branches from the state at the end of it, each with its own parameter overrides and its own random number stream (seeded from an independent SeedSequence stream, see AgModel_headless.run_seed()), and runs them back to back or in parallel.
+# The branches share the prefix without copying it around: each worker process gets the state at the fork once (with only the last year of the patch time series), sends back only the years after the fork, and the full output of each branch is put together from the shared prefix only while it is written out.
+# Overrides of the parameters that only set the starting state (People, Prey, CerealDensity, WildToDomesticatedProportion) have no effect in a branch, and Years, Cereal and Resources can't be changed. If the burn-in settles down and stops early (see convergence.py), every branch is a copy of it, as a full run would have been. Branches always use the "python" engine.
+
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from AgModel_headless import Simulation, model_parameters
+from recorders import Recorder
+
+FIXED = ('Years', 'Cereal', 'Resources') # Parameters that a branch can't change, as they size the output
+
+
+def burn_in(params, seed, years):
+    '''Run the model with the parameter overrides params and the random seed seed for the first years years, and return the Simulation, ready to be forked'''
+    p = dict(model_parameters(params), Engine="python")
+    if p['Landscape'] == "compact" or p['Bands'] > 1:
+        raise ValueError("Branches don't work on the compact Landscape or with several Bands")
+    simulation = Simulation(p, seed)
+    simulation.run(until=years)
+    return simulation
+
+
+def fork(state, params, seed, profile=False):
+    '''Returns a Simulation that carries on from state (a dict of arrays from Simulation.get_state()) with the parameter overrides params on top of the ones of the burn-in, and a random number generator seeded with seed. With profile=True, the branch is profiled'''
+    base = json.loads(str(state["params"]))
+    p = model_parameters(dict(base, **params))
+    for name in FIXED:
+        if p[name] != base[name]:
+            raise ValueError("A branch can't change %s (it is %s in the burn-in)" % (name, base[name]))
+    p['Engine'] = "python"
+    state = dict(state, params=np.array(json.dumps(p, default=lambda x: x.item())), seed=np.array(json.dumps(seed)))
+    simulation = Simulation.from_state(state, profile)
+    simulation.rng.seed(seed) # its own random number stream from the fork on
+    return simulation
+
+
+def _init_worker(state, profile=False):
+    '''Keep the state at the fork in each worker process'''
+    global fork_state, profiling
+    fork_state = state
+    profiling = profile
+
+
+def _run_branch(run):
+    '''Run one branch from the state at the fork, and return its label and the output of the years from the fork on'''
+    simulation = fork(fork_state, run["params"], run["seed"], profiling)
+    recorder = simulation.run()
+    year = int(fork_state["year"])
+    suffix = Recorder.from_arrays(recorder.stats, recorder.density[year:], recorder.proportion[year:])
+    suffix.stopped = recorder.stopped
+    suffix.profile = recorder.profile
+    if recorder.resources is not None: # (a few numbers per year, so all of them are sent back)
+        suffix.resource_names, suffix.resources = recorder.resource_names, recorder.resources
+    return run["label"], suffix
+
+
+def run_branches(params, seed, years, runs, processes=1, profile=False):
+    '''Simulate the burn-in (the parameter overrides params and the random seed seed, for the first years years) once, and fork each of runs (dicts with the "params", "label" and "seed" of each branch) from the end of it. Yield the label and output recorder of each branch as it finishes. With processes=1 the branches are run one after another in this process, otherwise on a warm pool of that many worker processes (None for one per CPU). With profile=True, each branch is profiled from the fork on (the burn-in isn't)'''
+    simulation = burn_in(params, seed, years)
+    if simulation.recorder.stopped is not None: # the burn-in settled down before the fork, so there's nothing left to branch
+        for run in runs:
+            yield run["label"], simulation.recorder
+        return
+    year = simulation.year
+    prefix = simulation.recorder
+    state = simulation.get_state(history=False)
+
+    def join(suffix):
+        '''Put the full output of a branch together from the shared prefix and the years from the fork on'''
+        recorder = Recorder.from_arrays(suffix.stats, np.concatenate((prefix.density[:year], suffix.density)), np.concatenate((prefix.proportion[:year], suffix.proportion)))
+        recorder.stopped = suffix.stopped
+        recorder.profile = suffix.profile
+        if suffix.resources is not None:
+            recorder.resource_names, recorder.resources = suffix.resource_names, suffix.resources
+        return recorder
+
+    if processes == 1:
+        _init_worker(state, profile)
+        for run in runs:
+            label, suffix = _run_branch(run)
+            yield label, join(suffix)
+        return
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(state, profile)) as pool:
+        futures = [pool.submit(_run_branch, run) for run in runs]
+        for future in as_completed(futures):
+            label, suffix = future.result()
+            yield label, join(suffix)
@@ -0,0 +1,120 @@
+#!usr/bin/python
+
+# Content-addressed result cache for AgModel_headless.py runs
+############################
+# Stores the output arrays of finished runs under a key that is a hash of the full parameter set (defaults included), the random seed and the model version, so that a sweep can serve or skip runs that have already been done (e.g., to resume a sweep that died partway, or to add values to a sweep), and a run with changed parameters can never be mistaken for an old one. Only seeded runs are cached, since a run without a seed can't be repeated.
+# The cache is a directory of compressed .npz files, one per run. It has a size cap: when it grows past the cap, the least recently used entries (by file modification time, which is refreshed every time an entry is read) are deleted.
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from AgModel_headless import MODEL_VERSION, model_parameters
+from recorders import from_buffers
+
+# The source files whose contents determine the model's output. Any change to them changes the model version used in the cache keys
+MODEL_SOURCES = ['AgModel_headless.py', 'patches.py', 'landscape.py', 'bands.py', 'foraging.py', 'recorders.py', 'convergence.py', 'jit.py']
+
+
+def model_version():
+    '''Returns a version string for the model: MODEL_VERSION plus a digest of the model source files, so that cached results are never served for a different version of the code'''
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in MODEL_SOURCES:
+        with open(os.path.join(here, name), 'rb') as f:
+            digest.update(f.read())
+    return "%s-%s" % (MODEL_VERSION, digest.hexdigest()[:16])
+
+
+def run_key(params, seed, version=None):
+    '''Returns the cache key (a hex digest) of a run with the parameter overrides params and the seed seed'''
+    version = model_version() if version is None else version
+    p = dict((name, float(value) if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) else value) for name, value in model_parameters(params).items()) # so that e.g. 1000000 and 1000000.0 give the same key
+    blob = json.dumps({"params": p, "seed": seed, "version": version}, sort_keys=True, default=float)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    '''A directory of cached run results, capped at maxbytes bytes (None for no cap)'''
+    def __init__(self, path, maxbytes=None):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.version = model_version()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def key(self, params, seed):
+        '''Returns the cache key of a run'''
+        return run_key(params, seed, self.version)
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def get(self, params, seed):
+        '''Returns the cached recorders.Recorder for a run, or None if it isn't in the cache (or seed is None)'''
+        if seed is None:
+            return None
+        filename = self._file(self.key(params, seed))
+        try:
+            with np.load(filename) as data:
+                recorder = from_buffers(data)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        os.utime(filename, None) # mark the entry as recently used
+        return recorder
+
+    def put(self, params, seed, recorder):
+        '''Store the recorders.Recorder of a finished run (unless seed is None), then evict old entries if the cache is over its size cap'''
+        if seed is None:
+            return
+        filename = self._file(self.key(params, seed))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        arrays = recorder.buffers()
+        # write to a temporary file and then move it into place, so that an interrupted write never leaves a broken entry behind
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, filename)
+        self.evict()
+
+    def run(self, params, seed, simulate):
+        '''Returns the cached result of a run if there is one, otherwise runs simulate(params, seed), caches its result and returns it. Also returns True if the result came from the cache'''
+        recorder = self.get(params, seed)
+        if recorder is not None:
+            return recorder, True
+        recorder = simulate(params, seed)
+        self.put(params, seed, recorder)
+        return recorder, False
+
+    def entries(self):
+        '''Returns a list of (last used time, size, filename) for all entries, oldest first'''
+        found = []
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.npz'):
+                    try:
+                        stat = entry.stat()
+                    except OSError: # another process evicted it in the meantime
+                        continue
+                    found.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(found)
+
+    def evict(self):
+        '''Delete the least recently used entries until the cache is within its size cap'''
+        if self.maxbytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for used, size, filename in entries)
+        for used, size, filename in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,48 @@
+#!usr/bin/python
+
+# Checkpoints of AgModel_headless.py runs
+############################
+# Saves the complete state of a run (the parameters, the seed, the year, the human and Prey populations, the Cereal patches, the state of the early stopping detectors, the state of the random number generator and the output recorded so far) to a compressed .npz file, so that a long run that is killed can be resumed from its last checkpoint and carry on exactly as if it had never stopped. The output is only kept up to the current year, so a checkpoint is much smaller than the finished run.
+# Checkpoints are written to a temporary file first and then renamed over the old one, so a run that is killed while saving one still has the one before. They work with the "python" engine (a run asked to checkpoint with the "numba" engine uses the "python" engine instead).
+
+import os
+import warnings
+import numpy as np
+
+SECONDS = 600. # Default interval between checkpoints, in seconds, when neither an interval in years nor one in seconds is given
+
+
+def save(simulation, filename):
+    '''Save the complete state of simulation (an AgModel_headless.Simulation) to the file filename, atomically'''
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **simulation.get_state())
+    os.replace(tmp, filename)
+
+
+def load(filename, profile=False):
+    '''Returns the AgModel_headless.Simulation saved in the checkpoint file filename, ready to carry on (and profiled from there on, with profile=True)'''
+    from AgModel_headless import Simulation
+    with np.load(filename, allow_pickle=False) as data:
+        return Simulation.from_state(dict(data), profile)
+
+
+def run(params, seed, filename, years=None, seconds=None, resume=False, profile=False):
+    '''Run the model with the parameter overrides params and the random seed seed, saving checkpoints to the file filename every "years" years and every "seconds" seconds (every SECONDS seconds if neither is given), and return the output recorder. With resume=True, carry on from the checkpoint in filename if there is one. It has to be a checkpoint of the same run (the same full set of parameters and seed). With profile=True, the recorder holds the profile report of the years simulated by this call'''
+    from AgModel_headless import Simulation, model_parameters
+    if years is None and seconds is None:
+        seconds = SECONDS
+    p = model_parameters(params)
+    if p['Landscape'] == "compact" or p['Bands'] > 1:
+        raise ValueError("Checkpoints don't work on the compact Landscape or with several Bands")
+    if p['Engine'] != "python":
+        warnings.warn("Checkpoints need the python engine, so this run uses it instead of the %s engine" % p['Engine'])
+        p['Engine'] = "python"
+    if resume and os.path.exists(filename):
+        simulation = load(filename, profile)
+        if simulation.params != p or simulation.seed != seed:
+            raise ValueError("The checkpoint %s is of a different run (other parameters or seed)" % filename)
+        print("Resuming from year %s" % simulation.year)
+    else:
+        simulation = Simulation(p, seed, profile)
+    return simulation.run(filename, years, seconds)
@@ -0,0 +1,77 @@
+#!usr/bin/python
+
+# Early stopping of AgModel_headless.py runs
+############################
+# Detects runs that have settled down long before Years, so that they can stop simulating. When a run stops early, its recorder copies the last simulated year forward to fill the rest of the years (recorders.Recorder.pad()), so the output still covers the full year range. The EarlyStop parameter picks which detectors are used, and each one includes the ones before it:
+#   "off" simulates every year, as in earlier versions of the model.
+#   "absorbing" stops a run as soon as the humans have died out. People can never grow again from 0, so the human side of the run is provably fixed from then on (the Prey and Cereal would keep fluctuating on their own, but are held at their last values).
+#   "steady" also stops a run once People, Prey, and the density and domestic proportion of every Cereal patch have all stayed within EarlyStopTolerance (relative) of their values at the start of a stretch of EarlyStopWindow years, e.g. with People pinned at MaximumPeople and every patch clamped at MaxCerealDensity and full domestication.
+#   "stationary" also stops a run once the yearly general stats are statistically stationary: the means of the human and Prey populations, the domestic proportion and the average patch density over the first and second halves of the last EarlyStopWindow years differ by no more than EarlyStopTolerance (relative), and have kept doing so every year for another EarlyStopWindow years (so that a slow trend that happens to level off for a while doesn't stop the run).
+
+import numpy as np
+
+EARLY_STOP_MODES = ('off', 'absorbing', 'steady', 'stationary')
+
+# The general stats that have to be stationary for the "stationary" detector
+STATIONARY_STATS = ('HumPop', 'PreyPop', 'ProportionDomesticated', 'AverageCerealDensity')
+
+
+def _within(values, reference, tolerance):
+    '''Check if every one of values is within tolerance (relative) of the matching reference value'''
+    return bool(np.all(np.abs(values - reference) <= tolerance * np.abs(reference)))
+
+
+class Convergence(object):
+    '''Watches a run year by year, and says when it can stop. p is the full set of model parameters'''
+    def __init__(self, p):
+        if p['EarlyStop'] not in EARLY_STOP_MODES:
+            raise ValueError("Unknown EarlyStop mode: %s" % p['EarlyStop'])
+        self.level = EARLY_STOP_MODES.index(p['EarlyStop'])
+        self.window = int(p['EarlyStopWindow'])
+        self.tolerance = p['EarlyStopTolerance']
+        self.reference = None # the state at the start of the current steady stretch, and the year it started
+        self.since = 0
+        self.stationary = 0 # the number of years in a row that the general stats have been stationary
+        self.reason = None
+
+    def converged(self, year, People, Prey, patches, stats):
+        '''Check the state at the end of year (patches is the patches.CerealPatches or patches.CompactPatches object, and stats is the recorder's general stats array). Returns True if the run can stop, and sets reason to the name of the detector that stopped it'''
+        if self.level == 0:
+            return False
+        if People <= 0:
+            self.reason = "absorbing"
+            return True
+        if self.level >= 2:
+            state = (np.array([People, Prey], dtype=float), patches.CerealDensity, patches.WildToDomesticatedProportion) # (only read here, as the compact patches have to be expanded)
+            if self.reference is None or not all(_within(values, reference, self.tolerance) for values, reference in zip(state, self.reference)):
+                self.reference = tuple(np.array(values, dtype=float) for values in state) # a new steady stretch starts here
+                self.since = year
+            elif year - self.since >= self.window:
+                self.reason = "steady"
+                return True
+        if self.level >= 3 and year >= self.window:
+            half = self.window // 2
+            for name in STATIONARY_STATS:
+                recent = stats[name][year - 2 * half + 1:year + 1]
+                first, second = recent[:half].mean(), recent[half:].mean()
+                if abs(second - first) > self.tolerance * max(abs(first), abs(second)):
+                    self.stationary = 0
+                    return False
+            self.stationary += 1
+            if self.stationary >= self.window:
+                self.reason = "stationary"
+                return True
+        return False
+
+    def get_state(self):
+        '''Returns the state of the detectors as a dict of arrays (for checkpoints)'''
+        state = {"since": np.array(self.since), "stationary": np.array(self.stationary)}
+        if self.reference is not None:
+            state.update(("reference%d" % j, values) for j, values in enumerate(self.reference))
+        return state
+
+    def set_state(self, state):
+        '''Restore the state of the detectors from a dict of arrays written by get_state()'''
+        self.since = int(state["since"])
+        self.stationary = int(state["stationary"])
+        self.reference = tuple(np.array(state["reference%d" % j]) for j in range(3)) if "reference0" in state else None
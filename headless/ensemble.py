@@ -0,0 +1,134 @@
+#!usr/bin/python
+
+# Vectorized ensemble engine for AgModel_headless.py
+############################
+# Simulates many replicate runs of one parameter set in lockstep. All of the annual state (People, Prey, and the patch density and domestic proportion arrays) carries a leading replicate axis, so the demography (babymaker/deathdealer), Prey dynamics and patch updates are each one NumPy operation across all of the replicates. The foraging loop advances every replicate by one bout at a time, and masks out the replicates that have already finished their year so that they sit idle.
+# The replicates are statistically equivalent to runs of the single-run model (with the same decision rule as the foraging engines in foraging.py), but they do not reproduce its random number stream.
+
+import numpy as np
+from AgModel_headless import model_parameters, babymaker, deathdealer
+from foraging import cereal_payoffs, prey_search_cost
+from recorders import EnsembleRecorder
+
+
+class Ensemble(object):
+    '''The state of an ensemble of replicate runs of the model, each stored as one row of the state arrays'''
+    def __init__(self, params=None, replicates=10, seed=None, record_patches=False):
+        '''params is a mapping of parameter overrides (as for run_simulation()), replicates the number of replicate runs, seed the seed for the random number generator, and record_patches says whether to keep the full patch time series of every replicate'''
+        self.params = p = model_parameters(params)
+        if p['Landscape'] != "dense" or p['Bands'] > 1 or p['Resources']:
+            raise ValueError("The ensemble engine only works on the dense Landscape with a single band, without extra Resources")
+        self.replicates = R = int(replicates)
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        N = int(p['Cereal'])
+        self.year = 0
+        self.People = np.full(R, p['People'], dtype=float)
+        self.Prey = np.full(R, p['Prey'], dtype=float)
+        self.density = np.full((R, N), p['CerealDensity'], dtype=float) # one row of Cereal patches per replicate. They will all start out the same.
+        self.proportion = np.full((R, N), p['WildToDomesticatedProportion'], dtype=float)
+        # prefix sums of the patch arrays, so that the mean of the remaining patches is O(1) during foraging
+        self.cumdensity = np.zeros((R, N + 1), dtype=float)
+        self.cumproportion = np.zeros((R, N + 1), dtype=float)
+        self._cumulate()
+        # scratch arrays for the yearly patch update
+        self._index = np.arange(N)
+        self._new = np.empty((R, N), dtype=float)
+        self._keep = np.empty((R, N), dtype=bool)
+        self.recorder = EnsembleRecorder(R, p['Years'], N, record_patches)
+        zeros = np.zeros(R)
+        self.recorder.record(0, self.People, zeros, self.Prey, zeros, zeros, self.density, self.proportion) # update with year 0 data
+
+    def _cumulate(self):
+        '''Refresh the prefix sums of the patch arrays'''
+        np.cumsum(self.density, axis=1, out=self.cumdensity[:, 1:])
+        np.cumsum(self.proportion, axis=1, out=self.cumproportion[:, 1:])
+
+    def forage(self):
+        '''Run one year of foraging for all replicates. Returns arrays with the kcal need left over, the Prey left, the number of Prey eaten and the number of Cereal patches harvested by each replicate'''
+        p = self.params
+        rng = self.rng
+        U = p['ForagingUncertainty']
+        R = self.replicates
+        kcalneed = self.People * p['HumanKcal']        # find the number of kcals needed by each band this year
+        timebudget = self.People * p['ForagingHours']       # find the time budget for each band this year
+        Prey_now = self.Prey.copy()
+        Cereal_now = np.full(R, int(p['Cereal']))
+        eatPrey = np.zeros(R)
+        eatCereal = np.zeros(R, dtype=int)
+        encounters = p['MinPreyEncountered'] < p['MaxPreyEncountered']
+        active = np.flatnonzero((kcalneed > 0) & ((Prey_now > 0) | (Cereal_now > 0))) # the replicates that are still foraging this year
+        while active.size:
+            n = Cereal_now[active]
+            harvest = n > 0
+            n = np.maximum(n, 1) # (the means are not used where there are no patches left, but keep them finite)
+            CerealGain, CerealHandling, Cerealscore = cereal_payoffs(p, self.cumproportion[active, n] / n, self.cumdensity[active, n] / n)
+            Cerealscore = np.where(harvest, Cerealscore, 0.)
+            prey = Prey_now[active]
+            hunt = prey > 0
+            PreySearchCost_Now = prey_search_cost(p, np.where(hunt, prey, 1.))
+            Preyscore = np.where(hunt, p['PreyReturns'] / (PreySearchCost_Now + p['PreyHandlingCost']), 0.)
+            if encounters:
+                PreyEncountered_Now = rng.randint(p['MinPreyEncountered'], p['MaxPreyEncountered'], active.size)
+            else:
+                PreyEncountered_Now = np.full(active.size, p['MinPreyEncountered'])
+            choice = rng.normal(Preyscore, Preyscore * U) > rng.normal(Cerealscore, Cerealscore * U) # True where hunting Prey looks more profitable than harvesting Cereal
+            hunt &= choice
+            harvest &= ~choice
+            kcalneed[active] -= np.where(hunt, p['PreyReturns'], 0.) + np.where(harvest, CerealGain, 0.)
+            timebudget[active] -= np.where(hunt, PreySearchCost_Now + (p['PreyHandlingCost'] * PreyEncountered_Now), 0.) + np.where(harvest, p['CerealSearchCosts'] + CerealHandling, 0.)
+            eaten = np.where(hunt, PreyEncountered_Now, 0)
+            eatPrey[active] += eaten
+            Prey_now[active] -= eaten
+            eatCereal[active] += harvest
+            Cereal_now[active] -= harvest
+            # replicates stop foraging once their kcal need is met, or they run out of time or food
+            active = active[(kcalneed[active] > 0) & (timebudget[active] > 0) & ((Prey_now[active] > 0) | (Cereal_now[active] > 0))]
+        return kcalneed, Prey_now, eatPrey, eatCereal
+
+    def step(self):
+        '''Simulate one year for all replicates'''
+        p = self.params
+        rng = self.rng
+        People = self.People
+        self.year = year = self.year + 1
+        kcalneed, Prey_now, eatPrey, eatCereal = self.forage()
+        ####### Now that the bands have foraged for a year, update human, Prey, and Cereal populations, and implement selection
+        starved = (People * p['HumanKcal']) - kcalneed <= (People * p['HumanKcal'] * p['StarvationThreshold'])     #Check which replicates starved this year, and just die deaths in those
+        starving = People - deathdealer(p['HumanDeathRate']*2, p['HumanBirthDeathFilter'], People, rng)
+        growing = People + babymaker(p['HumanBirthRate'], p['HumanBirthDeathFilter'], People, rng) - deathdealer(p['HumanDeathRate'], p['HumanBirthDeathFilter'], People, rng)
+        People = np.where(starved, starving, growing)
+        if p['MaxPreyMigrants'] == 0:
+            PreyMigrantsNow = 0
+        else:
+            PreyMigrantsNow = rng.randint(0, p['MaxPreyMigrants'], self.replicates)
+        Prey = Prey_now + babymaker(p['PreyBirthRate'], p['PreyBirthDeathFilter'], Prey_now, rng) - deathdealer(p['PreyDeathRate'], p['PreyBirthDeathFilter'], Prey_now, rng) + PreyMigrantsNow
+        People = np.minimum(People, p['MaximumPeople']) # don't allow human pop to exceed the limit we set
+        Prey = np.minimum(Prey, p['MaxPrey']) # don't allow Prey pop to exceed natural carrying capacity
+        # selection and diffusion, as in Simulation.step(), with one draw of the rates per replicate
+        diffusion = rng.normal(p['CerealDiffusionRate'], (p['CerealDiffusionRate']*p['SelectionDiffusionFilter']), self.replicates) * (1 - self.recorder.stats['ProportionDomesticated'][:, year - 1])
+        selection = rng.normal(p['CerealSelectionRate'], (p['CerealSelectionRate']*p['SelectionDiffusionFilter']), self.replicates)
+        exploited = self._index < np.clip(eatCereal - 1, 0, None)[:, None] # patch x (counting from 1) is treated as exploited if x < eatCereal
+        cultivation = p['CerealCultivationDensity']
+        new, keep = self._new, self._keep
+        np.add(self.density, np.where(exploited, cultivation, -cultivation), out=new)
+        np.logical_or(new > p['MaxCerealDensity'] - cultivation, new < p['CerealDensity'] + cultivation, out=keep)
+        np.copyto(self.density, new, where=~keep) # adjust the patch densities, but only where the value will stay between CerealDensity and MaxCerealDensity.
+        np.add(self.proportion, np.where(exploited, (diffusion - selection)[:, None], diffusion[:, None]), out=new)
+        np.logical_or(new > (1 - diffusion)[:, None], new < (0 + selection)[:, None], out=keep)
+        np.copyto(self.proportion, new, where=~keep) # adjust the selection coefficients, but only where the value will stay between 1 and 0.
+        self._cumulate()
+        self.recorder.record(year, People, (People * p['HumanKcal']) - kcalneed, Prey, eatPrey, eatCereal, self.density, self.proportion)
+        self.People = People
+        self.Prey = Prey
+
+    def run(self):
+        '''Simulate all the remaining years, and return the output EnsembleRecorder'''
+        while self.year < self.params['Years']:
+            self.step()
+        return self.recorder
+
+
+def run_ensemble(params=None, replicates=10, seed=None, record_patches=False):
+    '''Run replicates replicates of the model in lockstep with the parameter overrides in the mapping params and the random seed seed, and return a recorders.EnsembleRecorder holding the output arrays of all of them'''
+    return Ensemble(params, replicates, seed, record_patches).run()
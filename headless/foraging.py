@@ -0,0 +1,300 @@
+#!usr/bin/python
+
+# Annual foraging engines for AgModel_headless.py
+############################
+# Each engine runs the inner "while kcalneed > 0" loop of the model for one year: the band makes a series of noisy diet breadth decisions between hunting Prey and harvesting the next Cereal patch, until its kcal need is met, or it runs out of foraging time or food. The mean state of the remaining Cereal patches is read from the prefix sums kept by patches.CerealPatches, so it costs O(1) per bout rather than O(patches). On the spatial landscape (landscape.GridPatches), the next patch is the nearest one not harvested yet, with its own state and search cost.
+#
+# forage_stepwise() makes one decision per iteration, drawing random numbers in exactly the same order as the original loop, and is kept as the reference engine.
+# forage_batched() resolves whole runs of consecutive same-resource bouts at once. While the band keeps exploiting one resource, the state of the other one does not change, so the noisy decisions for the next block of bouts can be drawn in one go, and the run is cut at the first bout that would switch resource (or when kcal need, time, or the resource runs out). The decision that ended a run is carried over as the first bout of the next run, so no random draws are thrown away conditionally and the outcome has the same distribution as the reference engine (but not the same random number stream).
+# forage_diet() ("diet" ForagingEngine) generalizes forage_batched() to any number of resources: Prey, Cereal, and the extra resources of the Resources parameter (see Diet), which are described by arrays of returns, search and handling costs, with an entry per resource. During a run of bouts on one resource, the noisy return rates of all the others are drawn as one block of bouts x resources array, and the run is cut at the first bout where another resource ranks first, which starts the next run. So the Python work per run doesn't grow with the number of resources. With no extra resources, it makes the same decisions as forage_batched() (in distribution).
+
+import json
+import numpy as np
+
+# Names of the model parameters that the foraging engines read from the parameter mapping
+FORAGING_PARAMETERS = ('ForagingUncertainty', 'PreyReturns', 'PreySearchCost', 'PreyDensity', 'MaxPreyEncountered', 'MinPreyEncountered', 'PreyHandlingCost', 'WildCerealReturns', 'DomesticatedCerealReturns', 'CerealSearchCosts', 'WildCerealHandlingCost', 'DomesticatedCerealHandlingCost')
+
+
+# The fields of each extra resource in the Resources parameter: its name, its kind ("prey", whose search cost rises as it is depleted within the year, as for Prey, or "plant", whose search cost stays the same, as for Cereal), the kcal gained and the search and handling costs (hours) of one bout, and the number of bouts available each year (the stock, which renews every year)
+RESOURCE_FIELDS = ('name', 'kind', 'returns', 'search', 'handling', 'stock')
+RESOURCE_KINDS = ('prey', 'plant')
+
+
+class Diet(object):
+    '''The extra resources of the Resources parameter (a JSON list of objects with the RESOURCE_FIELDS, or "" for none) of the full set of model parameters p, as arrays with an entry per resource, and the number of bouts spent on each of them in the current year (eaten)'''
+    def __init__(self, p):
+        resources = json.loads(p['Resources']) if p['Resources'] else []
+        for resource in resources:
+            missing = set(RESOURCE_FIELDS) - set(resource)
+            if missing:
+                raise ValueError("Resource %s is missing %s" % (resource.get('name'), ", ".join(sorted(missing))))
+            if resource['kind'] not in RESOURCE_KINDS:
+                raise ValueError("Unknown kind of resource %s: %s" % (resource['name'], resource['kind']))
+        self.names = [str(resource['name']) for resource in resources]
+        self.prey = np.array([resource['kind'] == "prey" for resource in resources], dtype=bool)
+        for name in RESOURCE_FIELDS[2:]:
+            setattr(self, name, np.array([resource[name] for resource in resources], dtype=float))
+        self.stock = np.floor(self.stock) # (whole bouts)
+        self.eaten = np.zeros(len(resources))
+
+    def search_cost(self, left, which=slice(None)):
+        '''Returns the search cost (hours) of the next bout of each resource when left bouts of it are left. which picks the resources (default all, one per entry of left), or is the index of one resource, with left an array of the bouts left before each of a run of bouts'''
+        return np.where(self.prey[which], self.search[which] * self.stock[which] / np.maximum(left, 1), self.search[which])
+
+    def rates(self, left):
+        '''Returns the return rate (kcal/hr) of the next bout of each resource when left bouts of it are left, and 0 for the resources that are used up'''
+        return np.where(left > 0, self.returns / (self.search_cost(left) + self.handling), 0.)
+
+
+def cereal_payoffs(p, proportion, density, search=None):
+    '''Returns the kcal gain, handling time (hours, without the search cost) and return rate (kcal/hr) of harvesting a Cereal patch with the given mean wild-to-domesticated proportion and density, and search cost search (default CerealSearchCosts). Works on scalars or arrays'''
+    CerealReturns = (p['WildCerealReturns'] * proportion) + (p['DomesticatedCerealReturns'] * (1 - proportion))        #determine the actual kcal return for Cereal, based on the proportion of wild to domesticated.
+    CombinedCerealHandlingCost = (p['WildCerealHandlingCost'] * proportion) + (p['DomesticatedCerealHandlingCost'] * (1 - proportion))    #determine the actual handling time for Cereal, based on the proportion of wild to domesticated.
+    gain = CerealReturns * density
+    handling = CombinedCerealHandlingCost * density
+    search = p['CerealSearchCosts'] if search is None else search
+    return gain, handling, gain / (search + handling)        #find the current return rate (kcal/hr) for Cereal.
+
+
+def cereal_search_cost(p, patches, n):
+    '''Returns the search cost (hours) of the next Cereal patch when n patches are left (n can be an array): CerealSearchCosts, or on a spatial landscape (see landscape.py) the search cost of that patch'''
+    search = getattr(patches, 'search_cost', None)
+    return p['CerealSearchCosts'] if search is None else search(n)
+
+
+def prey_search_cost(p, prey):
+    '''Returns the density dependent search cost (hours) to find Prey when there are prey animals left. Works on scalars or arrays'''
+    return p['PreySearchCost'] / (prey / p['PreyDensity'])
+
+
+def forage_stepwise(kcalneed, timebudget, Prey_now, Cereal_now, patches, p, rng=np.random, bouts=None):
+    '''Reference foraging engine: one bout per iteration, exactly as in the original model loop. Returns the updated kcalneed, timebudget, Prey_now, Cereal_now, and the number of Prey eaten and Cereal patches harvested. If bouts is given (a list of two counts), the number of hunting and harvesting bouts are added to it'''
+    eatCereal = 0
+    eatPrey = 0
+    U = p['ForagingUncertainty']
+    while kcalneed > 0:
+        if Prey_now <= 0 and Cereal_now <= 0:
+            break
+        if Cereal_now > 0:
+            WildToDomesticatedProportion_now, CerealDensity_now = patches.remaining(Cereal_now)
+            CerealSearch_now = cereal_search_cost(p, patches, Cereal_now)
+            CerealGain, CerealHandling, Cerealscore = cereal_payoffs(p, WildToDomesticatedProportion_now, CerealDensity_now, CerealSearch_now)
+        else:
+            Cerealscore = 0
+        if Prey_now <= 0:
+            Preyscore = 0
+        else:
+            PreySearchCost_Now = prey_search_cost(p, Prey_now)
+            if p['MinPreyEncountered'] >= p['MaxPreyEncountered']:
+                PreyEncountered_Now = p['MinPreyEncountered']
+            else:
+                PreyEncountered_Now = rng.randint(p['MinPreyEncountered'], p['MaxPreyEncountered'])     # find how many prey are encountered at this time
+            Preyscore = p['PreyReturns'] / (PreySearchCost_Now + p['PreyHandlingCost'])    #find the current return rate (kcal/hr) for Prey.
+        hunt = rng.normal(Preyscore, Preyscore * U) > rng.normal(Cerealscore, Cerealscore * U)
+        if not hunt:
+            # the original decision logic draws (and ignores) a second comparison and a tie-breaker before harvesting Cereal, so do the same here to keep the random number stream identical
+            if not rng.normal(Preyscore, Preyscore * U) > rng.normal(Cerealscore, Cerealscore * U):
+                rng.randint(0, 1)
+        if hunt:
+            if Prey_now <= 0: #if they killed all the Prey, then go to Cereal if possible
+                Preyscore = 0.
+            else:
+                kcalneed = kcalneed - p['PreyReturns']
+                timebudget = timebudget - (PreySearchCost_Now + (p['PreyHandlingCost'] * PreyEncountered_Now))
+                eatPrey = eatPrey + PreyEncountered_Now
+                Prey_now = Prey_now - PreyEncountered_Now
+                if bouts is not None:
+                    bouts[0] += 1
+        else:
+            if Cereal_now <= 0: #if Cereal is all gone, then go back to Prey
+                Cerealscore = 0
+            else:
+                kcalneed = kcalneed - CerealGain
+                timebudget = timebudget - CerealSearch_now - CerealHandling
+                eatCereal = eatCereal + 1
+                Cereal_now = Cereal_now - 1
+                if bouts is not None:
+                    bouts[1] += 1
+        if timebudget <= 0:        #check if they've run out of foraging time, and stop the loop if necessary.
+            break
+        if Preyscore <= 0 and Cerealscore <= 0:    #check if they've run out of food, and stop the loop if necessary.
+            break
+    return kcalneed, timebudget, Prey_now, Cereal_now, eatPrey, eatCereal
+
+
+def _run(gains, costs, kcalneed, timebudget):
+    '''Given the kcal gains and time costs of a run of consecutive bouts, returns how many of them actually happen before the kcal need is met or the time budget runs out, and the kcal need and time budget after them'''
+    kcal = np.subtract.accumulate(np.concatenate(([kcalneed], gains)))[1:]
+    time = np.subtract.accumulate(np.concatenate(([timebudget], costs)))[1:]
+    done = (kcal <= 0) | (time <= 0)
+    m = int(np.argmax(done)) + 1 if done.any() else len(gains)
+    return m, kcal[m - 1], time[m - 1]
+
+
+def forage_batched(kcalneed, timebudget, Prey_now, Cereal_now, patches, p, rng=np.random, bouts=None, block=64, maxblock=4096):
+    '''Batched foraging engine: resolves runs of consecutive same-resource bouts in bulk. Takes and returns the same values as forage_stepwise(). block and maxblock bound the number of bouts that are looked ahead at once'''
+    eatCereal = 0
+    eatPrey = 0
+    U = p['ForagingUncertainty']
+    encounters = p['MinPreyEncountered'] < p['MaxPreyEncountered']
+    hunting = False # which resource the current run is exploiting
+    forced = False # True if the first bout of the run was already decided at the end of the previous run
+    while kcalneed > 0 and timebudget > 0:
+        if Prey_now <= 0 and Cereal_now <= 0:
+            break
+        if hunting and Prey_now <= 0:
+            hunting, forced = False, False
+        elif not hunting and Cereal_now <= 0:
+            hunting, forced = True, False
+        if hunting:
+            # Cereal stays as is during a run of hunting bouts, while Prey is depleted bout by bout
+            k = int(min(maxblock, max(block, kcalneed // p['PreyReturns'] + 1), Prey_now // max(p['MinPreyEncountered'], 1) + 1))
+            if encounters:
+                enc = rng.randint(p['MinPreyEncountered'], p['MaxPreyEncountered'], k)
+            else:
+                enc = np.full(k, p['MinPreyEncountered'])
+            prey = Prey_now - np.concatenate(([0], np.cumsum(enc[:-1]))) # Prey left before each bout
+            k = int(np.argmax(prey <= 0)) if (prey <= 0).any() else k # a run of hunting can't go on past the last Prey
+            enc, prey = enc[:k], prey[:k]
+            PreySearchCost_Now = prey_search_cost(p, prey)
+            Preyscore = p['PreyReturns'] / (PreySearchCost_Now + p['PreyHandlingCost'])
+            if Cereal_now > 0:
+                Cerealscore = cereal_payoffs(p, *patches.remaining(Cereal_now), cereal_search_cost(p, patches, Cereal_now))[2]
+                same = rng.normal(Preyscore, Preyscore * U) > rng.normal(Cerealscore, Cerealscore * U, k)
+            else:
+                same = np.ones(k, dtype=bool) # choosing to harvest Cereal when there is none left does nothing, so ignore those decisions
+            gains = np.full(k, p['PreyReturns'])
+            costs = PreySearchCost_Now + (p['PreyHandlingCost'] * enc)
+        else:
+            # Prey stays as is during a run of harvesting bouts, while Cereal patches are taken one by one from the end of the remaining patches
+            k = int(min(Cereal_now, maxblock, max(block, kcalneed // cereal_payoffs(p, *patches.remaining(Cereal_now))[0] + 1)))
+            n = Cereal_now - np.arange(k) # Cereal patches left before each bout
+            search = cereal_search_cost(p, patches, n)
+            gains, costs, Cerealscore = cereal_payoffs(p, *patches.remaining(n), search)
+            costs = search + costs
+            if Prey_now > 0:
+                Preyscore = p['PreyReturns'] / (prey_search_cost(p, Prey_now) + p['PreyHandlingCost'])
+                same = rng.normal(Preyscore, Preyscore * U, k) <= rng.normal(Cerealscore, Cerealscore * U)
+            else:
+                same = np.ones(k, dtype=bool) # choosing to hunt when there are no Prey left does nothing, so ignore those decisions
+        if forced:
+            same[0] = True
+        r = int(np.argmin(same)) if not same.all() else k # the run ends at the first bout that switches resource
+        if r == 0:
+            hunting, forced = not hunting, True
+            continue
+        m, kcalneed, timebudget = _run(gains[:r], costs[:r], kcalneed, timebudget)
+        if bouts is not None:
+            bouts[0 if hunting else 1] += m
+        if hunting:
+            eaten = enc[:m].sum().item()
+            eatPrey = eatPrey + eaten
+            Prey_now = Prey_now - eaten
+        else:
+            eatCereal = eatCereal + m
+            Cereal_now = Cereal_now - m
+        if r < k:
+            hunting, forced = not hunting, True
+        else:
+            forced = False
+    return kcalneed, timebudget, Prey_now, Cereal_now, eatPrey, eatCereal
+
+
+def forage_diet(kcalneed, timebudget, Prey_now, Cereal_now, patches, p, rng=np.random, bouts=None, block=64, maxblock=4096, diet=None):
+    '''N-resource foraging engine: resolves runs of consecutive bouts on one resource in bulk, choosing between Prey, Cereal and the extra resources of diet (a Diet, default made from p). Takes and returns the same values as forage_stepwise(), and puts the number of bouts spent on each extra resource in diet.eaten. block and maxblock bound the number of bouts that are looked ahead at once'''
+    diet = Diet(p) if diet is None else diet
+    eatCereal = 0
+    eatPrey = 0
+    U = p['ForagingUncertainty']
+    encounters = p['MinPreyEncountered'] < p['MaxPreyEncountered']
+    left = diet.stock.copy() # the bouts of each extra resource that are left this year
+    diet.eaten[:] = 0
+    kinds = np.concatenate(([True, False], diet.prey)) # which resources are hunted (for the bout counts)
+
+    def rate(j):
+        '''Returns the return rate of the next bout of resource j, 0 if it is used up'''
+        if j == 0:
+            return p['PreyReturns'] / (prey_search_cost(p, Prey_now) + p['PreyHandlingCost']) if Prey_now > 0 else 0.
+        if j == 1:
+            return cereal_payoffs(p, *patches.remaining(Cereal_now), cereal_search_cost(p, patches, Cereal_now))[2] if Cereal_now > 0 else 0.
+        return diet.returns[j - 2] / (diet.search_cost(left[j - 2], j - 2) + diet.handling[j - 2]) if left[j - 2] > 0 else 0.
+
+    # the return rates of the next bout of every resource, 0 where it is used up. Only the resource of a run changes during it, so only its rate is updated after the run
+    rates = np.concatenate(([rate(0), rate(1)], diet.rates(left)))
+    current = None # the resource that the current run is exploiting: 0 is Prey, 1 is Cereal, 2 on are the extra resources
+    forced = False # True if the first bout of the run was already decided at the end of the previous run
+    ahead = maxblock # how far to look ahead, which shrinks when the runs are short (e.g. when many resources have about the same return rate), so that few of the draws are thrown away
+    while kcalneed > 0 and timebudget > 0:
+        available = rates > 0
+        if not available.any():
+            break
+        if current is None or not available[current]:
+            scores = np.where(available, rng.normal(rates, rates * U), -np.inf) # one noisy ranking of everything that is left
+            current, forced = int(np.argmax(scores)), True
+        if current == 0:
+            # the other resources stay as they are during a run of hunting bouts, while Prey is depleted bout by bout
+            k = int(min(ahead, max(block, kcalneed // p['PreyReturns'] + 1), Prey_now // max(p['MinPreyEncountered'], 1) + 1))
+            if encounters:
+                enc = rng.randint(p['MinPreyEncountered'], p['MaxPreyEncountered'], k)
+            else:
+                enc = np.full(k, p['MinPreyEncountered'])
+            prey = Prey_now - np.concatenate(([0], np.cumsum(enc[:-1]))) # Prey left before each bout
+            k = int(np.argmax(prey <= 0)) if (prey <= 0).any() else k # a run of hunting can't go on past the last Prey
+            enc, prey = enc[:k], prey[:k]
+            search = prey_search_cost(p, prey)
+            own = p['PreyReturns'] / (search + p['PreyHandlingCost'])
+            gains = np.full(k, p['PreyReturns'])
+            costs = search + (p['PreyHandlingCost'] * enc)
+        elif current == 1:
+            # Cereal patches are taken one by one from the end of the remaining patches
+            k = int(min(Cereal_now, ahead, max(block, kcalneed // cereal_payoffs(p, *patches.remaining(Cereal_now))[0] + 1)))
+            n = Cereal_now - np.arange(k) # Cereal patches left before each bout
+            search = cereal_search_cost(p, patches, n)
+            gains, costs, own = cereal_payoffs(p, *patches.remaining(n), search)
+            costs = search + costs
+        else:
+            e = current - 2
+            k = int(min(left[e], ahead, max(block, kcalneed // diet.returns[e] + 1)))
+            search = diet.search_cost(left[e] - np.arange(k), e) # (bouts left before each bout)
+            own = diet.returns[e] / (search + diet.handling[e])
+            gains = np.full(k, diet.returns[e])
+            costs = search + diet.handling[e]
+        others = np.flatnonzero(available)
+        others = others[others != current]
+        if len(others) > 1:
+            others = others[rates[others] * (1 + 6 * U) >= own.min() * (1 - 6 * U)] # only the resources that can outrank the current one at all (within 6 standard deviations of the noise), as the others can be left out of the diet
+        if len(others):
+            scores = rng.normal(rates[others], rates[others] * U, (k, len(others)))
+            same = rng.normal(own, own * U) > scores.max(axis=1)
+        else:
+            same = np.ones(k, dtype=bool) # nothing else is left to choose, so ignore the decisions
+        if forced:
+            same[0] = True
+        r = int(np.argmin(same)) if not same.all() else k # the run ends at the first bout where another resource ranks first
+        if r < k:
+            switch = int(others[np.argmax(scores[r])])
+            ahead = max(4, 2 * r)
+        else:
+            ahead = min(2 * ahead, maxblock)
+        if r == 0:
+            current, forced = switch, True
+            continue
+        m, kcalneed, timebudget = _run(gains[:r], costs[:r], kcalneed, timebudget)
+        if bouts is not None:
+            bouts[0 if kinds[current] else 1] += m
+        if current == 0:
+            eaten = enc[:m].sum().item()
+            eatPrey = eatPrey + eaten
+            Prey_now = Prey_now - eaten
+        elif current == 1:
+            eatCereal = eatCereal + m
+            Cereal_now = Cereal_now - m
+        else:
+            left[current - 2] -= m
+            diet.eaten[current - 2] += m
+        rates[current] = rate(current)
+        if r < k:
+            current, forced = switch, True
+        else:
+            forced = False
+    return kcalneed, timebudget, Prey_now, Cereal_now, eatPrey, eatCereal
@@ -0,0 +1,234 @@
+#!usr/bin/python
+
+# Optional JIT-compiled (Numba) engine for AgModel_headless.py
+############################
+# Compiles the whole simulation (the foraging loop, demography, and patch update of every year) to native code with Numba. It is selected with Engine = "numba" (or --Engine numba on the command line), and AgModel_headless.py falls back to the pure Python engine if Numba isn't installed.
+# The compiled engine makes the same decisions as the reference engine (foraging.forage_stepwise), but it draws from Numba's own random number generator, so it reproduces the reference engine statistically, not bit-for-bit. Run this script to check that:
+#     python3 jit.py --runs 30 --years 400
+
+import sys
+import argparse
+import warnings
+import numpy as np
+from AgModel_headless import model_parameters, run_simulation
+from recorders import Recorder, GENERAL_STATS
+from convergence import EARLY_STOP_MODES
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# The parameters handed to the compiled kernel, in order
+KERNEL_PARAMETERS = ['People', 'MaximumPeople', 'HumanBirthRate', 'HumanDeathRate', 'HumanBirthDeathFilter', 'StarvationThreshold', 'HumanKcal', 'ForagingHours', 'ForagingUncertainty',
+                     'Prey', 'MaxPrey', 'MaxPreyMigrants', 'PreyBirthRate', 'PreyDeathRate', 'PreyBirthDeathFilter', 'PreyReturns', 'PreySearchCost', 'PreyDensity', 'MaxPreyEncountered', 'MinPreyEncountered', 'PreyHandlingCost',
+                     'WildCerealReturns', 'DomesticatedCerealReturns', 'WildToDomesticatedProportion', 'CerealSelectionRate', 'CerealDiffusionRate', 'SelectionDiffusionFilter', 'CerealSearchCosts', 'CerealDensity', 'MaxCerealDensity', 'CerealCultivationDensity', 'WildCerealHandlingCost', 'DomesticatedCerealHandlingCost']
+
+
+def _simulate(seed, k, stop, stats, density, proportion):
+    '''The compiled simulation kernel. seed seeds Numba's random number generator, k is a float array of the KERNEL_PARAMETERS, stop holds the early stopping level (the index of EarlyStop in convergence.EARLY_STOP_MODES), window and tolerance, stats is a (Years+1) x 9 array for the general stats (in the column order of recorders.GENERAL_STATS), and density and proportion are (Years+1) x Cereal arrays for the patch time series. Returns the last simulated year, and the index of the early stopping detector that stopped the run (0 if none did), with the same detectors as convergence.Convergence'''
+    (People, MaximumPeople, HumanBirthRate, HumanDeathRate, HumanBirthDeathFilter, StarvationThreshold, HumanKcal, ForagingHours, ForagingUncertainty,
+     Prey, MaxPrey, MaxPreyMigrants, PreyBirthRate, PreyDeathRate, PreyBirthDeathFilter, PreyReturns, PreySearchCost, PreyDensity, MaxPreyEncountered, MinPreyEncountered, PreyHandlingCost,
+     WildCerealReturns, DomesticatedCerealReturns, WildToDomesticatedProportion, CerealSelectionRate, CerealDiffusionRate, SelectionDiffusionFilter, CerealSearchCosts, CerealDensity, MaxCerealDensity, CerealCultivationDensity, WildCerealHandlingCost, DomesticatedCerealHandlingCost) = (
+        k[0], k[1], k[2], k[3], k[4], k[5], k[6], k[7], k[8], k[9], k[10], k[11], k[12], k[13], k[14], k[15], k[16], k[17], k[18], k[19], k[20], k[21], k[22], k[23], k[24], k[25], k[26], k[27], k[28], k[29], k[30], k[31], k[32])
+    np.random.seed(seed)
+    Years = stats.shape[0] - 1
+    N = density.shape[1]
+    dens = np.full(N, CerealDensity)
+    prop = np.full(N, WildToDomesticatedProportion)
+    cumdens = np.zeros(N + 1)
+    cumprop = np.zeros(N + 1)
+    level, window, tolerance = int(stop[0]), int(stop[1]), stop[2]
+    refdens = dens.copy() # the state at the start of the current steady stretch
+    refprop = prop.copy()
+    refPeople = People
+    refPrey = Prey
+    since = 0
+    stationaryyears = 0
+    for year in range(Years + 1):
+        if year == 0:
+            kcalneed = 0.
+            eatPrey = 0.
+            eatCereal = 0
+        else:
+            # prefix sums of the patch arrays, so that the mean of the remaining patches is O(1)
+            for i in range(N):
+                cumdens[i + 1] = cumdens[i] + dens[i]
+                cumprop[i + 1] = cumprop[i] + prop[i]
+            kcalneed = People * HumanKcal
+            timebudget = People * ForagingHours
+            Prey_now = Prey
+            Cereal_now = N
+            eatPrey = 0.
+            eatCereal = 0
+            while kcalneed > 0:
+                if Prey_now <= 0 and Cereal_now <= 0:
+                    break
+                Cerealscore = 0.
+                CerealGain = 0.
+                CerealHandling = 0.
+                if Cereal_now > 0:
+                    w = cumprop[Cereal_now] / Cereal_now
+                    d = cumdens[Cereal_now] / Cereal_now
+                    CerealGain = ((WildCerealReturns * w) + (DomesticatedCerealReturns * (1 - w))) * d
+                    CerealHandling = ((WildCerealHandlingCost * w) + (DomesticatedCerealHandlingCost * (1 - w))) * d
+                    Cerealscore = CerealGain / (CerealSearchCosts + CerealHandling)
+                Preyscore = 0.
+                PreySearchCost_Now = 0.
+                PreyEncountered_Now = MinPreyEncountered
+                if Prey_now > 0:
+                    PreySearchCost_Now = PreySearchCost / (Prey_now / PreyDensity)
+                    if MinPreyEncountered < MaxPreyEncountered:
+                        PreyEncountered_Now = float(np.random.randint(int(MinPreyEncountered), int(MaxPreyEncountered)))
+                    Preyscore = PreyReturns / (PreySearchCost_Now + PreyHandlingCost)
+                if np.random.normal(Preyscore, Preyscore * ForagingUncertainty) > np.random.normal(Cerealscore, Cerealscore * ForagingUncertainty):
+                    if Prey_now > 0:
+                        kcalneed = kcalneed - PreyReturns
+                        timebudget = timebudget - (PreySearchCost_Now + (PreyHandlingCost * PreyEncountered_Now))
+                        eatPrey = eatPrey + PreyEncountered_Now
+                        Prey_now = Prey_now - PreyEncountered_Now
+                elif Cereal_now > 0:
+                    kcalneed = kcalneed - CerealGain
+                    timebudget = timebudget - CerealSearchCosts - CerealHandling
+                    eatCereal = eatCereal + 1
+                    Cereal_now = Cereal_now - 1
+                if timebudget <= 0:
+                    break
+                if Preyscore <= 0 and Cerealscore <= 0:
+                    break
+            # demography
+            if (People * HumanKcal) - kcalneed <= (People * HumanKcal * StarvationThreshold):
+                People = People - np.round(np.random.normal(HumanDeathRate * 2, HumanBirthDeathFilter) * People)
+            else:
+                People = People + np.round(np.random.normal(HumanBirthRate, HumanBirthDeathFilter) * People) - np.round(np.random.normal(HumanDeathRate, HumanBirthDeathFilter) * People)
+            PreyMigrantsNow = 0.
+            if MaxPreyMigrants > 0:
+                PreyMigrantsNow = float(np.random.randint(0, int(MaxPreyMigrants)))
+            Prey = Prey_now + np.round(np.random.normal(PreyBirthRate, PreyBirthDeathFilter) * Prey_now) - np.round(np.random.normal(PreyDeathRate, PreyBirthDeathFilter) * Prey_now) + PreyMigrantsNow
+            if People > MaximumPeople:
+                People = MaximumPeople
+            if Prey > MaxPrey:
+                Prey = MaxPrey
+            # selection, diffusion and cultivation
+            diffusion = np.random.normal(CerealDiffusionRate, CerealDiffusionRate * SelectionDiffusionFilter) * (1 - stats[year - 1, 7])
+            selection = np.random.normal(CerealSelectionRate, CerealSelectionRate * SelectionDiffusionFilter)
+            for i in range(N):
+                exploited = i + 1 < eatCereal
+                new = dens[i] + (CerealCultivationDensity if exploited else -CerealCultivationDensity)
+                if not (new > MaxCerealDensity - CerealCultivationDensity or new < CerealDensity + CerealCultivationDensity):
+                    dens[i] = new
+                new = prop[i] + ((diffusion - selection) if exploited else diffusion)
+                if not (new > 1 - diffusion or new < 0 + selection):
+                    prop[i] = new
+        # record
+        total = 0.
+        totalprop = 0.
+        for i in range(N):
+            density[year, i] = dens[i]
+            proportion[year, i] = prop[i]
+            total += dens[i]
+            totalprop += prop[i]
+        stats[year, 0] = year
+        stats[year, 1] = People
+        stats[year, 2] = (People * HumanKcal) - kcalneed if year > 0 else 0.
+        stats[year, 3] = Prey
+        stats[year, 4] = eatPrey
+        stats[year, 5] = total / 1000.
+        stats[year, 6] = eatCereal
+        stats[year, 7] = 1 - totalprop / N
+        stats[year, 8] = (total / N) / 1000.
+        # early stopping
+        if level == 0 or year == 0:
+            continue
+        if People <= 0:
+            return year, 1
+        if level >= 2:
+            steady = abs(People - refPeople) <= tolerance * abs(refPeople) and abs(Prey - refPrey) <= tolerance * abs(refPrey)
+            for i in range(N):
+                if not steady:
+                    break
+                steady = abs(dens[i] - refdens[i]) <= tolerance * abs(refdens[i]) and abs(prop[i] - refprop[i]) <= tolerance * abs(refprop[i])
+            if not steady:
+                refPeople = People
+                refPrey = Prey
+                refdens[:] = dens
+                refprop[:] = prop
+                since = year
+            elif year - since >= window:
+                return year, 2
+        if level >= 3 and year >= window:
+            half = window // 2
+            stationary = True
+            for column in (1, 3, 7, 8): # convergence.STATIONARY_STATS
+                first = 0.
+                second = 0.
+                for y in range(year - 2 * half + 1, year - half + 1):
+                    first += stats[y, column]
+                for y in range(year - half + 1, year + 1):
+                    second += stats[y, column]
+                first /= half
+                second /= half
+                if abs(second - first) > tolerance * max(abs(first), abs(second)):
+                    stationary = False
+                    break
+            if stationary:
+                stationaryyears += 1
+                if stationaryyears >= window:
+                    return year, 3
+            else:
+                stationaryyears = 0
+    return Years, 0
+
+
+if HAVE_NUMBA:
+    _simulate = njit(cache=True)(_simulate)
+
+
+def run_jit(params=None, seed=None):
+    '''Run the model once with the compiled engine, and return a recorders.Recorder, just like AgModel_headless.run_simulation(). Falls back to the pure Python engine (with a warning) if Numba isn't installed'''
+    p = model_parameters(params)
+    if not HAVE_NUMBA:
+        warnings.warn("Numba is not installed, so the pure Python engine is used instead of the numba engine")
+        p['Engine'] = "python"
+        return run_simulation(p, seed)
+    recorder = Recorder(p['Years'], p['Cereal'])
+    kernelseed = np.random.RandomState(seed).randint(0, 2**31 - 1) # any seed that RandomState accepts (including None) maps onto one seed for Numba's generator
+    stop = np.array([EARLY_STOP_MODES.index(p['EarlyStop']), p['EarlyStopWindow'], p['EarlyStopTolerance']], dtype=float)
+    year, reason = _simulate(kernelseed, np.array([p[name] for name in KERNEL_PARAMETERS], dtype=float), stop, recorder.stats.view(np.float64).reshape(-1, len(GENERAL_STATS)), recorder.density, recorder.proportion)
+    if reason:
+        recorder.pad(year, EARLY_STOP_MODES[reason] == "absorbing") # fill the rest of the years with the last simulated one
+    return recorder
+
+
+def validate(params=None, runs=30, seed=0, years=(100, 200, -1), threshold=4.0):
+    '''Compare the compiled engine with the reference (stepwise, pure Python) engine statistically. Runs each engine runs times with independent seeds, and returns (and prints) the z-score of the difference in means of every general stat at each of the years. Returns the list of (stat, year, z) tuples and whether all of them are within threshold'''
+    params = dict(params or {})
+    reference = np.array([run_simulation(dict(params, Engine="python", ForagingEngine="stepwise"), seed=[seed, 0, r]).stats for r in range(runs)])
+    compiled = np.array([run_jit(params, seed=[seed, 1, r]).stats for r in range(runs)])
+    scores = []
+    print("%-25s %6s %14s %14s %7s" % ("stat", "year", "reference", "numba", "z"))
+    for name, header in GENERAL_STATS[1:]:
+        for year in years:
+            a, b = reference[name][:, year], compiled[name][:, year]
+            se = np.sqrt(a.var(ddof=1) / runs + b.var(ddof=1) / runs)
+            z = 0. if se == 0 else (b.mean() - a.mean()) / se
+            scores.append((name, reference['yr'][0, year], z))
+            print("%-25s %6d %14.4f %14.4f %7.2f" % (name, reference['yr'][0, year], a.mean(), b.mean(), z))
+    ok = all(abs(z) <= threshold for name, year, z in scores)
+    print("Engines agree" if ok else "Engines DISAGREE (|z| > %s)" % threshold)
+    return scores, ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate the compiled (Numba) engine against the reference pure Python engine, by comparing the means of the general stats over many runs of each.')
+    parser.add_argument('--runs', metavar='30', type=int, default=30, help='Number of runs of each engine')
+    parser.add_argument('--years', metavar='400', type=int, default=400, help='Number of years to simulate in each run')
+    parser.add_argument('--seed', metavar='0', type=int, default=0, help='Base seed for the runs')
+    parser.add_argument('--threshold', metavar='4.0', type=float, default=4.0, help='Largest acceptable z-score for a difference in means')
+    args = parser.parse_args()
+    if not HAVE_NUMBA:
+        print("Numba is not installed, so there is no compiled engine to validate.")
+        sys.exit(1)
+    scores, ok = validate({"Years": args.years}, args.runs, args.seed, (args.years // 4, args.years // 2, args.years), args.threshold)
+    sys.exit(0 if ok else 1)
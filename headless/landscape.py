@@ -0,0 +1,131 @@
+#!usr/bin/python
+
+# Spatially explicit Cereal landscape for AgModel_headless.py
+############################
+# With Landscape = "grid", the Cereal patches lie on a 2-D grid, GridWidth patches to a row (filled row by row), and the band lives at a camp at (CampX, CampY), in patch widths from the corner of the grid:
+#   The band always harvests the nearest patch that it hasn't harvested yet this year, and the search cost of a patch is CerealSearchCosts plus TravelCost per patch width of distance from the camp, so patches far from the camp are worth less.
+#   The patches that were harvested this year get the selection and cultivation treatment, as in the non-spatial model.
+#   Domestic traits also spread between neighbouring patches: every year, each patch moves NeighbourDiffusion of the way towards the mean domestic proportion of its (up to 4) neighbours. This is a vectorized 5-point stencil over the whole grid, not a loop over pairs of patches.
+# GridIndex is the spatial index: one table of all the (dx, dy) cell offsets that fit in the grid, sorted by distance, shared by any number of camps. The patches in distance order from a camp are the in-grid cells of camp + offsets, in table order, so the distance ranking of a camp costs O(patches) time without sorting, and the nearest unexploited patch is the next one in that ranking that isn't taken.
+# GridPatches keeps the patch arrays nearest to the camp first, so the front of the arrays is what the band harvests first, and all the prefix sum machinery of patches.CerealPatches carries over. The recorder writes the patch time series back in grid order (row by row), so the columns of the patch CSV files are the patches of the grid, counted from 1 along each row.
+
+import numpy as np
+from patches import CerealPatches
+
+
+def grid_shape(n, width=0):
+    '''Returns the (width, height) of a grid of n patches with width patches to a row (0 for as square a grid as possible)'''
+    width = int(width) if width > 0 else int(np.ceil(np.sqrt(n)))
+    return width, -(-int(n) // width)
+
+
+class GridIndex(object):
+    '''Spatial index of n patches on a grid of width patches to a row: the cell offsets that fit in the grid, sorted by distance, for distance rankings and nearest-patch queries from any camp'''
+    def __init__(self, n, width=0):
+        self.n = int(n)
+        self.width, self.height = grid_shape(n, width)
+        dy, dx = np.mgrid[1 - self.height:self.height, 1 - self.width:self.width]
+        distance = np.hypot(dx, dy).ravel()
+        order = np.argsort(distance, kind='stable') # (ties in row major order)
+        self.dx, self.dy, self.distance = dx.ravel()[order], dy.ravel()[order], distance[order]
+
+    def cell(self, x, y):
+        '''Returns the grid cell (column, row) that the point (x, y) lies in, clipped to the grid'''
+        return min(max(int(x), 0), self.width - 1), min(max(int(y), 0), self.height - 1)
+
+    def ranking(self, x, y):
+        '''Returns the patches (as indices into the row major patch arrays) in order of distance from the camp at (x, y), nearest first, and their distances in patch widths'''
+        cx, cy = self.cell(x, y)
+        px, py = cx + self.dx, cy + self.dy
+        cells = py * self.width + px
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height) & (cells < self.n) # (the last row may not be full)
+        return cells[inside], self.distance[inside]
+
+    def nearest(self, ranking, taken, start=0):
+        '''Returns the position in ranking (from ranking()) of the nearest patch that isn't taken (a boolean array over the row major patches), looking from position start on, or len(ranking) if they are all taken'''
+        free = np.flatnonzero(~taken[ranking[start:]])
+        return start + int(free[0]) if len(free) else len(ranking)
+
+
+def neighbour_sum(raster, out):
+    '''Put the sum of the 4 neighbours of every cell of the 2-D raster (cells off the edge count as 0) into out'''
+    out[:] = 0.
+    out[1:] += raster[:-1]
+    out[:-1] += raster[1:]
+    out[:, 1:] += raster[:, :-1]
+    out[:, :-1] += raster[:, 1:]
+    return out
+
+
+class NeighbourDiffusion(object):
+    '''The neighbour diffusion of the domestic proportion of n patches on a grid of width x height cells: each year, every patch moves rate of the way towards the mean of its (up to 4) neighbours. cell is the row major grid cell of each entry of the patch arrays (None if they are in grid order)'''
+    def __init__(self, n, width, height, rate, cell=None):
+        self.n = int(n)
+        self.rate = rate if self.n > 1 else 0.
+        self.cell = cell
+        # scratch rasters. The cells past the last patch stay 0, so they add nothing to the sums of their neighbours
+        self._raster = np.zeros((height, width))
+        self._sum = np.empty((height, width))
+        valid = np.zeros(width * height)
+        valid[:self.n] = 1.
+        count = self._patches(neighbour_sum(valid.reshape(height, width), np.empty((height, width))))
+        self._inverse = 1. / np.maximum(count, 1.) # one over the number of neighbours of each patch
+        self._delta = np.empty(self.n)
+
+    def _patches(self, raster, out=None):
+        '''Returns the values of the 2-D raster at the patches, in the order of the patch arrays'''
+        values = raster.ravel()
+        if self.cell is not None:
+            return np.take(values, self.cell, out=out)
+        if out is None:
+            return values[:self.n].copy()
+        out[:] = values[:self.n]
+        return out
+
+    def apply(self, proportion):
+        '''Apply one year of neighbour diffusion to the domestic proportion array proportion, in place'''
+        if self.rate <= 0:
+            return
+        if self.cell is None:
+            self._raster.ravel()[:self.n] = proportion
+        else:
+            self._raster.ravel()[self.cell] = proportion
+        delta = self._patches(neighbour_sum(self._raster, self._sum), self._delta)
+        delta *= self._inverse # the mean of the neighbours of each patch
+        delta -= proportion
+        delta *= self.rate
+        proportion += delta
+        np.clip(proportion, 0., 1., out=proportion)
+
+
+class GridPatches(CerealPatches):
+    '''CerealPatches on a grid, held nearest to the camp first, with distance dependent search costs and neighbour diffusion of the domestic proportion. p is the full set of model parameters'''
+    def __init__(self, p):
+        CerealPatches.__init__(self, p['Cereal'], p['CerealDensity'], p['WildToDomesticatedProportion'])
+        self.index = GridIndex(self.n, p['GridWidth'])
+        width, height = self.index.width, self.index.height
+        x = (width - 1) / 2. if p['CampX'] < 0 else p['CampX']
+        y = (height - 1) / 2. if p['CampY'] < 0 else p['CampY']
+        self.cell, self.distance = self.index.ranking(x, y) # the row major patch of each array entry, and its distance from the camp
+        self.search = p['CerealSearchCosts'] + p['TravelCost'] * self.distance # the search cost of each patch, nearest first
+        self.diffusion = NeighbourDiffusion(self.n, width, height, p['NeighbourDiffusion'], self.cell)
+
+    def remaining(self, n):
+        '''Returns the wild-to-domesticated proportion and density of the patch that the band harvests next when n patches are left (the nearest one it hasn't harvested yet). n can also be an array of patch counts'''
+        k = self.n - n
+        return self.WildToDomesticatedProportion[k], self.CerealDensity[k]
+
+    def search_cost(self, n):
+        '''Returns the search cost (hours) of the patch that the band harvests next when n patches are left'''
+        return self.search[self.n - n]
+
+    def exploited(self, eatCereal):
+        '''Returns the number of patches (nearest first) that were harvested this year'''
+        return min(max(int(eatCereal), 0), self.n)
+
+    def adjust(self, eatCereal, diffusion, selection, cultivation, mindensity, maxdensity):
+        '''Apply one year of selection/diffusion and cultivation density change (see CerealPatches.adjust()), and then the neighbour diffusion of the domestic proportion'''
+        CerealPatches.adjust(self, eatCereal, diffusion, selection, cultivation, mindensity, maxdensity)
+        if self.diffusion.rate > 0:
+            self.diffusion.apply(self.WildToDomesticatedProportion)
+            self.cumulate()
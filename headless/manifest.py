@@ -0,0 +1,102 @@
+#!usr/bin/python
+
+# Settings files and batch manifests for AgModel_headless.py
+############################
+# load_config() reads the parameters out of a settings file that the GUI version of the model (AgModel.py) saved with its Settings class (an easygui EgStore, which pickles the whole Settings object). Only the Settings object and the datetime stamps that EgStore adds are let through the unpickler, so a settings file can't run arbitrary code, and easygui doesn't have to be installed to read one.
+# read_manifest() reads a manifest of many runs, each with its own parameter overrides, from a JSON or CSV file, and run_manifest() runs them all in this one process (back to back), or on a warm pool of worker processes, so that a batch of thousands of short runs doesn't pay the startup time of a new python3 process for each one.
+# A JSON manifest is a list of runs (or a dict with the list under "runs"), each a dict of parameter names and values, with an optional "label" and "seed". A CSV manifest has a header row of parameter names (and optionally "label" and "seed" columns), and a row per run. Runs without a label are labelled "<row number>.0", and runs without a seed get one derived from the --seed of the batch (or an unpredictable one if there is no --seed).
+
+import os
+import csv
+import json
+import pickle
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from AgModel_headless import PARAMETERS, DEFAULTS, run_simulation, model_parameters
+
+
+class Settings(object):
+    '''Stand-in for the GUI's Settings class, so that its pickled objects can be loaded without it'''
+
+
+class _SettingsUnpickler(pickle.Unpickler):
+    '''Unpickler that only lets through the objects that a GUI settings file holds'''
+    def find_class(self, module, name):
+        if name == "Settings":
+            return Settings
+        if (module, name) == ("datetime", "datetime"):
+            return datetime.datetime
+        raise pickle.UnpicklingError("%s.%s isn't allowed in a settings file" % (module, name))
+
+
+def load_config(filename):
+    '''Returns the model parameters saved in the GUI settings file filename (e.g. agmodel.config), as a dict of parameter names and values'''
+    with open(filename, 'rb') as f:
+        settings = _SettingsUnpickler(f).load()
+    return dict((name, type(DEFAULTS[name])(value)) for name, value in vars(settings).items() if name in PARAMETERS) # (the GUI saves some of the integer parameters as floats)
+
+
+def _value(name, text):
+    '''Convert the text of a CSV manifest cell to the type of parameter name'''
+    kind = type(DEFAULTS[name])
+    if kind is int:
+        return int(float(text)) # (so that 1e6 works too)
+    return kind(text)
+
+
+def read_manifest(filename):
+    '''Returns the runs of the JSON or CSV manifest filename, as a list of dicts with the parameter overrides ("params") and the "label" and "seed" (None where not given) of each run'''
+    if os.path.splitext(filename)[1].lower() == '.json':
+        with open(filename) as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows["runs"]
+    else:
+        with open(filename, newline='') as f:
+            rows = [dict((name.strip(), text.strip()) for name, text in row.items() if text is not None and text.strip() != "") for row in csv.DictReader(f)]
+        for row in rows:
+            for name in row:
+                if name in PARAMETERS:
+                    row[name] = _value(name, row[name])
+    runs = []
+    for n, row in enumerate(rows):
+        row = dict(row)
+        label = row.pop("label", None)
+        seed = row.pop("seed", None)
+        model_parameters(row) # raises KeyError for unknown parameter names
+        runs.append({"params": row, "label": '%s.0' % (n + 1) if label is None else str(label), "seed": None if seed is None else int(seed)})
+    return runs
+
+
+def _init_worker(cache, cachesize, profile=False):
+    '''Open the result cache (if any) once in each worker process of the pool'''
+    global results, profiling
+    results = None
+    profiling = profile
+    if cache is not None:
+        from cache import ResultCache
+        results = ResultCache(cache, cachesize)
+
+
+def _run(run):
+    '''Run one run of a manifest (through the result cache, if there is one), and return its label and output recorder'''
+    simulate = lambda params, seed: run_simulation(params, seed, profiling)
+    if results is not None:
+        return run["label"], results.run(run["params"], run["seed"], simulate)[0]
+    return run["label"], simulate(run["params"], run["seed"])
+
+
+def run_manifest(runs, processes=1, cache=None, cachesize=None, profile=False):
+    '''Run each of runs (dicts with the "params", "label" and "seed" of each run), and yield the label and output recorder of each as it finishes. With processes=1 the runs are run one after another in this process, otherwise on a warm pool of that many worker processes (None for one per CPU). cache is the directory of a result cache to go through (see cache.py), and cachesize its size cap in bytes. With profile=True, each run is profiled (see profiling.py)'''
+    if processes == 1:
+        _init_worker(cache, cachesize, profile)
+        for run in runs:
+            yield _run(run)
+        return
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(cache, cachesize, profile)) as pool:
+        futures = [pool.submit(_run, run) for run in runs]
+        for future in as_completed(futures):
+            yield future.result()
@@ -1,11 +1,29 @@
 #!usr/bin/python
 import sys, os, time
-from subprocess import Popen, list2cmdline
+import numpy as np
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from AgModel_headless import run_seed
+from recorders import GENERAL_STATS_FILE, PATCH_DENSITY_FILE, PATCH_PROPORTION_FILE, GENERAL_STATS_DTYPE, patch_file, read_general_stats
 
 ##############################
 ## EDIT THESE VALUES -- They are the parameters to sweep through. Change names and values to fit the CLI command in cmdlist
 
+design = "grid" # How to pick the experiments. "grid" runs every combination of the values in v1list, v2list and v3list below (a full Cartesian product). "lhs" (Latin hypercube) and "sobol" (Sobol sequence) spread "samples" experiments evenly over the ranges in "space", for any number of parameters (see sampler.py)
+
+space = {"PreyReturns": (100000.0, 300000.0), "CerealDiffusionRate": (0.005, 0.05), "ForagingUncertainty": (0.01, 0.3)} # For "lhs" and "sobol": the parameters to sweep, and the (low, high) range of each. Any of the model's parameters can be used (see PARAMETERS in AgModel_headless.py)
+
+logscale = [] # For "lhs" and "sobol": names of the parameters in space that are spread evenly on a log scale, rather than a linear one
+
+samples = 32 # For "lhs" and "sobol": the number of experiments in the first round
+
+rounds = 0 # For "lhs" and "sobol": the number of rounds of adaptive refinement after the first round. Each round adds "perround" experiments where "metric" changes most sharply between neighbouring experiments so far
+
+perround = 16 # Number of experiments added by each round of adaptive refinement
+
+metric = "domestication" # The output that adaptive refinement follows: "domestication" (the first year that ProportionDomesticated reaches 0.5), "population" (the human population at the end) or "domestic" (ProportionDomesticated at the end). See METRICS in sampler.py
+
 v1list = [0.030,0.0325,0.035] # List of values of variable 1 to sweep through
 v1name = "HumanBirthRate" # Name of variable 1, for output files
 
@@ -21,7 +39,35 @@ expout = '%s%sSimulation_variables_and_numbers_list.csv' % (os.getcwd(), os.sep)
 
 cmdout = False # Change to True to write all iterations of cmdlist to expout
 
-## EDIT ONLY WHERE NOTED BELOW THIS LINE (LINE 94 ONLY)
+mode = "subprocess" # How to run the repetitions. "subprocess" starts a new python3 process running AgModel_headless.py for each repetition. "pool" keeps a warm pool of worker processes that import the model once, run each repetition with run_simulation(), and hand the results straight back to this process in memory (much faster for short runs). "ensemble" also uses the pool, but runs all of the repetitions of an experiment at once, in lockstep, with the vectorized engine in ensemble.py (much faster again when there are many repetitions). "queue" puts all of the repetitions in a shared task queue file (see queue below), so that other machines that share this filesystem can work on the sweep too, and works on it with a process per CPU here
+
+seed = None # Base seed for the random number generator. Set it to an integer to make the whole sweep reproducible (each repetition gets its own seed derived from this one), or leave it as None for unpredictable seeds
+
+cache = None # Directory of a result cache (see cache.py), or None for no cache. With a cache, every finished run is stored under a hash of its full parameter set, seed and the model version, and runs that are already in the cache are served from it (or skipped, if their output files are already there) instead of being simulated again. This lets an interrupted sweep resume where it left off, and lets you add values to a sweep without rerunning the old ones. Only works when seed is set (the "ensemble" mode doesn't use the cache)
+
+cachesize = 10 # Size cap of the result cache, in GB. The least recently used runs are deleted from the cache when it grows past this
+
+store = None # File name of a sweep store (see store.py), e.g. 'sweep.zip', or None. With a store, the output of all the runs goes into this one binary file, indexed by experiment and repetition, instead of three CSV files per run. Use "python3 store.py sweep.zip --csv" to export CSV files from it later
+
+reduce = False # Set to True to only keep summary statistics of each experiment (yearly mean, standard deviation, minimum, maximum and quantiles of the general stats, and the mean and standard deviation of every patch), rather than the output of every run. Each worker folds its runs straight into running summaries, which are merged and written once per experiment (Experiment<N>_summary.csv and friends, see summaries.py), so no per-run output is ever written. The store and cache settings are ignored when this is on
+
+patches = None # How to write the patch density and domestic proportion CSV files of each run: None (the default, "full" for most runs and "decimate" for runs on the compact Landscape), "full" (every patch in every year, not for the compact Landscape), "decimate" (only every "every" years), "changes" (only the patches whose value changed each year), "delta" (the yearly changes, run-length encoded, usually the smallest) or "none" (no patch files). See PATCH_POLICIES in recorders.py, and read_patch_stats() there to read any of them back as the full matrix. The sweep store always keeps the full series
+
+every = 10 # Interval in years between the recorded years when patches = "decimate"
+
+queue = 'sweep.db' # File name of the task queue of the "queue" mode (see taskqueue.py). Start workers on other machines with "python3 taskqueue.py sweep.db --work" (in this directory). Submitting the same sweep again only runs what isn't done yet
+
+lease = 120 # Lease time of a run in the "queue" mode, in seconds. If the worker running it (or its machine) dies, the run is given to another worker after this long
+
+retries = 1 # Number of times to retry a run that fails, before it is left out of the sweep. Runs that still fail are listed in the failures file below, and the rest of the sweep carries on
+
+failures = '%s%sSimulation_failed_runs.csv' % (os.getcwd(), os.sep) # This is an output text file that lists the runs that failed (if any), and why
+
+profile = False # Set to True to profile every run (see profiling.py): each run writes a JSON report of the wall time of each phase of its yearly loop, its foraging bouts per year and the random numbers it drew, and the reports of the whole sweep are put together in one table, Simulation_profile_summary.csv, at the end. Not available in the "ensemble" mode or with reduce on, as they don't simulate or write out runs one by one
+
+memory = None # Memory budget of the sweep, in GB. The number of runs at once is capped so that their predicted memory use (see scheduler.py) fits in it, as well as by the number of CPUs. None uses the free physical memory when the sweep starts
+
+## EDIT ONLY WHERE NOTED BELOW THIS LINE (THE "cmdlist" AND "params" LINES ONLY)
 ##############################
 
 
@@ -47,58 +93,385 @@ def cpu_count():
     return num
 
 
-def exec_commands(cmds):
+def budget():
+    '''Returns the memory budget of the sweep in bytes (None if there is no cap)'''
+    from scheduler import available_memory
+    return available_memory() if memory is None else int(memory * 1024**3)
+
+
+def workers(memories):
+    '''Returns the number of pool worker processes for tasks with the predicted memories (in bytes): one per CPU, but no more than the memory budget has room for, with each worker running the largest of the tasks'''
+    room = budget()
+    if room is None or not memories:
+        return cpu_count()
+    return int(max(1, min(cpu_count(), room // max(memories))))
+
+
+def exec_commands(cmds, tasks, progress):
     ''' Execute commands in "parallel" as multiple processes across as
-        many CPU's as are available'''
+        many CPU's as are available (and as memory allows), longest
+        runs first, retrying failed runs (see scheduler.py)'''
     if not cmds: return # empty list
+    from scheduler import run_commands, predicted_cost, predicted_memory
+    run_commands(cmds, [task["label"] for task in tasks], [predicted_cost(task["params"]) for task in tasks], [predicted_memory(task["params"]) for task in tasks], cpu_count(), budget(), retries, progress)
 
-    def done(p):
-        return p.poll() is not None
-    def success(p):
-        return p.returncode == 0
-    def fail():
-        sys.exit(1)
 
-    max_task = cpu_count()
-    processes = []
-    while True:
-        while cmds and len(processes) < max_task:
-            task = cmds.pop()
-            print(list2cmdline(task))
-            processes.append(Popen(task))
-
-        for p in processes:
-            if done(p):
-                if success(p):
-                    processes.remove(p)
-                else:
-                    fail()
+def open_store():
+    '''Open the sweep store for appending, or return None if the output goes to CSV files'''
+    if store is None:
+        return None
+    from store import SweepStore
+    return SweepStore(store, 'a')
+
 
-        if not processes and not cmds:
-            break
+def write_run(label, recorder, out):
+    '''Write the output of the run called label to the sweep store out, or to its CSV files if out is None'''
+    start = time.perf_counter()
+    if out is None:
+        recorder.write_csv(label, patches=patches, every=every)
+    else:
+        out.put(label, recorder)
+    if getattr(recorder, "profile", None) is not None:
+        from profiling import write_report
+        recorder.profile["phases"]["output"] += time.perf_counter() - start
+        write_report(recorder.profile, label)
+
+
+def finished(label, out):
+    '''Check if the output of the run called label has already been written to the sweep store out (or to CSV files if out is None)'''
+    if out is None:
+        names = [GENERAL_STATS_FILE] if patches == "none" else [GENERAL_STATS_FILE, patch_file(PATCH_DENSITY_FILE, patches), patch_file(PATCH_PROPORTION_FILE, patches)]
+        return all(os.path.exists(name % label) for name in names)
+    return label in out
+
+
+def serve_cached(tasks, commands=None, out=None):
+    '''Take the tasks whose results are already in the result cache out of tasks (and the matching entries out of commands), and write their output from the cache (to the sweep store out, or CSV files if out is None), unless it is already there. Returns the remaining tasks and commands'''
+    from cache import ResultCache
+    results = ResultCache(cache, int(cachesize * 1024**3))
+    remaining, remainingcmds = [], []
+    for j, task in enumerate(tasks):
+        recorder = results.get(task["params"], task["seed"])
+        if recorder is None:
+            remaining.append(task)
+            if commands is not None:
+                remainingcmds.append(commands[j])
+        elif finished(task["label"], out):
+            print("Skipping run %s, it is already done" % task["label"])
         else:
-            time.sleep(0.05)
+            print("Serving run %s from the result cache" % task["label"])
+            write_run(task["label"], recorder, out)
+    return remaining, remainingcmds
+
+
+def _init_worker(profile=False):
+    '''Import the model once in each worker process of the pool'''
+    global run_simulation, profiling
+    from AgModel_headless import run_simulation
+    profiling = profile
 
-if __name__ == "__main__":
-    #create a list of variable combos ("Cartesian product")
-    varlist = list(product(v1list, v2list, v3list))
-    # write out experiments list to a file and assemble the command strings
-    f = open(expout, 'w+') # Open up a text file to write out a list of the experiments to
-    f.write("Experiment number,%s,%s,%s,repetitions\n" % (v1name,v2name,v3name))
-    commands = []
-    for i in range(len(varlist)):
-        f.write("%s,%s,%s,%s,%s\n" % (i + 1, varlist[i][0], varlist[i][1], varlist[i][2], repeats)) # writing the experiment list to that file
-        for x in range(repeats):
 
-            ###YOU MAY NEED TO EDIT THIS LINE
-            cmdlist = ['python3', 'AgModel_headless.py', '--HumanBirthRate', '%s' % varlist[i][0], '--CerealSelectionRate', '%s' % varlist[i][1], '--CerealCultivationDensity', '%s' % varlist[i][2], '--label', '%s.%s' % (i + 1, str(x).zfill(len(str(repeats)))) ] # This is the main CLI command that will be constructed for each experiment. It must be in list form, with each CLI argument as an individual list element. Edit to match your model's CLI interface. NOTE that varible "varlist[i][1]" will be replaced by a numerical value from your list of values for the first variable, etc. Ensure that these variables appear at the proper place in the CLI for your model.
-            ##STOP EDITING
+def _run_task(task):
+    '''Run one repetition in a pool worker, and return its label and output recorder'''
+    return task["label"], run_simulation(task["params"], task["seed"], profiling)
 
-            commands.append(cmdlist) # creating a CLI command for each experiment and repetition. and appending the current CLI command to the list
+
+def _run_experiment(experiment):
+    '''Run all the repetitions of one experiment as an ensemble in a pool worker, and return their labels and the ensemble's output recorder'''
+    from ensemble import run_ensemble
+    return experiment["labels"], run_ensemble(experiment["params"], len(experiment["labels"]), experiment["seed"], record_patches=True)
+
+
+def _pool(size):
+    '''Start a warm pool of size worker processes that have each imported the model'''
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    return ProcessPoolExecutor(max_workers=size, mp_context=context, initializer=_init_worker, initargs=(profile,))
+
+
+def exec_ensembles(experiments, progress, out=None):
+    '''Run experiments (dicts with the "number", "params", "seed" and repetition "labels" of each experiment) as ensembles on a warm pool of worker processes, largest first, and write out each repetition's output (to the sweep store out, or CSV files if out is None) as the results come back'''
+    if not experiments: return # empty list
+    from scheduler import run_tasks, predicted_cost, predicted_memory
+    with _pool(workers([predicted_memory(experiment["params"]) * len(experiment["labels"]) for experiment in experiments])) as pool:
+        for experiment, (labels, recorder) in run_tasks(pool, _run_experiment, experiments, [experiment["number"] for experiment in experiments], [predicted_cost(experiment["params"]) * len(experiment["labels"]) for experiment in experiments], retries, progress):
+            for r, label in enumerate(labels):
+                write_run(label, recorder.replicate(r), out)
+            progress.finish(experiment["number"])
+
+
+def _reduce_batch(batch):
+    '''Run a batch of repetitions of one experiment in a pool worker (one by one, or all at once as an ensemble), fold them into an ExperimentSummary, and return the experiment number and the summary'''
+    from summaries import ExperimentSummary, summary_patches
+    from AgModel_headless import model_parameters
+    tasks = batch["tasks"]
+    p = model_parameters(tasks[0]["params"])
+    summary = ExperimentSummary(p['Years'], summary_patches(p))
+    if batch["ensemble"]:
+        from ensemble import run_ensemble
+        recorder = run_ensemble(tasks[0]["params"], len(tasks), tasks[0]["seed"], record_patches=True)
+        for r in range(len(tasks)):
+            summary.add(recorder.replicate(r))
+    else:
+        for task in tasks:
+            summary.add(run_simulation(task["params"], task["seed"]))
+    return batch["experiment"], summary
+
+
+def write_summary(experiment, summary):
+    '''Write out the summary statistics of an experiment, and save its accumulators so that more repetitions can be folded in later'''
+    print("Finished experiment %s (%s repetitions)" % (experiment, summary.count))
+    summary.write_csv(experiment)
+    summary.save("Experiment%s_summary.npz" % experiment)
+
+
+def exec_reduce(tasks, progress, ensemble=False):
+    '''Run tasks (dicts with the "experiment", "params", "seed" and "label" of each repetition) on a warm pool of worker processes, in batches that each worker reduces to summary statistics, and merge and write out the summaries of each experiment once all its repetitions are in. With ensemble=True, each batch is run as a vectorized ensemble'''
+    if not tasks: return # empty list
+    size = max(1, -(-len(tasks) // (4 * cpu_count()))) # about four batches per worker, to balance the load
+    batches = []
+    for task in tasks:
+        if not batches or batches[-1]["experiment"] != task["experiment"] or len(batches[-1]["tasks"]) == size:
+            batches.append({"experiment": task["experiment"], "ensemble": ensemble, "tasks": []})
+        batches[-1]["tasks"].append(task)
+    expected = dict((task["experiment"], 0) for task in tasks)
+    for task in tasks:
+        expected[task["experiment"]] += 1
+    progress.total = len(batches)
+    summaries = {}
+    from scheduler import run_tasks, predicted_cost, predicted_memory
+    with _pool(workers([predicted_memory(task["params"]) for task in tasks])) as pool:
+        for batch, (experiment, summary) in run_tasks(pool, _reduce_batch, batches, ["%s-%s" % (batch["tasks"][0]["label"], batch["tasks"][-1]["label"]) for batch in batches], [predicted_cost(batch["tasks"][0]["params"]) * len(batch["tasks"]) for batch in batches], retries, progress):
+            progress.finish("%s-%s" % (batch["tasks"][0]["label"], batch["tasks"][-1]["label"]))
+            expected[experiment] -= len(batch["tasks"])
+            if experiment in summaries:
+                summaries[experiment].merge(summary)
+            else:
+                summaries[experiment] = summary
+            if expected[experiment] == 0:
+                write_summary(experiment, summaries.pop(experiment)) # all its repetitions are in, so write it out and let go of it
+    for experiment, summary in sorted(summaries.items()): # experiments that lost some of their repetitions
+        write_summary(experiment, summary)
+
+
+def exec_pool(tasks, progress, out=None):
+    '''Run tasks (dicts with the "params", "seed" and "label" of each repetition) on a warm pool of worker processes, one per CPU (as memory allows), longest first, and write out each run's output (to the sweep store out, or CSV files if out is None) as its results come back'''
+    if not tasks: return # empty list
+    from scheduler import run_tasks, predicted_cost, predicted_memory
+    with _pool(workers([predicted_memory(task["params"]) for task in tasks])) as pool:
+        results = None
+        if cache is not None:
+            from cache import ResultCache
+            results = ResultCache(cache, int(cachesize * 1024**3))
+        for task, (label, recorder) in run_tasks(pool, _run_task, tasks, [task["label"] for task in tasks], [predicted_cost(task["params"]) for task in tasks], retries, progress):
+            write_run(label, recorder, out)
+            progress.finish(label)
+            if results is not None:
+                results.put(task["params"], task["seed"], recorder) # cache the run here, in the one process that writes to the cache
+
+
+def exec_queue(tasks, experiments):
+    '''Put tasks (dicts with the "experiment", "params", "seed" and "label" of each repetition) and experiments in the shared task queue, work on it with a process per CPU (as memory allows) until it is done, and write out the summaries of the experiments if reduce is on. Returns a scheduler.Progress of the tasks'''
+    from scheduler import Progress, predicted_memory
+    from taskqueue import TaskQueue, work_in_parallel
+    settings = {"path": os.getcwd(), "store": store, "patches": patches, "every": every, "reduce": reduce, "cache": cache if seed is not None else None, "cachesize": cachesize, "lease": lease, "retries": retries, "profile": profile}
+    with TaskQueue(queue) as q:
+        added = q.submit(tasks, experiments, settings)
+    print("Added %s of %s runs to the task queue %s" % (added, len(tasks), queue))
+    numbers = sorted(set(task["experiment"] for task in tasks))
+    if reduce and added == len(tasks):
+        for experiment in numbers:
+            if os.path.exists("Experiment%s_summary.npz" % experiment):
+                os.remove("Experiment%s_summary.npz" % experiment) # a new sweep, so start its summaries afresh
+    work_in_parallel(queue, workers([predicted_memory(task["params"]) for task in tasks]))
+    progress = Progress(len(tasks))
+    labels = set(task["label"] for task in tasks)
+    with TaskQueue(queue) as q:
+        progress.failed = [(label, error) for label, error in q.failed() if label in labels]
+    progress.done = len(tasks) - len(progress.failed)
+    if reduce:
+        from summaries import ExperimentSummary
+        for experiment in numbers:
+            if os.path.exists("Experiment%s_summary.npz" % experiment):
+                write_summary(experiment, ExperimentSummary.load("Experiment%s_summary.npz" % experiment))
+    return progress
+
+
+def command(point, label):
+    '''Returns the command line that runs one repetition of the experiment with the parameter values in the mapping point (for the "lhs" and "sobol" designs)'''
+    from AgModel_headless import parser
+    cmdlist = ['python3', 'AgModel_headless.py']
+    for name, value in point.items():
+        if '--%s' % name not in parser._option_string_actions:
+            sys.exit("%s can't be set on the command line of AgModel_headless.py, so it can't be swept in \"subprocess\" mode. Use the \"pool\" or \"ensemble\" mode instead" % name)
+        cmdlist = cmdlist + ['--%s' % name, '%s' % value]
+    return cmdlist + ['--label', label]
+
+
+def execute(commands, tasks, experiments):
+    '''Run the repetitions of a set of experiments in the chosen mode, and write out their output. Returns the scheduler.Progress of the runs, which lists the ones that failed'''
+    from scheduler import Progress
+    if mode == "queue":
+        return exec_queue(tasks, experiments)
+    if reduce:
+        if mode == "subprocess":
+            from summaries import ExperimentSummary
+            numbers = sorted(set(task["experiment"] for task in tasks))
+            for experiment in numbers:
+                if os.path.exists("Experiment%s_summary.npz" % experiment):
+                    os.remove("Experiment%s_summary.npz" % experiment) # start this sweep's summaries afresh
+            progress = Progress(len(tasks))
+            exec_commands([command + ['--summary', 'Experiment%s_summary.npz' % task["experiment"]] for command, task in zip(commands, tasks)], tasks, progress) # each run folds itself into the summary file of its experiment
+            for experiment in numbers:
+                if os.path.exists("Experiment%s_summary.npz" % experiment):
+                    write_summary(experiment, ExperimentSummary.load("Experiment%s_summary.npz" % experiment))
+        else:
+            progress = Progress(0, "batch", "batches")
+            exec_reduce(tasks, progress, mode == "ensemble") # reduce batches of runs to summaries on a warm pool of workers
+        return progress
+    out = open_store() # in the pool modes, this process is the only one that writes to the sweep store, so it holds it open for the whole sweep
+    if cache is not None and seed is not None and mode != "ensemble":
+        tasks, commands = serve_cached(tasks, commands, out) # leave out the runs that are already in the result cache
+        commands = [command + ['--cache', cache, '--cachesize', '%s' % cachesize] for command in commands]
+    if mode == "ensemble":
+        progress = Progress(len(experiments), "experiment")
+        exec_ensembles(experiments, progress, out) # execute each experiment as one vectorized ensemble of all its repetitions, on a warm pool of workers
+    elif mode == "pool":
+        progress = Progress(len(tasks))
+        exec_pool(tasks, progress, out) # execute all of the experiments on a warm pool of workers, one per core, until they are all done
+    else:
+        progress = Progress(len(tasks))
+        if out is not None:
+            out.close() # in "subprocess" mode, each run appends itself to the sweep store
+            out = None
+            commands = [command + ['--store', store] for command in commands]
+        exec_commands(commands, tasks, progress) # execute all of the experiments using every available core until they are all done
+    if out is not None:
+        out.close()
+    return progress
+
+
+def measure(experiments):
+    '''Returns the mean of the metric over the repetitions of each of experiments (dicts with the "number" and repetition "labels" of each experiment), read back from their output'''
+    from sampler import METRICS
+    values = []
+    if reduce:
+        from summaries import ExperimentSummary
+        for experiment in experiments:
+            mean = ExperimentSummary.load("Experiment%s_summary.npz" % experiment["number"]).general.mean
+            stats = np.zeros(len(mean), dtype=GENERAL_STATS_DTYPE)
+            for j, name in enumerate(GENERAL_STATS_DTYPE.names[1:]):
+                stats[name] = mean[:, j]
+            values.append(METRICS[metric](stats)) # the metric of the mean run
+        return values
+    reader = None
+    if store is not None:
+        from store import SweepStore
+        reader = SweepStore(store)
+    for experiment in experiments:
+        results = []
+        for label in experiment["labels"]:
+            try:
+                stats = reader.get(label, patches=False).stats if reader is not None else read_general_stats(GENERAL_STATS_FILE % label)
+            except (IOError, OSError, KeyError):
+                continue
+            results.append(METRICS[metric](stats))
+        values.append(np.mean(results) if results else np.nan)
+    if reader is not None:
+        reader.close()
+    return values
+
+
+def write_experiments(names, rows, values, commands):
+    '''Write out the list of experiments (rows of the experiment number, the values of the swept variables and the number of repetitions, and for the "lhs" and "sobol" designs the round and the metric, where it is known yet) to expout'''
+    f = open(expout, 'w+') # Open up a text file to write out a list of the experiments to
+    f.write("Experiment number,%s,repetitions%s\n" % (",".join(names), "" if design == "grid" else ",round,%s" % metric))
+    for n, row in enumerate(rows):
+        if design != "grid":
+            row = row + [values[n] if n < len(values) else ""]
+        f.write(",".join("%s" % value for value in row) + "\n") # writing the experiment list to that file
     if cmdout is True:
-        for command in commands:
-            f.write(" ".join(command) + "\n") # Writing the CLI command to experiment list text file, if we are told to do so
+        for cmd in commands:
+            f.write(" ".join(cmd) + "\n") # Writing the CLI command to experiment list text file, if we are told to do so
     f.close() # close text file
 
-    exec_commands(commands) # execute all of the experiments using every available core until they are all done
+
+if __name__ == "__main__":
+    names = [v1name, v2name, v3name] if design == "grid" else list(space)
+    varlist = [] # the values of the swept variables in each experiment, in the order of names
+    rows = [] # the lines of the experiments list
+    unit = np.empty((0, len(names))) # where the experiments so far sit in the unit cube of the space (for adaptive refinement)
+    values = [] # the metric of each experiment so far
+    allcommands = [] # the commands of the earlier rounds
+    failed = [] # the runs that failed, and why
+    labels = [] # the labels of all the runs
+    for sweepround in range(1 if design == "grid" else rounds + 1):
+        #pick the variable combos for this round
+        if design == "grid":
+            points = [dict(zip(names, combo)) for combo in product(v1list, v2list, v3list)] # create a list of variable combos ("Cartesian product")
+        else:
+            from sampler import design as plan, refine, scale
+            new = plan(design, samples, len(names), seed) if sweepround == 0 else refine(unit, values, perround, None if seed is None else seed + sweepround)
+            unit = np.vstack((unit, new))
+            points = scale(new, space, logscale)
+        # assemble the command strings and tasks
+        commands = []
+        tasks = []
+        experiments = []
+        for point in points:
+            i = len(varlist)
+            varlist.append(tuple(point[name] for name in names))
+            rows.append([i + 1] + list(varlist[i]) + [repeats] + ([] if design == "grid" else [sweepround]))
+            for x in range(repeats):
+                label = '%s.%s' % (i + 1, str(x).zfill(len(str(repeats)))) # the experiment and repetition number, used to name the output files
+
+                if design == "grid":
+                    ###YOU MAY NEED TO EDIT THIS LINE
+                    cmdlist = ['python3', 'AgModel_headless.py', '--HumanBirthRate', '%s' % varlist[i][0], '--CerealSelectionRate', '%s' % varlist[i][1], '--CerealCultivationDensity', '%s' % varlist[i][2], '--label', label ] # This is the main CLI command that will be constructed for each experiment. It must be in list form, with each CLI argument as an individual list element. Edit to match your model's CLI interface. NOTE that varible "varlist[i][1]" will be replaced by a numerical value from your list of values for the first variable, etc. Ensure that these variables appear at the proper place in the CLI for your model.
+                    ##STOP EDITING
+                elif mode == "subprocess":
+                    cmdlist = command(point, label) # the other designs build the command line from the parameter names
+                else:
+                    cmdlist = []
+
+                runseed = None if seed is None else run_seed(seed, i + 1, x)
+                if runseed is not None:
+                    cmdlist = cmdlist + ['--seed', '%s' % runseed]
+                if patches is not None:
+                    cmdlist = cmdlist + ['--patches', patches, '--every', '%s' % every]
+                if profile:
+                    cmdlist = cmdlist + ['--profile']
+                commands.append(cmdlist) # creating a CLI command for each experiment and repetition. and appending the current CLI command to the list
+
+                if design == "grid":
+                    ###YOU MAY NEED TO EDIT THIS LINE TOO, TO MATCH cmdlist
+                    params = {v1name: varlist[i][0], v2name: varlist[i][1], v3name: varlist[i][2]} # These are the parameter values that "pool" mode hands to run_simulation() for each experiment. The names must be parameter names of the model (see PARAMETERS in AgModel_headless.py).
+                    ##STOP EDITING
+                else:
+                    params = dict(point)
+
+                tasks.append({"experiment": i + 1, "params": params, "seed": runseed, "label": label})
+            experiments.append({"number": i + 1, "params": params, "seed": None if seed is None else run_seed(seed, i + 1, repeats), "labels": [task["label"] for task in tasks[-repeats:]]})
+        write_experiments(names, rows, values, allcommands + commands) # write out experiments list to a file (again after every round, to add the new experiments and the metric of the old ones)
+        failed.extend(execute(commands, tasks, experiments).failed)
+        if design != "grid" and rounds > 0:
+            values.extend(measure(experiments)) # see how the metric came out, to steer the next round
+        allcommands.extend(commands)
+        labels.extend(task["label"] for task in tasks)
+    if design != "grid" and rounds > 0:
+        write_experiments(names, rows, values, allcommands)
+    if profile:
+        from profiling import aggregate, PROFILE_FILE, PROFILE_SUMMARY_FILE
+        reports = [PROFILE_FILE % label for label in labels if os.path.exists(PROFILE_FILE % label)] # (runs served from the result cache weren't simulated, so have no report)
+        if reports:
+            aggregate(reports, PROFILE_SUMMARY_FILE) # one table of the profiles of all the runs of the sweep
+            print("Wrote the profiles of %s runs to %s" % (len(reports), PROFILE_SUMMARY_FILE))
+    if failed:
+        f = open(failures, 'w+') # list the runs that failed, so that they can be looked into and rerun
+        f.write("Run,Reason\n")
+        for label, reason in failed:
+            f.write('%s,"%s"\n' % (label, str(reason).replace('"', "'")))
+        f.close()
+        print("%s runs failed, see %s" % (len(failed), failures))
+        sys.exit(1)
     sys.exit(0)
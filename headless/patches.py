@@ -0,0 +1,151 @@
+#!usr/bin/python
+
+# Array-backed Cereal patch engine for AgModel_headless.py
+############################
+# Holds the per-patch Cereal state in preallocated NumPy arrays, and applies the yearly selection/diffusion and cultivation density changes to them in place with masked array operations. This replaces the per-year patch_adjust list/DataFrame and the chained pandas Series.where expressions of earlier versions.
+# CompactPatches (the "compact" Landscape) holds the same state run-length encoded, for landscapes of 10^5 to 10^6 patches and more. All the patches start out the same, and every year the update treats the patches in front of the exploited count one way and all the others another way, so the patches always form runs of neighbouring patches with the same density and proportion, and at most one new run starts each year. CompactPatches keeps one entry per run (the first patch as uint32, and the density and proportion as float32), and works on the runs only, so that neither memory nor the time of a year grows with the number of patches. The values are float32, so a compact run follows the same dynamics as a dense one, but not its exact random number stream.
+
+import numpy as np
+
+
+class CerealPatches(object):
+    '''Preallocated density and wild-to-domesticated proportion arrays for all Cereal patches, plus scratch buffers for the yearly update'''
+    def __init__(self, n, density, proportion):
+        '''n is the number of Cereal patches, density is the starting kernel yield per patch, proportion is the starting wild-to-domesticated proportion'''
+        self.n = int(n)
+        self.CerealDensity = np.full(self.n, density, dtype=float)
+        self.WildToDomesticatedProportion = np.full(self.n, proportion, dtype=float)
+        # scratch buffers that are reused every year so that the update never allocates
+        self._new = np.empty(self.n, dtype=float)
+        self._keep = np.empty(self.n, dtype=bool)
+        self._mask = np.empty(self.n, dtype=bool)
+        # prefix sums of the two arrays, so that the mean of any number of remaining patches is O(1) during foraging
+        self.cumdensity = np.zeros(self.n + 1, dtype=float)
+        self.cumproportion = np.zeros(self.n + 1, dtype=float)
+        self.cumulate()
+
+    def cumulate(self):
+        '''Refresh the prefix sums. Call this whenever the patch arrays have changed (i.e., once a year, after the update)'''
+        np.cumsum(self.CerealDensity, out=self.cumdensity[1:])
+        np.cumsum(self.WildToDomesticatedProportion, out=self.cumproportion[1:])
+
+    def remaining(self, n):
+        '''Returns the mean wild-to-domesticated proportion and mean density of the first n patches (the patches that have not been harvested yet this year). n can also be an array of patch counts, all of which must be > 0'''
+        return self.cumproportion[n] / n, self.cumdensity[n] / n
+
+    def exploited(self, eatCereal):
+        '''Returns the number of patches (counting from the front of the array) that get the selection and cultivation treatment when eatCereal patches were harvested this year'''
+        # patch x (counting from 1) is treated as exploited if x < eatCereal, as in the original patch_adjust loop
+        return min(max(int(eatCereal) - 1, 0), self.n)
+
+    def _apply(self, values, lower, upper):
+        '''Copy the candidate values in the scratch buffer into values, but only where they fall between lower and upper (inclusive)'''
+        np.greater(self._new, upper, out=self._keep)
+        np.less(self._new, lower, out=self._mask)
+        np.logical_or(self._keep, self._mask, out=self._keep)
+        np.logical_not(self._keep, out=self._mask)
+        np.copyto(values, self._new, where=self._mask)
+
+    def adjust(self, eatCereal, diffusion, selection, cultivation, mindensity, maxdensity):
+        '''Apply one year of selection/diffusion and cultivation density change. eatCereal is the number of patches harvested this year, diffusion and selection are this year's rates, cultivation is the yearly change in kernel yield, and mindensity and maxdensity bound the kernel yield per patch'''
+        k = self.exploited(eatCereal)
+        new = self._new
+        # Cultivation increases the yield of exploited patches, and neglect decreases it everywhere else, but a patch is left as is if the change would take it past either bound.
+        density = self.CerealDensity
+        np.add(density[:k], cultivation, out=new[:k])
+        np.subtract(density[k:], cultivation, out=new[k:])
+        self._apply(density, mindensity + cultivation, maxdensity - cultivation)
+        # Selection is balanced against diffusion in exploited patches, while only diffusion occurs in the others. Again, a patch is left as is if the change would take it out of the range 0 to 1.
+        proportion = self.WildToDomesticatedProportion
+        np.add(proportion[:k], diffusion - selection, out=new[:k])
+        np.add(proportion[k:], diffusion, out=new[k:])
+        self._apply(proportion, 0 + selection, 1 - diffusion)
+        self.cumulate()
+
+
+class CompactPatches(object):
+    '''Run-length encoded density and wild-to-domesticated proportion of all Cereal patches: runs of neighbouring patches with the same values, stored as structure-of-arrays (first patch of each run, and its density and proportion)'''
+    def __init__(self, n, density, proportion):
+        '''n is the number of Cereal patches, density is the starting kernel yield per patch, proportion is the starting wild-to-domesticated proportion'''
+        self.n = int(n)
+        if self.n >= 2**32:
+            raise ValueError("The compact landscape holds up to 2^32 - 1 patches, not %s" % self.n)
+        self.starts = np.zeros(1, dtype=np.uint32) # the first patch of each run (counting from 0)
+        self.density = np.full(1, density, dtype=np.float32)
+        self.proportion = np.full(1, proportion, dtype=np.float32)
+        self.cumulate()
+
+    @property
+    def runs(self):
+        '''The number of runs of patches'''
+        return len(self.starts)
+
+    def lengths(self):
+        '''Returns the number of patches in each run'''
+        return np.diff(self.starts, append=self.n).astype(np.int64)
+
+    @property
+    def CerealDensity(self):
+        '''The density of every patch, as a float32 array (this expands the runs, so it takes O(patches) time and memory)'''
+        return np.repeat(self.density, self.lengths())
+
+    @property
+    def WildToDomesticatedProportion(self):
+        '''The wild-to-domesticated proportion of every patch, as a float32 array (this expands the runs, so it takes O(patches) time and memory)'''
+        return np.repeat(self.proportion, self.lengths())
+
+    def cumulate(self):
+        '''Refresh the prefix sums of the runs. Call this whenever the runs have changed'''
+        lengths = self.lengths()
+        self.cumdensity = np.concatenate(([0.], np.cumsum(lengths * self.density.astype(float))))
+        self.cumproportion = np.concatenate(([0.], np.cumsum(lengths * self.proportion.astype(float))))
+
+    def totals(self):
+        '''Returns the total density and total proportion of all the patches'''
+        return self.cumdensity[-1], self.cumproportion[-1]
+
+    def remaining(self, n):
+        '''Returns the mean wild-to-domesticated proportion and mean density of the first n patches, like CerealPatches.remaining(), in O(log runs) time'''
+        j = np.searchsorted(self.starts, n, side='left') - 1 # the run that patch n - 1 is in
+        within = n - self.starts[j].astype(np.int64)
+        return (self.cumproportion[j] + within * self.proportion[j].astype(float)) / n, (self.cumdensity[j] + within * self.density[j].astype(float)) / n
+
+    def exploited(self, eatCereal):
+        '''Returns the number of patches (counting from the front) that get the selection and cultivation treatment when eatCereal patches were harvested this year'''
+        return min(max(int(eatCereal) - 1, 0), self.n)
+
+    def split(self, k):
+        '''Make sure that a run starts at patch k, and return the number of runs in front of it'''
+        m = int(np.searchsorted(self.starts, k, side='left'))
+        if k <= 0 or k >= self.n or (m < len(self.starts) and self.starts[m] == k):
+            return m if k < self.n else len(self.starts)
+        self.starts = np.insert(self.starts, m, k)
+        self.density = np.insert(self.density, m, self.density[m - 1])
+        self.proportion = np.insert(self.proportion, m, self.proportion[m - 1])
+        return m
+
+    def merge(self):
+        '''Join neighbouring runs whose values have become the same'''
+        keep = np.ones(len(self.starts), dtype=bool)
+        keep[1:] = (self.density[1:] != self.density[:-1]) | (self.proportion[1:] != self.proportion[:-1])
+        if not keep.all():
+            self.starts, self.density, self.proportion = self.starts[keep], self.density[keep], self.proportion[keep]
+
+    @staticmethod
+    def _apply(values, new, lower, upper):
+        '''Copy new into values, but only where it falls between lower and upper (inclusive)'''
+        np.copyto(values, new, where=(new >= lower) & (new <= upper), casting='same_kind')
+
+    def adjust(self, eatCereal, diffusion, selection, cultivation, mindensity, maxdensity):
+        '''Apply one year of selection/diffusion and cultivation density change, exactly as CerealPatches.adjust() does, to each run at once'''
+        m = self.split(self.exploited(eatCereal))
+        new = self.density.astype(float)
+        new[:m] += cultivation
+        new[m:] -= cultivation
+        self._apply(self.density, new, mindensity + cultivation, maxdensity - cultivation)
+        new = self.proportion.astype(float)
+        new[:m] += diffusion - selection
+        new[m:] += diffusion
+        self._apply(self.proportion, new, 0 + selection, 1 - diffusion)
+        self.merge()
+        self.cumulate()
@@ -0,0 +1,139 @@
+#!usr/bin/python
+
+# Opt-in profiling of AgModel_headless.py runs
+############################
+# With --profile (or profile=True in run_simulation(), or profile = True in parallelizer.py), a run keeps a Profiler, which records:
+#   the wall time spent in each phase of the yearly loop (foraging, demography, patch update, recording, early stopping checks) and in writing the output,
+#   the number of hunting and harvesting bouts in every year,
+#   the number of calls to each method of the random number generator, and the number of random numbers they drew.
+# Without it, the only cost is a check of one attribute per phase per year. The report of each run is written to a JSON file next to its output (PROFILE_FILE), and aggregate() puts the reports of a whole sweep into one CSV table with a row per run (PROFILE_SUMMARY_FILE), alongside the run's Years, number of patches and people, so that slow runs can be connected to population size and patch count. Run this script to aggregate the reports in a directory:
+#     python3 profiling.py [DIR] [--output FILE]
+# The "numba" engine runs the whole simulation as one compiled call, so its runs only report the total time.
+
+import os
+import glob
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+PROFILE_FILE = 'Simulation_profile.%s.json'
+PROFILE_SUMMARY_FILE = 'Simulation_profile_summary.csv'
+PHASES = ('foraging', 'demography', 'patches', 'recording', 'convergence', 'output')
+
+
+class CountingRNG(object):
+    '''Stands in for a numpy RandomState, counting the calls to each of its methods and the random numbers they return'''
+    def __init__(self, rng):
+        self.rng = rng
+        self.calls = {}
+        self.draws = {}
+
+    def __getattr__(self, name):
+        method = getattr(self.rng, name)
+        if not callable(method) or name in ('get_state', 'set_state', 'seed'):
+            return method
+
+        def counted(*args, **kwargs):
+            result = method(*args, **kwargs)
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.draws[name] = self.draws.get(name, 0) + int(np.size(result))
+            return result
+        return counted
+
+
+class Profiler(object):
+    '''Per-phase wall times, per-year foraging bout counts, and random number generator call counts of one run of years years'''
+    def __init__(self, years):
+        self.times = dict((phase, 0.) for phase in PHASES)
+        self.bouts = np.zeros((int(years) + 1, 2), dtype=np.int64) # hunting and harvesting bouts in each year
+        self.year_bouts = [0, 0] # the counts of the current year, which the foraging engines add to
+        self.rng = None
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.total = None
+
+    def count(self, rng):
+        '''Returns a CountingRNG around rng, whose counts go into the report'''
+        self.rng = CountingRNG(rng)
+        return self.rng
+
+    def mark(self):
+        '''Start timing the next phase from now'''
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        '''Add the time since the last mark (or lap) to phase'''
+        now = time.perf_counter()
+        self.times[phase] += now - self._last
+        self._last = now
+
+    def end_year(self, year):
+        '''Keep the bout counts of year'''
+        self.bouts[year] = self.year_bouts
+        self.year_bouts = [0, 0]
+
+    def stop(self):
+        '''Stop the clock of the whole run'''
+        self.total = time.perf_counter() - self.start
+
+    def report(self, p=None, seed=None, years=None):
+        '''Returns the report of the run as a dict of JSON values. p is the full parameter set of the run, seed its seed, and years the number of years simulated'''
+        report = {"total": self.total if self.total is not None else time.perf_counter() - self.start, "phases": dict(self.times)}
+        if years is not None:
+            report["years"] = int(years)
+            report["bouts"] = {"hunting": int(self.bouts[:years + 1, 0].sum()), "harvesting": int(self.bouts[:years + 1, 1].sum())}
+            report["bouts_per_year"] = {"hunting": self.bouts[:years + 1, 0].tolist(), "harvesting": self.bouts[:years + 1, 1].tolist()}
+        if self.rng is not None:
+            report["rng"] = dict((name, {"calls": calls, "draws": self.rng.draws[name]}) for name, calls in sorted(self.rng.calls.items()))
+        if p is not None:
+            report["params"] = dict((name, p[name]) for name in ('Years', 'Cereal', 'People', 'MaximumPeople', 'Prey', 'Engine', 'ForagingEngine', 'EarlyStop', 'Landscape', 'Bands'))
+        if seed is not None:
+            report["seed"] = seed
+        return report
+
+
+def write_report(report, label, path=None):
+    '''Write the profile report of the run called label to its JSON file in path (default is the current working directory)'''
+    path = os.getcwd() if path is None else path
+    with open(os.path.join(path, PROFILE_FILE % label), 'w') as f:
+        json.dump(dict(report, label=label), f, default=lambda x: x.item())
+
+
+def aggregate(filenames, output=None, stats=True):
+    '''Put the profile reports in filenames into one table with a row per run: its label, parameters, total time, time in each phase, bout counts and random number draws, and (if stats is True and its general stats CSV file is next to the report) its mean human population. Writes the table to the CSV file output, if given, and returns it as a pandas DataFrame'''
+    from recorders import GENERAL_STATS_FILE
+    rows = []
+    for filename in filenames:
+        with open(filename) as f:
+            report = json.load(f)
+        row = {"label": report.get("label"), "total": report["total"]}
+        row.update(report.get("params", {}))
+        row.update(("%s time" % phase, seconds) for phase, seconds in report["phases"].items())
+        if "years" in report:
+            row["years simulated"] = report["years"]
+            row.update(("%s bouts" % kind, count) for kind, count in report["bouts"].items())
+        if "rng" in report:
+            row["rng calls"] = sum(counts["calls"] for counts in report["rng"].values())
+            row["rng draws"] = sum(counts["draws"] for counts in report["rng"].values())
+        general = os.path.join(os.path.dirname(filename), GENERAL_STATS_FILE % report.get("label"))
+        if stats and os.path.exists(general):
+            row["mean human population"] = pd.read_csv(general, index_col=0)["Total Human Population"].mean()
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    if output is not None:
+        table.to_csv(output, index=False)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Aggregate the profile reports of the runs of a sweep into one CSV table')
+    parser.add_argument('path', metavar='DIR', nargs='?', default=os.getcwd(), help='Directory of the profile reports (default is the current working directory)')
+    parser.add_argument('--output', metavar='FILE', default=None, help='File name of the table (default is %s in DIR)' % PROFILE_SUMMARY_FILE)
+    args = parser.parse_args()
+    filenames = sorted(glob.glob(os.path.join(args.path, PROFILE_FILE % '*')))
+    table = aggregate(filenames, args.output or os.path.join(args.path, PROFILE_SUMMARY_FILE))
+    print("Aggregated %s profile reports" % len(table))
+    if len(table):
+        print(table[["total"] + ["%s time" % phase for phase in PHASES if "%s time" % phase in table]].describe().to_string())
@@ -0,0 +1,436 @@
+#!usr/bin/python
+
+# Output recorders for AgModel_headless.py
+############################
+# Preallocates typed arrays for everything that the model records each year, and writes them by row index, rather than growing Python lists and object-dtype pandas DataFrames column by column. The CSV writers (and any other exporter) read straight from these buffers.
+
+import os
+import numpy as np
+import pandas as pd
+
+# The general stats that are recorded each year, as (field name, CSV column header) pairs
+GENERAL_STATS = [("yr", "Year"),
+                 ("HumPop", "Total Human Population"),
+                 ("HumanKcalPrey", "Human Kcal Deficit"),
+                 ("PreyPop", "Total Prey Animals Population"),
+                 ("PreyKilled", "Number of Prey Animals Eaten"),
+                 ("CerealPop", "Total Cereal Population (*10^3)"),
+                 ("CerealExploited", "Number of Cereal Patches Exploited"),
+                 ("ProportionDomesticated", "Proportion of Domestic-Type Cereal"),
+                 ("AverageCerealDensity", "Average Cereal Patch Density (*10^3)")]
+GENERAL_STATS_DTYPE = np.dtype([(name, 'f8') for name, header in GENERAL_STATS])
+
+# The stats of each band that are recorded each year in runs of several bands (see bands.py), as (field name, CSV column header) pairs
+BAND_STATS = [("HumPop", "Band Population"),
+              ("PreyKilled", "Number of Prey Animals Eaten"),
+              ("CerealExploited", "Number of Cereal Patches Exploited")]
+BAND_STATS_DTYPE = np.dtype([(name, 'f8') for name, header in BAND_STATS])
+
+# Names of the output files, %s is replaced by the run label
+GENERAL_STATS_FILE = 'Simulation_general_stats.%s.csv'
+PATCH_DENSITY_FILE = 'Simulation_millet_patch_density_stats.%s.csv'
+PATCH_PROPORTION_FILE = 'Simulation_millet_patch_domestic_proportion_stats.%s.csv'
+BAND_STATS_FILE = 'Simulation_band_stats.%s.csv'
+RESOURCE_STATS_FILE = 'Simulation_resource_stats.%s.csv'
+
+# How the patch time series can be written out:
+#   "full" writes every patch in every year (a patch x year table),
+#   "decimate" writes the same table, but only every k-th year (and the last year), and a reader holds each value until the next recorded year,
+#   "changes" writes (Year, Patch, Value) rows for year 0 and then only for the patches whose value changed since the year before,
+#   "delta" writes the change of every patch since the year before, run-length encoded along the patches of each year as (Year, Patch, Patches, Delta) rows (Patches patches in a row, starting at Patch, all changed by Delta). The updates of the model move long runs of neighbouring patches by the same amount, so this is usually the smallest,
+#   "none" doesn't write the patch time series at all.
+# "changes" and "delta" work on the values rounded to the precision of the CSV files (PATCH_PRECISION), so read_patch_stats() rebuilds exactly the values of the "full" files.
+PATCH_POLICIES = ('full', 'decimate', 'changes', 'delta', 'none')
+PATCH_PRECISION = 10**5 # the CSV files are written with five decimals
+# A run on the compact Landscape (CompactRecorder) can only be written out with the policies that don't expand all of its years into full (Years+1) x Cereal arrays, and is written with "decimate" by default
+COMPACT_POLICIES = ('decimate', 'none')
+PATCH_CHUNK = 10**5 # the "decimate" files of a compact run are expanded and written this many patches at a time
+
+# The output buffers of a run that are saved by the result cache and the sweep store (see Recorder.buffers() and from_buffers()). Only stats is always there. A run on the compact Landscape keeps its patch time series as runs of patches (offsets, starts, run_density, run_proportion and patch_count, see CompactRecorder) instead of density and proportion
+BUFFERS = ('stats', 'density', 'proportion', 'bands', 'resources', 'resource_names', 'offsets', 'starts', 'run_density', 'run_proportion', 'patch_count')
+PATCH_BUFFERS = ('density', 'proportion', 'offsets', 'starts', 'run_density', 'run_proportion', 'patch_count') # the ones that hold the patch time series
+
+
+class Recorder(object):
+    '''Preallocated buffers for the yearly general stats (one structured array with a row per year) and the patch density and domestic proportion time series (one (Years+1) x Cereal float array each)'''
+    SAVED = ('stats', 'density', 'proportion', 'bands', 'resources') # the attributes that buffers() saves, if the run has them
+
+    def __init__(self, years, patches):
+        '''years is the number of years to be simulated (year 0 is recorded too), patches is the number of Cereal patches'''
+        self.years = int(years)
+        self.stats = np.zeros(self.years + 1, dtype=GENERAL_STATS_DTYPE)
+        self.density = np.empty((self.years + 1, int(patches)), dtype=float)
+        self.proportion = np.empty((self.years + 1, int(patches)), dtype=float)
+        self.stopped = None # the last simulated year, if the run stopped early
+        self.profile = None # the profile report of the run, if it was profiled (see profiling.py)
+        self.resources = None # the bouts spent on each extra resource in each year, if the run has any (see track_resources())
+
+    @classmethod
+    def from_arrays(cls, stats, density=None, proportion=None):
+        '''Make a Recorder around existing buffers (e.g., views of one replicate of an EnsembleRecorder) without copying them. density and proportion can be None if the patch time series were not recorded'''
+        recorder = cls.__new__(cls)
+        recorder.years = len(stats) - 1
+        recorder.stats = stats
+        recorder.density = density
+        recorder.proportion = proportion
+        recorder.stopped = None
+        recorder.profile = None
+        recorder.resources = None
+        return recorder
+
+    def buffers(self):
+        '''Returns a dict of the output buffers (see BUFFERS) that the run has, for saving'''
+        found = {}
+        for name in self.SAVED:
+            values = getattr(self, name, None)
+            if values is not None:
+                found[name] = values
+        if self.resources is not None:
+            found['resource_names'] = np.array(self.resource_names, dtype=str) # (a plain string array, so it loads without pickling)
+        return found
+
+    def track_resources(self, names):
+        '''Also keep the number of bouts spent each year on each of the extra resources called names (see foraging.Diet)'''
+        self.resource_names = list(names)
+        self.resources = np.zeros((self.years + 1, len(self.resource_names)))
+
+    def record_resources(self, year, eaten):
+        '''Write the bouts spent on each extra resource in year (an array with an entry per resource) into the buffer'''
+        self.resources[year] = eaten
+
+    def record(self, year, People, KcalDeficit, Prey, eatPrey, eatCereal, patches):
+        '''Write the state at the end of year into the buffers. patches is the patches.CerealPatches object'''
+        cell = getattr(patches, 'cell', None)
+        if cell is None:
+            self.density[year] = patches.CerealDensity
+            self.proportion[year] = patches.WildToDomesticatedProportion
+        else: # patches on a grid (landscape.GridPatches) are held nearest to the camp first, so put them back in grid order
+            self.density[year, cell] = patches.CerealDensity
+            self.proportion[year, cell] = patches.WildToDomesticatedProportion
+        self.stats[year] = (year, People, KcalDeficit, Prey, eatPrey, np.sum(patches.CerealDensity)/1000., eatCereal, 1 - np.mean(patches.WildToDomesticatedProportion), np.mean(patches.CerealDensity)/1000.)
+
+    def pad(self, year, idle=False):
+        '''Fill all the years after year with copies of year, for a run that stopped early. With idle=True (the humans have died out), nobody forages in the padded years'''
+        self.stopped = year
+        self.stats[year + 1:] = self.stats[year]
+        self.stats['yr'][year + 1:] = np.arange(year + 1, self.years + 1)
+        if idle:
+            for name in ('HumanKcalPrey', 'PreyKilled', 'CerealExploited'):
+                self.stats[name][year + 1:] = 0
+        if self.resources is not None:
+            self.resources[year + 1:] = 0 if idle else self.resources[year]
+        self.pad_patches(year)
+
+    def pad_patches(self, year):
+        '''Fill all the years of the patch time series after year with copies of year'''
+        if self.density is not None:
+            self.density[year + 1:] = self.density[year]
+            self.proportion[year + 1:] = self.proportion[year]
+
+    def general_stats(self):
+        '''Returns the general stats as a pandas DataFrame with the CSV column headers'''
+        return pd.DataFrame(self.stats).rename(columns=dict(GENERAL_STATS))
+
+    @staticmethod
+    def patch_stats(values):
+        '''Returns one of the patch time series buffers as a pandas DataFrame with a row per patch (counted from 1) and a column per year'''
+        return pd.DataFrame(values.T, index=range(1, values.shape[1] + 1), columns=range(values.shape[0]))
+
+    def resource_stats(self):
+        '''Returns the bouts spent on each extra resource in each year as a pandas DataFrame with a column per resource'''
+        return pd.DataFrame(self.resources, columns=self.resource_names).rename_axis("Year")
+
+    def write_stats(self, label, path):
+        '''Write the general stats CSV file of the run called label into path, and the resource stats file if the run has extra resources'''
+        self.general_stats().to_csv(os.path.join(path, GENERAL_STATS_FILE % label), float_format='%.5f')
+        if self.resources is not None:
+            self.resource_stats().to_csv(os.path.join(path, RESOURCE_STATS_FILE % label))
+
+    def write_csv(self, label, path=None, patches=None, every=1):
+        '''Write the general stats, patch density and patch domestic proportion CSV files for the run called label into path (default is the current working directory), and the resource stats file if the run has extra resources. patches is one of the PATCH_POLICIES for the patch files (default "full"), and every the interval in years for the "decimate" policy'''
+        patches = "full" if patches is None else patches
+        path = os.getcwd() if path is None else path
+        self.write_stats(label, path)
+        if self.density is None or patches == "none":
+            return
+        for filename, values in ((PATCH_DENSITY_FILE, self.density), (PATCH_PROPORTION_FILE, self.proportion)):
+            write_patch_stats(os.path.join(path, patch_file(filename, patches) % label), values, patches, every)
+
+
+class BandRecorder(Recorder):
+    '''Output buffers for a run of several bands sharing one landscape (see bands.py): the general stats (summed over the bands) and patch time series as in Recorder, and the BAND_STATS of every band in every year (a (Years+1) x bands structured array)'''
+    def __init__(self, years, patches, bands):
+        '''years is the number of years to be simulated (year 0 is recorded too), patches is the number of Cereal patches, bands the number of bands'''
+        Recorder.__init__(self, years, patches)
+        self.bands = np.zeros((self.years + 1, int(bands)), dtype=BAND_STATS_DTYPE)
+
+    def record_bands(self, year, People, eatPrey, eatCereal):
+        '''Write the stats of every band at the end of year into the buffers. The arguments are arrays with one value per band'''
+        bands = self.bands[year] # a view, so the buffer is written through it
+        bands['HumPop'] = People
+        bands['PreyKilled'] = eatPrey
+        bands['CerealExploited'] = eatCereal
+
+    def pad(self, year, idle=False):
+        '''Fill all the years after year with copies of year, as Recorder.pad() does, for the band stats too'''
+        Recorder.pad(self, year, idle)
+        self.bands[year + 1:] = self.bands[year]
+        if idle:
+            for name in ('PreyKilled', 'CerealExploited'):
+                self.bands[name][year + 1:] = 0
+
+    def band_stats(self):
+        '''Returns the band stats as a pandas DataFrame with a row per band per year, and the CSV column headers'''
+        years, bands = self.bands.shape
+        table = pd.DataFrame(self.bands.ravel()).rename(columns=dict(BAND_STATS))
+        table.insert(0, "Band", np.tile(np.arange(1, bands + 1), years))
+        table.insert(0, "Year", np.repeat(np.arange(years), bands))
+        return table
+
+    def write_csv(self, label, path=None, patches=None, every=1):
+        '''Write the CSV files of the run, as Recorder.write_csv() does, and the band stats file'''
+        Recorder.write_csv(self, label, path, patches, every)
+        path = os.getcwd() if path is None else path
+        self.band_stats().to_csv(os.path.join(path, BAND_STATS_FILE % label), index=False, float_format='%.5f')
+
+
+def from_buffers(buffers):
+    '''Make a Recorder around saved output buffers (a mapping like the one Recorder.buffers() returns, or an open .npz file), as a BandRecorder if it has band stats, as a CompactRecorder if it has runs of patches, and with the resource stats if it has them'''
+    get = lambda name: buffers[name] if name in buffers else None
+    if 'patch_count' in buffers:
+        recorder = CompactRecorder.from_runs(buffers['stats'], buffers['offsets'], get('starts'), get('run_density'), get('run_proportion'), int(buffers['patch_count'][0]))
+    else:
+        recorder = (BandRecorder if 'bands' in buffers else Recorder).from_arrays(buffers['stats'], get('density'), get('proportion'))
+    if 'bands' in buffers:
+        recorder.bands = buffers['bands']
+    if 'resources' in buffers:
+        recorder.resources = buffers['resources']
+        recorder.resource_names = [str(name) for name in buffers['resource_names']]
+    return recorder
+
+
+class CompactRecorder(Recorder):
+    '''Output buffers for a run on the compact landscape (patches.CompactPatches): the general stats as in Recorder, and the patch time series run-length encoded, as the runs of patches of every year (first patch as uint32, density and proportion as float32), so that they take memory in proportion to the number of runs, not of patches. They are saved (by the result cache and the sweep store) and written out (see COMPACT_POLICIES) without expanding them; only the density and proportion attributes expand them into the full (Years+1) x Cereal float32 arrays, when they are asked for'''
+    SAVED = ('stats', 'offsets', 'resources')
+
+    def __init__(self, years, patches):
+        '''years is the number of years to be simulated (year 0 is recorded too), patches is the number of Cereal patches'''
+        self.years = int(years)
+        self.patches = int(patches)
+        self.stats = np.zeros(self.years + 1, dtype=GENERAL_STATS_DTYPE)
+        self.offsets = np.zeros(self.years + 2, dtype=np.int64) # the runs of year y are entries offsets[y] to offsets[y + 1]
+        self.starts = np.empty(1024, dtype=np.uint32)
+        self.run_density = np.empty(1024, dtype=np.float32)
+        self.run_proportion = np.empty(1024, dtype=np.float32)
+        self.stopped = None
+        self.profile = None
+        self.resources = None
+
+    @classmethod
+    def from_runs(cls, stats, offsets, starts, run_density, run_proportion, patches):
+        '''Make a CompactRecorder around saved runs of patches (see buffers()) without copying them. patches is the number of Cereal patches'''
+        recorder = cls.__new__(cls)
+        recorder.years = len(stats) - 1
+        recorder.patches = int(patches)
+        recorder.stats = stats
+        recorder.offsets = offsets
+        recorder.starts = starts
+        recorder.run_density = run_density
+        recorder.run_proportion = run_proportion
+        recorder.stopped = None
+        recorder.profile = None
+        recorder.resources = None
+        return recorder
+
+    def buffers(self):
+        '''Returns a dict of the output buffers (see BUFFERS) of the run, for saving: the runs of patches of every year, rather than the expanded patch time series'''
+        found = Recorder.buffers(self)
+        last = self.offsets[-1]
+        for name in ('starts', 'run_density', 'run_proportion'):
+            found[name] = getattr(self, name)[:last] # (without the unused end of the grown buffers)
+        found['patch_count'] = np.array([self.patches])
+        return found
+
+    def _append(self, year, starts, density, proportion):
+        '''Write the runs of year after those of the year before, growing the buffers (by doubling) if need be'''
+        first = self.offsets[year]
+        last = first + len(starts)
+        if last > len(self.starts):
+            size = max(2 * len(self.starts), last)
+            for name in ('starts', 'run_density', 'run_proportion'):
+                values = getattr(self, name)
+                grown = np.empty(size, dtype=values.dtype)
+                grown[:first] = values[:first]
+                setattr(self, name, grown)
+        self.starts[first:last] = starts
+        self.run_density[first:last] = density
+        self.run_proportion[first:last] = proportion
+        self.offsets[year + 1] = last
+
+    def record(self, year, People, KcalDeficit, Prey, eatPrey, eatCereal, patches):
+        '''Write the state at the end of year into the buffers. patches is the patches.CompactPatches object'''
+        self._append(year, patches.starts, patches.density, patches.proportion)
+        density, proportion = patches.totals()
+        self.stats[year] = (year, People, KcalDeficit, Prey, eatPrey, density/1000., eatCereal, 1 - proportion / patches.n, density / patches.n / 1000.)
+
+    def pad_patches(self, year):
+        '''Fill all the years of the patch time series after year with copies of year'''
+        first, last = self.offsets[year], self.offsets[year + 1]
+        for y in range(year + 1, self.years + 1):
+            self._append(y, self.starts[first:last], self.run_density[first:last], self.run_proportion[first:last])
+
+    def runs(self, year):
+        '''Returns the runs of patches of year: the first patch of each run, and its density and proportion'''
+        first, last = self.offsets[year], self.offsets[year + 1]
+        return self.starts[first:last], self.run_density[first:last], self.run_proportion[first:last]
+
+    def expand(self, values, years=None, patches=None):
+        '''Returns the values (run_density or run_proportion) of years (default all) of patches (a range of patch indices, default all of them), as a years x patches float32 array'''
+        years = range(self.years + 1) if years is None else years
+        if patches is None:
+            out = np.empty((len(years), self.patches), dtype=np.float32)
+            for row, year in enumerate(years):
+                first, last = self.offsets[year], self.offsets[year + 1]
+                out[row] = np.repeat(values[first:last], np.diff(self.starts[first:last], append=self.patches).astype(np.int64))
+            return out
+        patches = np.asarray(patches)
+        out = np.empty((len(years), len(patches)), dtype=np.float32)
+        for row, year in enumerate(years):
+            first, last = self.offsets[year], self.offsets[year + 1]
+            out[row] = values[first:last][np.searchsorted(self.starts[first:last], patches, side='right') - 1] # (the run that each patch is in)
+        return out
+
+    @property
+    def density(self):
+        return self.expand(self.run_density)
+
+    @property
+    def proportion(self):
+        return self.expand(self.run_proportion)
+
+    def write_csv(self, label, path=None, patches=None, every=1):
+        '''Write the CSV files of the run, as Recorder.write_csv() does, with one of the COMPACT_POLICIES for the patch files (default "decimate"). The "decimate" patch files are expanded and written PATCH_CHUNK patches at a time, so they never need the full patch x year arrays'''
+        patches = "decimate" if patches is None else patches
+        if patches not in COMPACT_POLICIES:
+            raise ValueError('The patch files of a run on the compact Landscape can only be written with the %s policies, not "%s", which would expand its runs of patches into full Years x Cereal arrays' % (' or '.join('"%s"' % policy for policy in COMPACT_POLICIES), patches))
+        path = os.getcwd() if path is None else path
+        self.write_stats(label, path)
+        if patches == "none":
+            return
+        years = np.unique(np.append(np.arange(0, self.years + 1, max(int(every), 1)), self.years))
+        for filename, values in ((PATCH_DENSITY_FILE, self.run_density), (PATCH_PROPORTION_FILE, self.run_proportion)):
+            for first in range(0, max(self.patches, 1), PATCH_CHUNK):
+                chunk = range(first, min(first + PATCH_CHUNK, self.patches))
+                table = pd.DataFrame(self.expand(values, years, chunk).T, index=range(chunk.start + 1, chunk.stop + 1), columns=years)
+                table.to_csv(os.path.join(path, filename % label), mode='w' if first == 0 else 'a', header=first == 0, float_format='%.5f')
+
+
+def read_general_stats(filename):
+    '''Read a general stats CSV file back into a general stats array (with the GENERAL_STATS_DTYPE fields)'''
+    table = pd.read_csv(filename, index_col=0)
+    stats = np.zeros(len(table), dtype=GENERAL_STATS_DTYPE)
+    for name, header in GENERAL_STATS:
+        stats[name] = table[header]
+    return stats
+
+
+def patch_file(filename, policy="full"):
+    '''Returns the name pattern of a patch file (PATCH_DENSITY_FILE or PATCH_PROPORTION_FILE) written with policy. The "changes" and "delta" files have a different layout, so they get their own names'''
+    if policy in ("changes", "delta"):
+        return filename.replace('_stats.', '_%s.' % policy)
+    return filename
+
+
+def _quantize(values):
+    '''Returns the values rounded to PATCH_PRECISION, as integers'''
+    return np.round(np.asarray(values, dtype=float) * PATCH_PRECISION).astype(np.int64) # (in float64, as float32 values of a compact run would lose their decimals)
+
+
+def patch_table(values, policy="full", every=1):
+    '''Returns a (Years+1) x patches time series as a pandas DataFrame laid out for policy (see PATCH_POLICIES)'''
+    if policy == "full":
+        return Recorder.patch_stats(values)
+    if policy == "decimate":
+        years = np.unique(np.append(np.arange(0, len(values), max(int(every), 1)), len(values) - 1)) # every k-th year, and always the last one
+        table = Recorder.patch_stats(values[years])
+        table.columns = years
+        return table
+    q = _quantize(values)
+    if policy == "changes":
+        changed = np.ones(q.shape, dtype=bool)
+        changed[1:] = q[1:] != q[:-1]
+        changed[-1, 0] = True # always list the last year, so that the reader knows how many years there were
+        year, patch = np.nonzero(changed)
+        return pd.DataFrame({"Year": year, "Patch": patch + 1, "Value": q[year, patch] / PATCH_PRECISION})
+    if policy == "delta":
+        delta = np.diff(q, axis=0, prepend=0) # (year 0 is the change from 0)
+        start = np.ones(delta.shape, dtype=bool) # where a run of equal changes starts. Every year starts a new run
+        start[:, 1:] = delta[:, 1:] != delta[:, :-1]
+        year, patch = np.nonzero(start)
+        starts = year * q.shape[1] + patch
+        return pd.DataFrame({"Year": year, "Patch": patch + 1, "Patches": np.diff(np.append(starts, q.size)), "Delta": delta[year, patch] / PATCH_PRECISION})
+    raise ValueError("Unknown patch recording policy: %s" % policy)
+
+
+def write_patch_stats(filename, values, policy="full", every=1):
+    '''Write a (Years+1) x patches time series to the CSV file filename, laid out for policy (see PATCH_POLICIES)'''
+    patch_table(values, policy, every).to_csv(filename, float_format='%.5f', index=policy in ("full", "decimate"))
+
+
+def read_patch_stats(filename):
+    '''Read a patch CSV file written with any of the PATCH_POLICIES, and rebuild the full (Years+1) x patches time series from it. Years that a "decimate" file leaves out hold the value of the last recorded year'''
+    table = pd.read_csv(filename)
+    if list(table.columns) == ["Year", "Patch", "Value"]:
+        years, patches = table["Year"].max() + 1, table["Patch"].max()
+        q = np.zeros((years, patches), dtype=np.int64)
+        known = np.zeros((years, patches), dtype=bool)
+        q[table["Year"], table["Patch"] - 1] = _quantize(table["Value"])
+        known[table["Year"], table["Patch"] - 1] = True
+    elif list(table.columns) == ["Year", "Patch", "Patches", "Delta"]:
+        years = table["Year"].max() + 1
+        delta = np.repeat(_quantize(table["Delta"]), table["Patches"])
+        return np.cumsum(delta.reshape(years, -1), axis=0) / PATCH_PRECISION
+    else: # a patch x year table, with all of the years or only some of them
+        recorded = np.array([int(year) for year in table.columns[1:]])
+        q = np.zeros((recorded[-1] + 1, len(table)), dtype=np.int64)
+        known = np.zeros(q.shape, dtype=bool)
+        q[recorded] = _quantize(table.iloc[:, 1:].to_numpy(dtype=float).T)
+        known[recorded] = True
+    last = np.maximum.accumulate(np.where(known, np.arange(len(q))[:, None], 0), axis=0) # the last recorded year of every patch, in every year
+    return np.take_along_axis(q, last, axis=0) / PATCH_PRECISION
+
+
+class EnsembleRecorder(object):
+    '''Preallocated buffers for an ensemble of replicate runs that are simulated in lockstep. Same layout as Recorder, with a leading replicate axis'''
+    def __init__(self, replicates, years, patches, record_patches=True):
+        '''replicates is the number of replicate runs, years the number of years to be simulated, patches the number of Cereal patches. The patch time series take replicates x (years+1) x patches values each, so they can be left out with record_patches=False'''
+        self.replicates = int(replicates)
+        self.years = int(years)
+        self.stats = np.zeros((self.replicates, self.years + 1), dtype=GENERAL_STATS_DTYPE)
+        if record_patches:
+            self.density = np.empty((self.replicates, self.years + 1, int(patches)), dtype=float)
+            self.proportion = np.empty((self.replicates, self.years + 1, int(patches)), dtype=float)
+        else:
+            self.density = self.proportion = None
+
+    def record(self, year, People, KcalDeficit, Prey, eatPrey, eatCereal, density, proportion):
+        '''Write the state of all replicates at the end of year into the buffers. The arguments are arrays with one value per replicate, except density and proportion, which are replicates x patches arrays'''
+        if self.density is not None:
+            self.density[:, year] = density
+            self.proportion[:, year] = proportion
+        stats = self.stats[:, year] # a view, so the buffer is written through it
+        stats['yr'] = year
+        stats['HumPop'] = People
+        stats['HumanKcalPrey'] = KcalDeficit
+        stats['PreyPop'] = Prey
+        stats['PreyKilled'] = eatPrey
+        stats['CerealPop'] = np.sum(density, axis=1)/1000.
+        stats['CerealExploited'] = eatCereal
+        stats['ProportionDomesticated'] = 1 - np.mean(proportion, axis=1)
+        stats['AverageCerealDensity'] = np.mean(density, axis=1)/1000.
+
+    def replicate(self, r):
+        '''Returns a Recorder for replicate r that shares this recorder's buffers'''
+        if self.density is None:
+            return Recorder.from_arrays(self.stats[r])
+        return Recorder.from_arrays(self.stats[r], self.density[r], self.proportion[r])
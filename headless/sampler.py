@@ -0,0 +1,136 @@
+#!usr/bin/python
+
+# Sweep planner for parallelizer.py
+############################
+# Picks the parameter values of the experiments of a sweep over any number of the model's parameters. A full Cartesian grid needs (values per parameter)^(number of parameters) experiments, which is out of reach for more than three or four parameters, so the space-filling designs here spread a fixed number of experiments evenly over the whole space instead:
+#   "lhs" is a Latin hypercube: the range of every parameter is cut into as many equal slices as there are experiments, and each slice gets exactly one experiment.
+#   "sobol" is a Sobol low-discrepancy sequence (with a random digital shift): every extra point goes where the earlier ones are thinnest, so it covers the space more evenly than random or Latin hypercube samples. Best with a power of two samples. Up to 21 parameters.
+# refine() then adds experiments where an output of the model (one of the METRICS, e.g. the time to domestication) changes most sharply between neighbouring experiments, so that later rounds of a sweep concentrate on the boundaries between regimes instead of the flat regions between them.
+
+import numpy as np
+from AgModel_headless import DEFAULTS
+
+DESIGNS = ('grid', 'lhs', 'sobol')
+
+# Primitive polynomials (degree s, coefficients a) and initial direction numbers m of the Sobol sequence for dimensions 2 to 21, from Joe & Kuo (2008), new-joe-kuo-6.21201. Dimension 1 is the van der Corput sequence
+SOBOL_DIRECTIONS = [(1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)), (3, 2, (1, 1, 1)), (4, 1, (1, 1, 3, 3)), (4, 4, (1, 3, 5, 13)), (5, 2, (1, 1, 5, 5, 17)), (5, 4, (1, 1, 5, 5, 5)), (5, 7, (1, 1, 7, 11, 19)), (5, 11, (1, 1, 5, 1, 1)),
+                    (5, 13, (1, 1, 1, 3, 11)), (5, 14, (1, 3, 5, 5, 31)), (6, 1, (1, 3, 3, 9, 7, 49)), (6, 13, (1, 1, 1, 15, 21, 21)), (6, 16, (1, 3, 1, 13, 27, 49)), (6, 19, (1, 1, 1, 15, 7, 5)), (6, 22, (1, 3, 1, 15, 13, 25)), (6, 25, (1, 1, 5, 5, 19, 61)),
+                    (7, 1, (1, 3, 7, 11, 23, 15, 103)), (7, 4, (1, 3, 7, 13, 13, 15, 69))]
+SOBOL_BITS = 32
+
+DOMESTICATED = 0.5 # The ProportionDomesticated at which the Cereal counts as domesticated, for the "domestication" metric
+
+
+def time_to_domestication(stats):
+    '''The first year in which ProportionDomesticated reaches DOMESTICATED (Years+1 if it never does)'''
+    reached = np.flatnonzero(stats['ProportionDomesticated'] >= DOMESTICATED)
+    return float(reached[0]) if len(reached) else float(len(stats))
+
+
+def final_population(stats):
+    '''The mean human population over the last tenth of the years'''
+    return float(stats['HumPop'][-max(len(stats) // 10, 1):].mean())
+
+
+def final_domestication(stats):
+    '''The ProportionDomesticated in the last year'''
+    return float(stats['ProportionDomesticated'][-1])
+
+
+# The outputs that refine() can follow, as functions of a run's general stats array (see recorders.GENERAL_STATS)
+METRICS = {"domestication": time_to_domestication, "population": final_population, "domestic": final_domestication}
+
+
+def latin_hypercube(n, d, rng):
+    '''Returns an n x d Latin hypercube sample of the unit cube'''
+    slices = np.argsort(rng.random_sample((d, n)), axis=1).T # a random permutation of the slices for each dimension
+    return (slices + rng.random_sample((n, d))) / n
+
+
+def _sobol_directions(d):
+    '''Returns the d x SOBOL_BITS direction numbers of the Sobol sequence'''
+    if d > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError("The Sobol design handles up to %s parameters" % (len(SOBOL_DIRECTIONS) + 1))
+    V = np.zeros((d, SOBOL_BITS), dtype=np.uint64)
+    V[0] = [1 << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]
+    for j in range(1, d):
+        s, a, m = SOBOL_DIRECTIONS[j - 1]
+        v = [m[k] << (SOBOL_BITS - 1 - k) for k in range(s)]
+        for k in range(s, SOBOL_BITS):
+            x = v[k - s] ^ (v[k - s] >> s)
+            for l in range(1, s):
+                if (a >> (s - 1 - l)) & 1:
+                    x ^= v[k - l]
+            v.append(x)
+        V[j] = v
+    return V
+
+
+def sobol(n, d, rng=None, skip=0):
+    '''Returns n x d points of the Sobol sequence (starting at point skip), with a random digital shift drawn from rng (or unshifted if rng is None)'''
+    V = _sobol_directions(d)
+    x = np.zeros(d, dtype=np.uint64)
+    points = np.empty((n, d), dtype=np.uint64)
+    for i in range(skip + n):
+        if i >= skip:
+            points[i - skip] = x
+        c = 0 # the lowest zero bit of i (Gray code order)
+        while (i >> c) & 1:
+            c += 1
+        x = x ^ V[:, c]
+    if rng is not None:
+        points ^= rng.randint(0, 2**SOBOL_BITS, size=d, dtype=np.uint64)
+    return points.astype(float) / 2.**SOBOL_BITS
+
+
+def design(kind, n, d, seed=None):
+    '''Returns n points of the design kind ("lhs" or "sobol") in the d dimensional unit cube'''
+    rng = np.random.RandomState(seed)
+    if kind == "lhs":
+        return latin_hypercube(n, d, rng)
+    if kind == "sobol":
+        return sobol(n, d, rng)
+    raise ValueError("Unknown sweep design: %s" % kind)
+
+
+def scale(unit, space, logscale=()):
+    '''Map points of the unit cube onto the parameter space, a mapping of parameter names to (low, high) ranges (in order). Parameters in logscale are spread evenly on a log scale, and parameters whose defaults are integers are rounded. Returns a list of dicts of parameter values'''
+    points = []
+    for u in unit:
+        point = {}
+        for x, (name, (low, high)) in zip(u, space.items()):
+            if name in logscale:
+                value = float(np.exp(np.log(low) + x * (np.log(high) - np.log(low))))
+            else:
+                value = float(low + x * (high - low))
+            point[name] = int(round(value)) if isinstance(DEFAULTS[name], int) else value
+        points.append(point)
+    return points
+
+
+def refine(unit, values, n, seed=None, neighbours=None):
+    '''Returns n new points of the unit cube, placed where the output changes most sharply between neighbouring points. unit is the m x d array of the points so far, and values the output at each of them (NaN where unknown). Every point is paired with its nearest neighbours (d+1 of them by default), the pairs are ranked by how much the output differs across them, and a new point is put near the middle of each of the n top ranked pairs (with a random offset, so that repeated refinement of the same pair doesn't pile up points)'''
+    rng = np.random.RandomState(seed)
+    unit = np.asarray(unit, dtype=float)
+    values = np.asarray(values, dtype=float)
+    m, d = unit.shape
+    k = min(neighbours or d + 1, m - 1)
+    known = np.isfinite(values)
+    spread = np.ptp(values[known]) if known.any() else 0.
+    if k < 1 or spread == 0:
+        return latin_hypercube(n, d, rng) # nothing to follow yet, so just fill the space
+    distance = np.sqrt(((unit[:, None, :] - unit[None, :, :])**2).sum(axis=2))
+    np.fill_diagonal(distance, np.inf)
+    nearest = np.argsort(distance, axis=1)[:, :k]
+    i = np.repeat(np.arange(m), k)
+    j = nearest.ravel()
+    pairs = np.unique(np.sort(np.column_stack((i, j)), axis=1), axis=0)
+    i, j = pairs[:, 0], pairs[:, 1]
+    score = np.abs(values[i] - values[j]) / spread
+    score[~(known[i] & known[j])] = 0.
+    order = np.argsort(-score, kind='stable')[:n]
+    order = order[score[order] > 0]
+    new = (unit[i[order]] + unit[j[order]]) / 2 + (rng.random_sample((len(order), d)) - 0.5) * np.abs(unit[i[order]] - unit[j[order]]) / 2
+    if len(new) < n: # not enough sharp pairs, so fill the space with the rest
+        new = np.vstack((new, latin_hypercube(n - len(new), d, rng)))
+    return np.clip(new, 0., 1.)
@@ -0,0 +1,148 @@
+#!usr/bin/python
+
+# Sweep scheduler for parallelizer.py
+############################
+# Runs the repetitions of a sweep (as python3 subprocesses, or on a pool of worker processes) so that the cores stay busy to the end:
+#   Runs are started longest first, by a predicted cost (Years times the initial number of people and patches to forage), so that the long runs don't end up starting last and leaving the other cores idle at the tail of the sweep.
+#   The scheduler blocks until a run finishes, instead of polling, and starts the next one straight away.
+#   A run that fails is retried (up to "retries" times), and then quarantined: it is left out and reported at the end, and the rest of the sweep carries on.
+#   The number of runs at once is capped by memory as well as by the number of CPUs, using a predicted memory use of each run and the free physical memory (or a given budget).
+#   Progress reports the throughput of the sweep (runs per minute) and the time left, as it goes.
+
+import os
+import time
+import threading
+from bisect import insort
+from queue import Queue
+from subprocess import Popen, list2cmdline
+from concurrent.futures import FIRST_COMPLETED, wait
+from AgModel_headless import model_parameters
+
+PROCESS_MEMORY = 100 * 1024**2 # Rough memory use of a python3 process that has imported the model, in bytes
+REPORT_INTERVAL = 10. # Shortest time between progress reports, in seconds
+
+
+def predicted_cost(params):
+    '''Returns the predicted relative cost of a run with the parameter overrides params. The run time of the model grows with the number of years, and each year with the number of people and patches to forage and update'''
+    p = model_parameters(params)
+    return float(p['Years']) * (p['People'] * p['Bands'] + p['Cereal'])
+
+
+def predicted_memory(params):
+    '''Returns the predicted peak memory use of a run with the parameter overrides params, in bytes: a python3 process, and the patch time series (two float arrays of Years x Cereal, and about as much again to write them out, or on the compact Landscape, the runs of patches of every year, of which there are at most one more each year, plus the patch ranking of every band in runs of several bands)'''
+    p = model_parameters(params)
+    if p['Landscape'] == "compact":
+        return PROCESS_MEMORY + 3 * 4 * (int(p['Years']) + 1) * min(int(p['Cereal']), int(p['Years']) + 1)
+    return PROCESS_MEMORY + 4 * 8 * (int(p['Years']) + 1) * int(p['Cereal']) + (4 * int(p['Bands']) * int(p['Cereal']) if p['Bands'] > 1 else 0)
+
+
+def available_memory():
+    '''Returns the free physical memory of the system in bytes, or None if it can't be found'''
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError): # not on this platform
+        return None
+
+
+class Progress(object):
+    '''Counts the finished and failed items of a sweep of total items (runs, or whole experiments or batches of runs, as named by unit), and reports the throughput and the time left'''
+    def __init__(self, total, unit="run", units=None):
+        self.total = total
+        self.unit = unit
+        self.units = unit + "s" if units is None else units
+        self.done = 0
+        self.failed = [] # (label, reason) of the items that were quarantined
+        self.start = time.time()
+        self.reported = self.start
+
+    def finish(self, label):
+        '''Count one finished item'''
+        self.done += 1
+        print("Finished %s %s" % (self.unit, label))
+        now = time.time()
+        if now - self.reported >= REPORT_INTERVAL or self.done + len(self.failed) == self.total:
+            self.reported = now
+            self.report()
+
+    def fail(self, label, reason):
+        '''Count one item that failed for good'''
+        self.failed.append((label, reason))
+        print("%s %s failed (%s), leaving it out" % (self.unit.capitalize(), label, reason))
+
+    def report(self):
+        '''Print the throughput so far and the time left'''
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.
+        left = self.total - self.done - len(self.failed)
+        print("%s of %s %s finished in %.0f s (%.1f per minute%s)" % (self.done, self.total, self.units, elapsed, 60 * rate, ", about %.0f s left" % (left / rate) if rate > 0 and left else ""))
+
+
+def run_commands(commands, labels, costs, memories, processes, budget=None, retries=1, progress=None):
+    '''Run commands (lists of command line arguments) as subprocesses, up to processes at once and with their predicted memories adding up to no more than budget bytes (no cap if None), longest predicted cost first. A failed command is retried up to retries times and then quarantined. labels name the runs in the progress reports. Returns the Progress'''
+    progress = Progress(len(commands)) if progress is None else progress
+    pending = sorted((costs[n], -n) for n in range(len(commands))) # longest last (and in their original order among equals), so they are popped first
+    attempts = [0] * len(commands)
+    finished = Queue()
+    running = {}
+    used = 0
+
+    def watch(p, n):
+        p.wait()
+        finished.put(n)
+
+    while pending or running:
+        while pending and len(running) < processes:
+            # the longest pending command that fits in the memory that is left (the longest one if nothing else is running)
+            fits = [k for k in range(len(pending) - 1, -1, -1) if budget is None or used + memories[-pending[k][1]] <= budget]
+            if not fits and running:
+                break
+            n = -pending.pop(fits[0] if fits else len(pending) - 1)[1]
+            print(list2cmdline(commands[n]))
+            try:
+                p = Popen(commands[n])
+            except OSError as error:
+                progress.fail(labels[n], error)
+                continue
+            running[n] = p
+            used += memories[n]
+            threading.Thread(target=watch, args=(p, n), daemon=True).start()
+        if not running:
+            continue
+        n = finished.get() # wait for a run to finish
+        p = running.pop(n)
+        used -= memories[n]
+        if p.returncode == 0:
+            progress.finish(labels[n])
+        elif attempts[n] < retries:
+            attempts[n] += 1
+            print("%s %s failed (exit code %s), retrying it" % (progress.unit.capitalize(), labels[n], p.returncode))
+            insort(pending, (costs[n], -n))
+        else:
+            progress.fail(labels[n], "exit code %s" % p.returncode)
+    return progress
+
+
+def run_tasks(pool, function, items, labels, costs, retries=1, progress=None):
+    '''Run function(item) for each of items on the concurrent.futures pool, longest predicted cost first, and yield each item and its result as it finishes. A call that raises an exception is retried up to retries times and then quarantined (counted as failed in progress, and left out). labels name the items in the progress reports'''
+    order = sorted(range(len(items)), key=lambda n: -costs[n])
+    futures = dict((pool.submit(function, items[n]), n) for n in order)
+    attempts = [0] * len(items)
+    while futures:
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            n = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as error:
+                if attempts[n] < retries:
+                    attempts[n] += 1
+                    print("%s %s failed (%r), retrying it" % ("Run" if progress is None else progress.unit.capitalize(), labels[n], error))
+                    try:
+                        futures[pool.submit(function, items[n])] = n
+                        continue
+                    except RuntimeError as broken: # the pool itself is broken (a worker died), so it can't take any more
+                        error = broken
+                if progress is not None:
+                    progress.fail(labels[n], repr(error))
+                continue
+            yield items[n], result
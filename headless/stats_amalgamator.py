@@ -1,9 +1,12 @@
 #!usr/bin/python
 import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
 from itertools import product
-import seaborn as sns
+from multiprocessing import Pool
+from recorders import GENERAL_STATS, GENERAL_STATS_FILE
+from summaries import RunningStats
 ##############################
 ## EDIT THESE VALUES -- They are the parameters to sweep through
 # of these length should be the number of variable values used in parallelizer.pu)
@@ -12,21 +15,73 @@ v2len = range(1)
 v3len = range(1)
 repeats = 10
 basepath = os.getcwd()
-skipheader = 1
-# this is the column to amalgamate
+store = None # File name of the sweep store that parallelizer.py wrote the runs to (see store.py), or None to read the CSV files in basepath
+quantiles = [0.05, 0.5, 0.95] # Quantiles to estimate for every general stat in every year, across the repetitions of each experiment
+processes = None # Number of processes that read the runs in parallel (None for one per CPU)
+# this is the column to also amalgamate as a raw matrix, with a column per repetition (set header to None to skip this, the raw matrix is the only output that grows with the number of repetitions)
 header = "human_pop"
 label = 'Total Human Population'
-col = 3
 ## DON'T EDIT BELOW THIS LINE
 ##############################
-varlist = list(product(v1len,v2len,v3len))
-for i in range(len(varlist)):
-    print("Processing stats file %s of %s" % (i+1, len(varlist)))
-    sfs = ['%s%sSimulation_general_stats.%s.%s.csv' % (basepath, os.sep, i + 1, str(x).zfill(len(str(repeats)))) for x in range(repeats)]
-    all_data = np.genfromtxt(sfs.pop(0), dtype=float, delimiter=',', skip_header=skipheader, usecols=(col-1))
-    for match in sfs:
-        data = np.genfromtxt(match, dtype=float, delimiter=',', skip_header=skipheader, usecols=(col-1))
-        all_data = np.vstack((all_data, data))
-    np.savetxt("%s%s%s" % (basepath, os.sep, "Experiment%s_%s_all.csv" % (i + 1, header)), all_data.T, delimiter=",")
 
 
+def _open_store(path, storefile):
+    '''Open the sweep store once in each reader process'''
+    global reader, basepath
+    basepath = path
+    reader = None
+    if storefile is not None:
+        from store import SweepStore
+        reader = SweepStore(storefile)
+
+
+def read_run(run):
+    '''Read the general stats of one run (an (experiment, repetition, label) tuple) as a years x stats float array (without the Year column). Returns the run and the array, or None if the run is missing'''
+    try:
+        if reader is not None:
+            stats = reader.get(run[2], patches=False).stats
+            values = stats.view(np.float64).reshape(len(stats), -1)
+        else:
+            values = pd.read_csv('%s%s%s' % (basepath, os.sep, GENERAL_STATS_FILE % run[2]), index_col=0).to_numpy(dtype=float)
+    except (IOError, OSError, KeyError):
+        return run, None
+    return run, values[:, 1:]
+
+
+def amalgamate(experiments, repeats, path, storefile=None, processes=None):
+    '''Amalgamate the repetitions of experiments experiments (numbered from 1), of repeats repetitions each, from the CSV files in path (or the sweep store storefile), and write the summary files of each experiment to path'''
+    names = [name for name, title in GENERAL_STATS[1:]]
+    col = [title for name, title in GENERAL_STATS[1:]].index(label) if header is not None else None
+    runs = [(i + 1, x, '%s.%s' % (i + 1, str(x).zfill(len(str(repeats))))) for i in range(experiments) for x in range(repeats)]
+    accumulators = {}
+    raws = {}
+    with Pool(processes, initializer=_open_store, initargs=(path, storefile)) as pool:
+        for run, values in pool.imap_unordered(read_run, runs, chunksize=max(1, len(runs) // (8 * (processes or os.cpu_count() or 1)))):
+            experiment, repetition = run[0], run[1]
+            if values is None:
+                print("Run %s is missing, leaving it out" % run[2])
+                continue
+            if experiment not in accumulators:
+                accumulators[experiment] = RunningStats(values.shape, quantiles)
+                if col is not None:
+                    raws[experiment] = np.full((len(values), repeats), np.nan)
+            accumulators[experiment].add(values)
+            if col is not None:
+                raws[experiment][:, repetition] = values[:, col]
+            if accumulators[experiment].count == repeats:
+                # all the repetitions of this experiment are in, so write it out and let go of its accumulators
+                print("Processing stats of experiment %s of %s" % (experiment, experiments))
+                accumulators.pop(experiment).summary(names).to_csv("%s%s%s" % (path, os.sep, "Experiment%s_summary.csv" % experiment), index_label="Year", float_format='%.5f')
+                if col is not None:
+                    np.savetxt("%s%s%s" % (path, os.sep, "Experiment%s_%s_all.csv" % (experiment, header)), raws.pop(experiment), delimiter=",")
+    for experiment, stats in sorted(accumulators.items()): # experiments with missing runs
+        print("Processing stats of experiment %s of %s (%s of %s repetitions)" % (experiment, experiments, stats.count, repeats))
+        stats.summary(names).to_csv("%s%s%s" % (path, os.sep, "Experiment%s_summary.csv" % experiment), index_label="Year", float_format='%.5f')
+        if col is not None:
+            np.savetxt("%s%s%s" % (path, os.sep, "Experiment%s_%s_all.csv" % (experiment, header)), raws[experiment], delimiter=",")
+
+
+if __name__ == "__main__":
+    varlist = list(product(v1len,v2len,v3len))
+    amalgamate(len(varlist), repeats, basepath, store, processes)
+    sys.exit(0)
@@ -0,0 +1,157 @@
+#!usr/bin/python
+
+# Binary sweep store for AgModel_headless.py runs
+############################
+# Keeps the output of every run of a sweep in one append-only file, instead of three CSV files per run. The store is a zip file with one compressed .npy array per output buffer of each run (named "<label>/stats.npy", "<label>/density.npy" and "<label>/proportion.npy", "<label>/bands.npy" for a run of several bands, "<label>/resources.npy" and "<label>/resource_names.npy" for a run with extra resources, and the runs of patches instead of the density and proportion for a run on the compact Landscape (see BUFFERS in recorders.py), where label is the usual "experiment.repetition" run label), so it can also be opened with any zip tool, or with np.load() on the extracted members. The zip central directory is the index: runs are looked up by experiment and repetition number without reading any of the others.
+# The index is only written when the store is closed (or flushed), so a writer that stays open for a long time (e.g., the pool modes of parallelizer.py) rewrites it every flush seconds, and a crash loses at most the runs since the last flush.
+# Writers take an exclusive lock on "<store>.lock" while the store is open, so several AgModel_headless.py processes (e.g., the "subprocess" mode of parallelizer.py) can append to the same store safely. Run this script to export runs back to the usual CSV files:
+#     python3 store.py sweep.zip --csv [--runs 1.00 1.01 ...]
+
+import sys
+import time
+import argparse
+import warnings
+import zipfile
+import numpy as np
+from recorders import BUFFERS, PATCH_BUFFERS, from_buffers
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+
+def lock(path):
+    '''Take an exclusive lock on "<path>.lock" (waiting for it if another process holds it), and return the handle to pass to unlock()'''
+    handle = open(path + '.lock', 'a+b')
+    if sys.platform == 'win32':
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+    return handle
+
+
+def unlock(handle):
+    '''Release a lock taken with lock()'''
+    if sys.platform == 'win32':
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    handle.close() # closing the file releases the flock
+
+
+def parse_label(label):
+    '''Returns the (experiment, repetition) numbers of a run label like "1.01"'''
+    experiment, repetition = str(label).split('.')
+    return int(experiment), int(repetition)
+
+
+class SweepStore(object):
+    '''One sweep store file. Open it with mode 'r' to read, or 'a' to append runs (creating the file if needed). Use it as a context manager, or call close() when done'''
+    def __init__(self, path, mode='r', flush=30.):
+        '''flush is the longest time (in seconds) that appended runs can go without the index being written'''
+        self.path = path
+        self.mode = mode
+        self.flushtime = flush
+        self._lock = None
+        if mode == 'a':
+            self._lock = lock(path)
+        try:
+            self.zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        except Exception:
+            self._unlock()
+            raise
+        self._flushed = time.time()
+        self._index()
+
+    def _index(self):
+        '''Map each run label in the store to its (experiment, repetition) numbers'''
+        self.labels = {}
+        for name in self.zip.namelist():
+            label, buffer = name.rsplit('/', 1)
+            if buffer == 'stats.npy':
+                self.labels[label] = parse_label(label)
+
+    def _unlock(self):
+        if self._lock is not None:
+            unlock(self._lock)
+            self._lock = None
+
+    def flush(self):
+        '''Write the index, so that everything appended so far can be read even if this process dies'''
+        self.zip.close()
+        self.zip = zipfile.ZipFile(self.path, self.mode, compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._flushed = time.time()
+
+    def close(self):
+        '''Write the index and release the lock'''
+        self.zip.close()
+        self._unlock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, label):
+        return label in self.labels
+
+    def runs(self):
+        '''Returns the labels of all the runs in the store, sorted by experiment and repetition'''
+        return sorted(self.labels, key=self.labels.get)
+
+    def label(self, experiment, repetition):
+        '''Returns the label of the run with the given experiment and repetition numbers, or None if it isn't in the store'''
+        for label, numbers in self.labels.items():
+            if numbers == (experiment, repetition):
+                return label
+        return None
+
+    def put(self, label, recorder):
+        '''Append the output buffers of the run called label (a recorders.Recorder). Storing a run that is already in the store shadows the old copy (it is still in the file, but can't be read)'''
+        parse_label(label) # check that the label can be indexed
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning) # zipfile warns about duplicate member names
+            for buffer, values in recorder.buffers().items():
+                with self.zip.open('%s/%s.npy' % (label, buffer), 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.ascontiguousarray(values), allow_pickle=False)
+        self.labels[label] = parse_label(label)
+        if time.time() - self._flushed > self.flushtime:
+            self.flush()
+
+    def _read(self, name):
+        with self.zip.open(name) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def get(self, label, patches=True):
+        '''Returns a recorders.Recorder (a BandRecorder for a run of several bands) with the output buffers of the run called label. With patches=False, the patch time series are not read'''
+        buffers = {}
+        for buffer in BUFFERS:
+            name = '%s/%s.npy' % (label, buffer)
+            if name in self.zip.NameToInfo and (patches or buffer not in PATCH_BUFFERS):
+                buffers[buffer] = self._read(name)
+        return from_buffers(buffers)
+
+    def export_csv(self, labels=None, path=None, patches=None, every=1):
+        '''Write the usual CSV files of the runs called labels (default is all of them) into path (default is the current working directory), with the patch files laid out for patches (one of recorders.PATCH_POLICIES, default "full", or "decimate" for runs on the compact Landscape)'''
+        for label in self.runs() if labels is None else labels:
+            self.get(label, patches != "none").write_csv(label, path, patches, every)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='List the runs in a sweep store, or export them to the usual CSV files.')
+    parser.add_argument('store', help='The sweep store file')
+    parser.add_argument('--csv', action='store_true', help='Write the general stats, patch density and patch domestic proportion CSV files of the runs')
+    parser.add_argument('--runs', metavar='Z.ZZ', nargs='+', default=None, help='Labels of the runs to export (default is all of them)')
+    parser.add_argument('--path', metavar='DIR', default=None, help='Directory to write the CSV files to (default is the current working directory)')
+    parser.add_argument('--patches', metavar='full', choices=['full', 'decimate', 'changes', 'delta', 'none'], default=None, help='How to write the patch files (see PATCH_POLICIES in recorders.py). The default is "full", or "decimate" for runs on the compact Landscape')
+    parser.add_argument('--every', metavar='10', type=int, default=10, help='Interval in years between the recorded years of "decimate" patch files')
+    args = parser.parse_args()
+    with SweepStore(args.store) as store:
+        if args.csv:
+            store.export_csv(args.runs, args.path, args.patches, args.every)
+        else:
+            for label in store.runs():
+                print(label)
+    sys.exit(0)
@@ -0,0 +1,250 @@
+#!usr/bin/python
+
+# Online summary statistics of model runs
+############################
+# Accumulators that fold runs of the model into per-experiment summary statistics one at a time, in constant memory (however many repetitions there are), and that can be merged, so that several processes can each reduce some of the repetitions of an experiment and combine their accumulators at the end.
+# RunningStats keeps the count, mean, variance (Welford's algorithm, merged with Chan's formula), minimum, maximum and a quantile sketch of every cell of a stream of equally shaped arrays. QuantileSketch is a stack of compactors, as in the KLL sketch (Karnin, Lang & Liberty, 2016), run in lockstep for every cell: it is exact until sketchsize arrays have been added, and after that its rank error is of the order of 1/sketchsize.
+# ExperimentSummary holds the RunningStats of the general stats and of the patch density and domestic proportion time series of one experiment (except on the compact Landscape, see summary_patches()), and writes them out as CSV files. It also keeps the labels of the runs folded into its file with fold(), so that a run that is folded in again (e.g. by a task queue worker that took over a run whose first worker died after folding it) is only counted once.
+
+import os
+import numpy as np
+import pandas as pd
+from recorders import Recorder, GENERAL_STATS
+
+QUANTILES = (0.05, 0.5, 0.95) # Default quantiles of the general stats to report
+SKETCHSIZE = 64 # Default size of the quantile sketches (the number of values kept per cell is about three times this)
+
+
+class QuantileSketch(object):
+    '''Mergeable streaming quantile sketch of every cell of a stream of equally shaped arrays'''
+    def __init__(self, shape, k=SKETCHSIZE):
+        self.shape = tuple(shape)
+        self.k = int(k)
+        self.levels = [np.empty((0,) + self.shape)] # the values kept at each level. A value at level j stands for 2**j of the values added
+        self._offsets = [0]
+
+    def _capacity(self, j):
+        '''Returns the number of values that level j can hold before it is compacted. The top level holds k, and lower levels hold geometrically fewer'''
+        return max(2, int(np.ceil(self.k * (2. / 3.) ** (len(self.levels) - 1 - j))))
+
+    def _compress(self):
+        '''While the sketch holds more values than its total capacity, compact the lowest level that is over its capacity: sort it, and promote every other value to the level above'''
+        while sum(len(level) for level in self.levels) > sum(self._capacity(j) for j in range(len(self.levels))):
+            j = [len(level) >= self._capacity(j) for j, level in enumerate(self.levels)].index(True)
+            if j + 1 == len(self.levels):
+                self.levels.append(np.empty((0,) + self.shape))
+                self._offsets.append(0)
+            level = np.sort(self.levels[j], axis=0)
+            m = len(level) - len(level) % 2
+            self.levels[j + 1] = np.concatenate((self.levels[j + 1], level[self._offsets[j]:m:2]))
+            self.levels[j] = level[m:]
+            self._offsets[j] = 1 - self._offsets[j] # alternate which half is promoted, so the sketch isn't biased
+
+    def add(self, x):
+        '''Fold in one array of observations'''
+        self.levels[0] = np.concatenate((self.levels[0], np.asarray(x, dtype=float)[None]))
+        self._compress()
+
+    def merge(self, other):
+        '''Fold another sketch of the same shape into this one'''
+        for j, level in enumerate(other.levels):
+            if j == len(self.levels):
+                self.levels.append(np.empty((0,) + self.shape))
+                self._offsets.append(0)
+            self.levels[j] = np.concatenate((self.levels[j], level))
+        self._compress()
+
+    def quantile(self, p):
+        '''Returns the estimate of quantile p of every cell'''
+        if len(self.levels) == 1: # nothing has been compacted yet, so the sketch holds every value
+            if not len(self.levels[0]):
+                return np.full(self.shape, np.nan)
+            return np.quantile(self.levels[0], p, axis=0)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2. ** j) for j, level in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        weights = weights[order]
+        ranks = np.cumsum(weights, axis=0) - weights / 2 # each value sits in the middle of the ranks that it stands for
+        target = p * ranks[-1] + p * weights[-1] / 2 # (so that p = 0 and p = 1 give the minimum and maximum kept)
+        upper = np.clip(np.argmax(ranks >= target, axis=0), 1, len(values) - 1)[None]
+        lower = upper - 1
+        r0, r1 = np.take_along_axis(ranks, lower, axis=0)[0], np.take_along_axis(ranks, upper, axis=0)[0]
+        v0, v1 = np.take_along_axis(values, lower, axis=0)[0], np.take_along_axis(values, upper, axis=0)[0]
+        return v0 + (v1 - v0) * np.clip((target - r0) / (r1 - r0), 0, 1) # interpolate between the two values around the target rank
+
+    def to_arrays(self, prefix):
+        '''Returns the state of the sketch as a dict of arrays, with keys starting with prefix'''
+        arrays = dict(("%s%d" % (prefix, j), level) for j, level in enumerate(self.levels))
+        arrays["%soffsets" % prefix] = np.array(self._offsets)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, shape, k=SKETCHSIZE):
+        '''Make a sketch from the dict of arrays written by to_arrays()'''
+        sketch = cls(shape, k)
+        sketch._offsets = [int(offset) for offset in arrays["%soffsets" % prefix]]
+        sketch.levels = [arrays["%s%d" % (prefix, j)] for j in range(len(sketch._offsets))]
+        return sketch
+
+
+class RunningStats(object):
+    '''Online (one pass, constant memory) count, mean, variance, minimum, maximum and (optionally) quantiles of every cell of a stream of equally shaped arrays'''
+    def __init__(self, shape, quantiles=(), sketchsize=SKETCHSIZE):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape) # sum of squared differences from the mean (Welford's algorithm)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.quantiles = tuple(quantiles)
+        self.sketch = QuantileSketch(shape, sketchsize) if self.quantiles else None
+
+    def add(self, x):
+        '''Fold in one array of observations'''
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+        if self.sketch is not None:
+            self.sketch.add(x)
+
+    def merge(self, other):
+        '''Fold the accumulators of another RunningStats of the same shape into this one'''
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self.m2 += other.m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+    def variance(self):
+        '''Returns the sample variance of every cell'''
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full(self.shape, np.nan)
+
+    def quantile(self, p):
+        '''Returns the estimate of quantile p of every cell'''
+        return self.sketch.quantile(p)
+
+    def summary(self, names):
+        '''Returns the summary statistics of 2D arrays as a pandas DataFrame, with a row per row of the arrays (year) and a column per statistic of each of the columns, which are called names'''
+        columns = {}
+        sd = np.sqrt(self.variance())
+        quantiles = [(p, self.quantile(p)) for p in self.quantiles]
+        for j, name in enumerate(names):
+            columns["%s mean" % name] = self.mean[:, j]
+            columns["%s sd" % name] = sd[:, j]
+            columns["%s min" % name] = self.min[:, j]
+            columns["%s max" % name] = self.max[:, j]
+            for p, values in quantiles:
+                columns["%s q%g" % (name, p)] = values[:, j]
+        return pd.DataFrame(columns)
+
+    def to_arrays(self, prefix):
+        '''Returns the state of the accumulators as a dict of arrays, with keys starting with prefix'''
+        arrays = {prefix + "count": np.array(self.count), prefix + "mean": self.mean, prefix + "m2": self.m2, prefix + "min": self.min, prefix + "max": self.max, prefix + "quantiles": np.array(self.quantiles, dtype=float)}
+        if self.sketch is not None:
+            arrays[prefix + "sketchsize"] = np.array(self.sketch.k)
+            arrays.update(self.sketch.to_arrays(prefix + "sketch"))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        '''Make a RunningStats from the dict of arrays written by to_arrays()'''
+        quantiles = tuple(float(p) for p in arrays[prefix + "quantiles"])
+        sketchsize = int(arrays[prefix + "sketchsize"]) if quantiles else SKETCHSIZE
+        stats = cls(arrays[prefix + "mean"].shape, quantiles, sketchsize)
+        stats.count = int(arrays[prefix + "count"])
+        stats.mean, stats.m2, stats.min, stats.max = (np.array(arrays[prefix + name]) for name in ("mean", "m2", "min", "max"))
+        if quantiles:
+            stats.sketch = QuantileSketch.from_arrays(arrays, prefix + "sketch", stats.shape, sketchsize)
+        return stats
+
+
+class ExperimentSummary(object):
+    '''The summary statistics of all the repetitions of one experiment: RunningStats of the general stats (with quantiles), and of the patch density and domestic proportion time series (without)'''
+    def __init__(self, years, patches, quantiles=QUANTILES, sketchsize=SKETCHSIZE):
+        self.general = RunningStats((int(years) + 1, len(GENERAL_STATS) - 1), quantiles, sketchsize) # (the Year column is left out)
+        self.density = RunningStats((int(years) + 1, int(patches)))
+        self.proportion = RunningStats((int(years) + 1, int(patches)))
+        self.labels = set() # the labels of the runs folded in with fold()
+
+    @property
+    def count(self):
+        return self.general.count
+
+    def add(self, recorder):
+        '''Fold in the output of one run, a recorders.Recorder'''
+        stats = recorder.stats
+        self.general.add(stats.view(np.float64).reshape(len(stats), -1)[:, 1:])
+        if self.density.shape[1] and recorder.density is not None: # (a summary without patches, see summary_patches(), leaves out the patch time series)
+            self.density.add(recorder.density)
+            self.proportion.add(recorder.proportion)
+
+    def merge(self, other):
+        '''Fold another ExperimentSummary of the same experiment into this one'''
+        self.general.merge(other.general)
+        self.density.merge(other.density)
+        self.proportion.merge(other.proportion)
+        self.labels |= other.labels
+
+    def save(self, filename):
+        '''Save the accumulators to the .npz file filename, so that more runs can be folded in later'''
+        arrays = {}
+        for name in ("general", "density", "proportion"):
+            arrays.update(getattr(self, name).to_arrays(name + "_"))
+        arrays["labels"] = np.array(sorted(self.labels), dtype=str)
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        '''Load the accumulators from the .npz file filename'''
+        summary = cls.__new__(cls)
+        with np.load(filename) as data:
+            arrays = dict(data)
+        for name in ("general", "density", "proportion"):
+            setattr(summary, name, RunningStats.from_arrays(arrays, name + "_"))
+        summary.labels = set(str(label) for label in arrays.get("labels", ()))
+        return summary
+
+    def write_csv(self, experiment, path=None):
+        '''Write the summary statistics of experiment number experiment into path (default is the current working directory): the general stats summary, and the mean and standard deviation of the patch density and domestic proportion of every patch in every year (laid out like the patch CSV files of a single run)'''
+        path = os.getcwd() if path is None else path
+        self.general.summary([name for name, header in GENERAL_STATS[1:]]).to_csv(os.path.join(path, "Experiment%s_summary.csv" % experiment), index_label="Year", float_format='%.5f')
+        if self.density.count == 0:
+            return
+        for name, stats in (("millet_patch_density", self.density), ("millet_patch_domestic_proportion", self.proportion)):
+            Recorder.patch_stats(stats.mean).to_csv(os.path.join(path, "Experiment%s_%s_mean.csv" % (experiment, name)), float_format='%.5f')
+            Recorder.patch_stats(np.sqrt(stats.variance())).to_csv(os.path.join(path, "Experiment%s_%s_sd.csv" % (experiment, name)), float_format='%.5f')
+
+
+def summary_patches(p):
+    '''Returns the number of patches whose time series the ExperimentSummary of the runs with the model parameters p keeps: all the Cereal patches, or none on the compact Landscape, whose runs of patches would have to be expanded into full (Years+1) x Cereal arrays to be summarized'''
+    return 0 if p['Landscape'] == "compact" else p['Cereal']
+
+
+def fold(filename, recorder, years, patches, label=None):
+    '''Fold the output of one run (a recorders.Recorder) into the ExperimentSummary saved in filename (starting a new one if there is none yet), under an exclusive lock so that several processes can fold into the same file. years and patches size a new summary. If label (the run label) is given and a run of that label has already been folded in, the run is left out. Returns True if the run was folded in'''
+    from store import lock, unlock
+    handle = lock(filename)
+    try:
+        summary = ExperimentSummary.load(filename) if os.path.exists(filename) else ExperimentSummary(years, patches)
+        if label is not None:
+            if label in summary.labels:
+                return False
+            summary.labels.add(label)
+        summary.add(recorder)
+        tmp = filename + '.tmp'
+        summary.save(tmp)
+        os.replace(tmp, filename)
+    finally:
+        unlock(handle)
+    return True
@@ -0,0 +1,229 @@
+#!usr/bin/python
+
+# Shared task queue for sweeps across several machines
+############################
+# A durable queue of the runs of a sweep in one SQLite file, so that worker processes on any number of machines that share a filesystem can work through the same sweep, with no server or message broker. parallelizer.py (with mode = "queue") puts the experiments list and the runs of every experiment into the queue, along with where their output should go, and then works on it itself; every other machine joins in with
+#     python3 taskqueue.py sweep.db --work [--processes N]
+# Each worker claims the longest pending run (by scheduler.predicted_cost()) under a lease, and keeps renewing the lease while the run is going. A run whose lease runs out (because its worker or its machine died) goes back to pending, and is picked up by another worker. A run that fails is retried up to "retries" times, and then marked as failed. Runs that are already in the queue are left as they are when a sweep is submitted again, so finished runs are never rerun (but failed ones are retried).
+# The output of each run is written by the worker that ran it, to the CSV files (in the directory of the sweep), the sweep store, or the summary file of its experiment, as parallelizer.py asked for. The filesystem has to support file locking (e.g. NFSv4, Lustre, GPFS, BeeGFS, or any local disk), as SQLite and the sweep store both rely on it, and the clocks of the machines should agree to well within the lease time. Run this script without --work to see how far along a sweep is:
+#     python3 taskqueue.py sweep.db [--failed]
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+
+LEASE = 120. # Default lease time of a claimed run, in seconds. The lease is renewed every third of this while the run is going
+RETRIES = 1 # Default number of times a failed run is retried
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS experiments (number INTEGER PRIMARY KEY, params TEXT, repetitions INTEGER);
+CREATE TABLE IF NOT EXISTS tasks (label TEXT PRIMARY KEY, experiment INTEGER, params TEXT, seed INTEGER, cost REAL,
+    state TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, worker TEXT, lease REAL, error TEXT);
+CREATE INDEX IF NOT EXISTS pending ON tasks (state, cost);
+'''
+
+
+def worker_name():
+    '''Returns a name for this worker process that is unique across the machines'''
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+
+class TaskQueue(object):
+    '''The task queue in the SQLite file path (created if needed)'''
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=600., isolation_level=None) # transactions are begun explicitly
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, statements):
+        '''Run statements(cursor) in one transaction that holds the write lock from the start, and return what it returns'''
+        cursor = self.db.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(cursor)
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+        return result
+
+    def settings(self):
+        '''Returns the settings of the sweep (where and how to write the output of each run) as a dict'''
+        return dict((name, json.loads(value)) for name, value in self.db.execute('SELECT name, value FROM settings'))
+
+    def submit(self, tasks, experiments, settings):
+        '''Add tasks (dicts with the "experiment", "params", "seed" and "label" of each run) and experiments (dicts with the "number", "params" and repetition "labels" of each experiment) to the queue, leaving out the runs that are already in it (but putting the ones among them that failed back to pending), and set the settings of the sweep (a dict of JSON values). Returns the number of runs added'''
+        from scheduler import predicted_cost
+
+        def statements(cursor):
+            cursor.executemany('INSERT OR REPLACE INTO settings VALUES (?, ?)', [(name, json.dumps(value)) for name, value in settings.items()])
+            cursor.executemany('INSERT OR IGNORE INTO experiments VALUES (?, ?, ?)', [(experiment["number"], json.dumps(experiment["params"]), len(experiment["labels"])) for experiment in experiments])
+            before = cursor.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            cursor.executemany("UPDATE tasks SET state = 'pending', attempts = 0 WHERE label = ? AND state = 'failed'", [(task["label"],) for task in tasks]) # give the runs that failed last time another go
+            cursor.executemany('INSERT OR IGNORE INTO tasks (label, experiment, params, seed, cost) VALUES (?, ?, ?, ?, ?)', [(task["label"], task["experiment"], json.dumps(task["params"]), task["seed"], predicted_cost(task["params"])) for task in tasks])
+            return cursor.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+        return self._transaction(statements)
+
+    def claim(self, worker, lease=LEASE, retries=RETRIES):
+        '''Claim the longest pending run for worker, for lease seconds. First puts the runs whose leases have run out back to pending (or marks them as failed, if they have used up their retries). Returns the claimed task as a dict, or None if there are no pending runs'''
+        def statements(cursor):
+            now = time.time()
+            cursor.execute("UPDATE tasks SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, attempts = attempts + 1, error = 'lease of ' || worker || ' ran out' WHERE state = 'running' AND lease < ?", (retries, now))
+            row = cursor.execute("SELECT label, experiment, params, seed FROM tasks WHERE state = 'pending' ORDER BY cost DESC, rowid LIMIT 1").fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE tasks SET state = 'running', worker = ?, lease = ? WHERE label = ?", (worker, now + lease, row[0]))
+            return {"label": row[0], "experiment": row[1], "params": json.loads(row[2]), "seed": row[3]}
+        return self._transaction(statements)
+
+    def renew(self, label, worker, lease=LEASE):
+        '''Extend worker's lease on the run called label. Returns False if worker doesn't hold it any more'''
+        return self._transaction(lambda cursor: cursor.execute("UPDATE tasks SET lease = ? WHERE label = ? AND worker = ? AND state = 'running'", (time.time() + lease, label, worker)).rowcount == 1)
+
+    def complete(self, label, worker):
+        '''Mark the run called label, held by worker, as done. Returns False if worker doesn't hold it any more'''
+        return self._transaction(lambda cursor: cursor.execute("UPDATE tasks SET state = 'done', lease = NULL, error = NULL WHERE label = ? AND worker = ? AND state = 'running'", (label, worker)).rowcount == 1)
+
+    def fail(self, label, worker, error, retries=RETRIES):
+        '''Put the run called label, held by worker, back to pending after it failed with error, or mark it as failed if it has used up its retries'''
+        self._transaction(lambda cursor: cursor.execute("UPDATE tasks SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, attempts = attempts + 1, lease = NULL, error = ? WHERE label = ? AND worker = ? AND state = 'running'", (retries, str(error), label, worker)))
+
+    def counts(self):
+        '''Returns the number of runs in each state'''
+        counts = dict((state, 0) for state in ('pending', 'running', 'done', 'failed'))
+        counts.update(self.db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+        return counts
+
+    def failed(self):
+        '''Returns the (label, error) of every failed run'''
+        return self.db.execute("SELECT label, error FROM tasks WHERE state = 'failed' ORDER BY rowid").fetchall()
+
+
+def _heartbeat(path, label, worker, lease, stop):
+    '''Renew worker's lease on the run called label every third of the lease time, until stop is set'''
+    queue = TaskQueue(path) # (a connection of its own, as SQLite connections can't be shared between threads)
+    try:
+        while not stop.wait(lease / 3.):
+            queue.renew(label, worker, lease)
+    finally:
+        queue.close()
+
+
+def write_output(task, recorder, settings):
+    '''Write out the output of a run as the settings of the sweep ask: fold it into the summary file of its experiment, append it to the sweep store, or write its CSV files into the directory of the sweep. The profile report of a profiled run is written there too'''
+    path = settings["path"]
+    start = time.perf_counter()
+    if settings.get("reduce"):
+        from summaries import fold, summary_patches
+        from AgModel_headless import model_parameters
+        p = model_parameters(task["params"])
+        fold(os.path.join(path, "Experiment%s_summary.npz" % task["experiment"]), recorder, p['Years'], summary_patches(p), task["label"]) # (by label, so that a run that is rerun after its worker died between folding it in and completing it is only counted once)
+    elif settings.get("store") is not None:
+        from store import SweepStore
+        with SweepStore(os.path.join(path, settings["store"]), 'a') as out: # (only held open for this one run, so that other workers can append too)
+            out.put(task["label"], recorder)
+    else:
+        recorder.write_csv(task["label"], path=path, patches=settings.get("patches"), every=settings.get("every", 1))
+    if getattr(recorder, "profile", None) is not None:
+        from profiling import write_report
+        recorder.profile["phases"]["output"] += time.perf_counter() - start
+        write_report(recorder.profile, task["label"], path)
+
+
+def work(path, lease=None, retries=None, wait=5.):
+    '''Work on the runs in the task queue path until there are none left pending or running, checking for runs whose leases run out every wait seconds in the meantime. lease and retries default to the ones in the settings of the sweep. Returns the number of runs this worker finished'''
+    from AgModel_headless import run_simulation
+    worker = worker_name()
+    queue = TaskQueue(path)
+    settings = queue.settings()
+    simulate = lambda params, seed: run_simulation(params, seed, settings.get("profile", False))
+    lease = settings.get("lease", LEASE) if lease is None else lease
+    retries = settings.get("retries", RETRIES) if retries is None else retries
+    cache = None
+    if settings.get("cache") is not None:
+        from cache import ResultCache
+        cache = ResultCache(settings["cache"], None if settings.get("cachesize") is None else int(settings["cachesize"] * 1024**3))
+    finished = 0
+    try:
+        while True:
+            task = queue.claim(worker, lease, retries)
+            if task is None:
+                counts = queue.counts()
+                if not counts['running']:
+                    break
+                time.sleep(wait) # other workers are still running, and one of them might die
+                continue
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat, args=(path, task["label"], worker, lease, stop), daemon=True)
+            heartbeat.start()
+            try:
+                if cache is not None:
+                    recorder = cache.run(task["params"], task["seed"], simulate)[0]
+                else:
+                    recorder = simulate(task["params"], task["seed"])
+                stop.set()
+                heartbeat.join()
+                if not queue.renew(task["label"], worker, lease):
+                    print("Lost the lease on run %s, leaving it to another worker" % task["label"])
+                    continue
+                write_output(task, recorder, settings)
+            except Exception as error:
+                stop.set()
+                heartbeat.join()
+                print("Run %s failed (%r)" % (task["label"], error))
+                queue.fail(task["label"], worker, repr(error), retries)
+                continue
+            if queue.complete(task["label"], worker):
+                finished += 1
+                print("Finished run %s" % task["label"])
+    finally:
+        queue.close()
+    return finished
+
+
+def _work(args):
+    return work(*args)
+
+
+def work_in_parallel(path, processes=None, lease=None, retries=None):
+    '''Work on the task queue path with processes worker processes on this machine (None for one per CPU), until it is done. Returns the number of runs they finished'''
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return work(path, lease, retries)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    with context.Pool(processes) as pool:
+        return sum(pool.map(_work, [(path, lease, retries)] * processes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Work on, or show the progress of, the shared task queue of a sweep (see the "queue" mode of parallelizer.py)')
+    parser.add_argument('queue', metavar='FILE', help='The task queue file (e.g. sweep.db)')
+    parser.add_argument('--work', action='store_true', help='Work on the runs in the queue until it is done')
+    parser.add_argument('--processes', metavar='N', type=int, default=None, help='Number of worker processes to start on this machine (default one per CPU)')
+    parser.add_argument('--lease', metavar='SECONDS', type=float, default=None, help='Lease time of a claimed run (default the one the sweep was submitted with). A run whose worker hasn\'t renewed its lease for this long is given to another worker')
+    parser.add_argument('--retries', metavar='N', type=int, default=None, help='Number of times to retry a failed run (default the number the sweep was submitted with)')
+    parser.add_argument('--failed', action='store_true', help='List the failed runs, and why they failed')
+    args = parser.parse_args()
+    if args.work:
+        print("Finished %s runs" % work_in_parallel(args.queue, args.processes, args.lease, args.retries))
+    with TaskQueue(args.queue) as queue:
+        print(", ".join("%s %s" % (count, state) for state, count in queue.counts().items()))
+        if args.failed:
+            for label, error in queue.failed():
+                print("%s: %s" % (label, error))